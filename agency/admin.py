@@ -1,10 +1,87 @@
+from django import forms
 from django.contrib import admin
+from django.contrib.admin.widgets import SELECT2_TRANSLATIONS
+from django.utils import timezone
+from django.utils.translation import get_language
 from django.utils.safestring import mark_safe
 
+from .cdn import purge_trips
+from .images import variant_url
 from .models import (
     Trip, TripPhoto, ProgramByDay, IncludedFeature,
-    TripDate, TripRequest, FAQ, Sociallink, Review
+    TripDate, TripRequest, NotificationOutbox, FAQ, Sociallink, Review, SpamRule
 )
+from .pagination import EstimatedCountPaginator
+from .spam import learn
+
+
+class TripAutocompleteFilter(admin.SimpleListFilter):
+    """
+    Trip filter with a search box over the trip autocomplete instead of
+    a link per trip: only the selected trip is loaded.
+    """
+    title = "Тур"
+    parameter_name = 'trip__id__exact'
+    template = 'admin/agency/trip_autocomplete_filter.html'
+
+    def __init__(self, request, params, model, model_admin):
+        super().__init__(request, params, model, model_admin)
+        self.app_label = model._meta.app_label
+        self.model_name = model._meta.model_name
+
+    def lookups(self, request, model_admin):
+        value = self.value()
+        if not value or not value.isdigit():
+            return []
+        return list(Trip.objects.filter(pk=value).values_list('pk', 'title'))
+
+    def has_output(self):
+        return True
+
+    def choices(self, changelist):
+        # The placeholder is swapped for the picked trip id in trip_filter.js
+        self.select_query_string = changelist.get_query_string({self.parameter_name: '__trip__'})
+        self.clear_query_string = changelist.get_query_string(remove=[self.parameter_name])
+        yield {
+            'selected': self.value() is None,
+            'query_string': self.clear_query_string,
+            'display': "Все",
+        }
+
+    def queryset(self, request, queryset):
+        value = self.value()
+        if value:
+            return queryset.filter(trip_id=value)
+        return queryset
+
+
+class TripChildAdmin(admin.ModelAdmin):
+    """
+    Changelist of rows belonging to a trip: the trip is joined in one
+    query, picked through autocomplete and big tables aren't fully counted.
+    """
+    list_select_related = ('trip', )
+    autocomplete_fields = ('trip', )
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    @property
+    def media(self):
+        i18n_file = SELECT2_TRANSLATIONS.get(get_language())
+        return super().media + forms.Media(
+            js=(
+                'admin/js/vendor/jquery/jquery.min.js',
+                'admin/js/vendor/select2/select2.full.min.js',
+                *((f'admin/js/vendor/select2/i18n/{i18n_file}.js', ) if i18n_file else ()),
+                'admin/js/jquery.init.js',
+                'admin/js/autocomplete.js',
+                'agency/admin/trip_filter.js',
+            ),
+            css={'screen': (
+                'admin/css/vendor/select2/select2.min.css',
+                'admin/css/autocomplete.css',
+            )},
+        )
 
 
 class TripPhotoInline(admin.TabularInline):
@@ -15,7 +92,7 @@ class TripPhotoInline(admin.TabularInline):
 
     def photo_preview(self, obj):
         if obj.photo:
-            return mark_safe(f'<img src="{obj.photo.url}" style="max-height: 100px;" />')
+            return mark_safe(f'<img src="{variant_url(obj.variants) or obj.photo.url}" style="max-height: 100px;" />')
         return "Нет фото"
     photo_preview.allow_tags = True
     photo_preview.short_description = "Предпросмотр"
@@ -50,8 +127,9 @@ class TripAdmin(admin.ModelAdmin):
     list_display = ('status', 'title', 'country', 'duration_days', 'group_size', 'created_at')
     readonly_fields = ('created_at', )
     list_filter = ('status', 'country', 'duration_days', 'group_size')
-    search_fields = ('title', 'description', 'destination')
+    search_fields = ('title', 'description', 'welcome_message')
     prepopulated_fields = {'slug': ('title', )}
+    actions = ['purge_cdn']
     inlines = [
         TripPhotoInline,
         ProgramByDayInline,
@@ -72,17 +150,22 @@ class TripAdmin(admin.ModelAdmin):
         }),
     )
 
+    # Edits purge on their own, this is for pages the CDN got wrong otherwise
+    def purge_cdn(self, request, queryset):
+        purge_trips(queryset.values_list('pk', flat=True))
+    purge_cdn.short_description = "Сбросить кэш CDN"
+
 
 @admin.register(TripPhoto)
-class TripPhotoAdmin(admin.ModelAdmin):
+class TripPhotoAdmin(TripChildAdmin):
     list_display = ('trip', 'type', 'photo_preview', 'caption')
-    list_filter = ('type', )
+    list_filter = (TripAutocompleteFilter, 'type')
     search_fields = ('trip__title', 'caption')
     readonly_fields = ('photo_preview', )
 
     def photo_preview(self, obj):
         if obj.photo:
-            return mark_safe(f'<img src="{obj.photo.url}" style="max-height: 100px;" />')
+            return mark_safe(f'<img src="{variant_url(obj.variants) or obj.photo.url}" style="max-height: 100px;" />')
         return "Нет фото"
 
     photo_preview.allow_tags = True
@@ -90,23 +173,23 @@ class TripPhotoAdmin(admin.ModelAdmin):
 
 
 @admin.register(ProgramByDay)
-class ProgramByDayAdmin(admin.ModelAdmin):
+class ProgramByDayAdmin(TripChildAdmin):
     list_display = ('trip', 'day_number', 'title', 'accommodation')
-    list_filter = ('trip', 'day_number')
+    list_filter = (TripAutocompleteFilter, 'day_number')
     search_fields = ('trip__title', 'title', 'description')
 
 
 @admin.register(IncludedFeature)
-class IncludedFeatureAdmin(admin.ModelAdmin):
+class IncludedFeatureAdmin(TripChildAdmin):
     list_display = ('trip', 'title', 'icon')
-    list_filter = ('trip', )
+    list_filter = (TripAutocompleteFilter, )
     search_fields = ('trip__title', 'title', 'description')
 
 
 @admin.register(TripDate)
-class TripDateAdmin(admin.ModelAdmin):
+class TripDateAdmin(TripChildAdmin):
     list_display = ('trip', 'start_date', 'end_date', 'price', 'available_spots', 'is_special_offer')
-    list_filter = ('trip', 'start_date', 'is_special_offer')
+    list_filter = (TripAutocompleteFilter, 'start_date', 'is_special_offer')
     search_fields = ('trip__title', )
 
     def available_spots(self, obj):
@@ -115,26 +198,48 @@ class TripDateAdmin(admin.ModelAdmin):
 
 
 @admin.register(TripRequest)
-class TripRequestAdmin(admin.ModelAdmin):
-    list_display = ('trip', 'name', 'phone', 'preferred_contact', 'created_at', 'is_spam')
-    list_filter = ('trip', 'preferred_contact', 'is_spam')
+class TripRequestAdmin(TripChildAdmin):
+    list_display = ('trip', 'name', 'phone', 'preferred_contact', 'created_at', 'is_spam', 'spam_score')
+    list_filter = (TripAutocompleteFilter, 'preferred_contact', 'is_spam', 'spam_reviewed')
     search_fields = ('trip__title', 'name', 'phone', 'email')
-    readonly_fields = ('created_at', )
+    readonly_fields = ('created_at', 'spam_score', 'spam_reviewed')
     actions = ['mark_as_spam', 'mark_as_not_spam']
 
+    # Both marks also train the spam scorer, see agency.spam.learn
     def mark_as_spam(self, request, queryset):
-        queryset.update(is_spam=True)
+        learn(queryset, is_spam=True)
     mark_as_spam.short_description = "Пометить как спам"
 
     def mark_as_not_spam(self, request, queryset):
-        queryset.update(is_spam=False)
+        learn(queryset, is_spam=False)
     mark_as_not_spam.short_description = "Снять пометку спама"
 
 
+@admin.register(SpamRule)
+class SpamRuleAdmin(admin.ModelAdmin):
+    list_display = ('pattern', 'kind', 'field', 'weight', 'is_active')
+    list_editable = ('weight', 'is_active')
+    list_filter = ('kind', 'field', 'is_active')
+    search_fields = ('pattern', )
+
+
+@admin.register(NotificationOutbox)
+class NotificationOutboxAdmin(admin.ModelAdmin):
+    list_display = ('trip_request', 'status', 'attempts', 'next_attempt_at', 'sent_at', 'created_at')
+    list_filter = ('status', )
+    list_select_related = ('trip_request__trip', )
+    readonly_fields = ('trip_request', 'text', 'attempts', 'last_error', 'created_at', 'sent_at')
+    actions = ['requeue']
+
+    def requeue(self, request, queryset):
+        queryset.exclude(status='sent').update(status='pending', attempts=0, next_attempt_at=timezone.now())
+    requeue.short_description = "Отправить повторно"
+
+
 @admin.register(FAQ)
-class FAQAdmin(admin.ModelAdmin):
+class FAQAdmin(TripChildAdmin):
     list_display = ('trip', 'question', 'order')
-    list_filter = ('trip', )
+    list_filter = (TripAutocompleteFilter, )
     search_fields = ('trip__title', 'question', 'answer')
 
 
@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class AgencyConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "agency"
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from . import signals  # noqa: F401
+        from . import metrics, slow_queries
+
+        # In this order: the slow-query timing doesn't include the metrics'
+        connection_created.connect(metrics.install_execute_wrapper, dispatch_uid="agency.metrics")
+        connection_created.connect(slow_queries.install_execute_wrapper, dispatch_uid="agency.slow_queries")
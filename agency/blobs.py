@@ -0,0 +1,213 @@
+"""
+Reference counts of stored media files.
+
+A row references its file and every variant built from it. Counts move
+in the transaction that saves or deletes the row, see agency.signals;
+`recount()` rebuilds them from the rows, like reconcile_seats does for
+booked seats.
+"""
+import datetime
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Now
+from django.utils import timezone
+
+
+def get_media_models():
+    """
+    Models with media and the field holding the original.
+    """
+    from .models import Review, TripPhoto
+
+    return {TripPhoto: 'photo', Review: 'avatar'}
+
+
+def references(name, variants):
+    """
+    Names a row with file `name` and `variants` keeps alive.
+    """
+    names = {name} if name else set()
+    for entry in (variants or {}).values():
+        if isinstance(entry, dict):
+            names.update(value for key, value in entry.items() if key != 'width' and value)
+    return names
+
+
+def instance_references(instance):
+    field_name = get_media_models()[type(instance)]
+    return references(getattr(instance, field_name).name, instance.variants)
+
+
+def stored_size(name):
+    try:
+        return default_storage.size(name)
+    except (OSError, ValueError):
+        # Rows may point at files that were never uploaded here
+        return 0
+
+
+def _change(counts, sign):
+    from .models import MediaBlob
+
+    counts = +Counter(counts)
+    if not counts:
+        return
+    if sign > 0:
+        known = set(MediaBlob.objects.filter(name__in=list(counts)).values_list('name', flat=True))
+        # Created at zero and counted below with the rest, so a row
+        # inserted concurrently can't swallow this count
+        MediaBlob.objects.bulk_create(
+            [MediaBlob(name=name, size=stored_size(name)) for name in counts if name not in known],
+            ignore_conflicts=True,
+        )
+    # One UPDATE per distinct change, however many names
+    by_amount = defaultdict(list)
+    for name, amount in counts.items():
+        by_amount[amount].append(name)
+    for amount, names in by_amount.items():
+        queryset = MediaBlob.objects.filter(name__in=names)
+        if sign < 0:
+            queryset = queryset.filter(ref_count__gte=amount)
+        queryset.update(ref_count=F('ref_count') + sign * amount, updated_at=Now())
+
+
+def add_references(names):
+    _change(names, +1)
+
+
+def release_references(names):
+    _change(names, -1)
+
+
+def replace_references(old, new):
+    old, new = set(old), set(new)
+    release_references(old - new)
+    add_references(new - old)
+
+
+def count_references():
+    """
+    {name: count} over every row with media.
+    """
+    counts = Counter()
+    for model, field_name in get_media_models().items():
+        for name, variants in model.objects.values_list(field_name, 'variants').iterator():
+            counts.update(references(name, variants))
+    return counts
+
+
+def recount():
+    """
+    Sets every count from the rows. Returns how many were wrong.
+    """
+    from .models import MediaBlob
+
+    with transaction.atomic():
+        counts = count_references()
+        stored = dict(MediaBlob.objects.select_for_update().values_list('name', 'ref_count'))
+        drifted = {name: count for name, count in counts.items() if stored.get(name) != count}
+        drifted.update({name: 0 for name, count in stored.items() if count and name not in counts})
+
+        MediaBlob.objects.bulk_create(
+            [MediaBlob(name=name, size=stored_size(name)) for name in drifted if name not in stored],
+            ignore_conflicts=True,
+        )
+        by_count = defaultdict(list)
+        for name, count in drifted.items():
+            by_count[count].append(name)
+        for count, names in by_count.items():
+            MediaBlob.objects.filter(name__in=names).update(ref_count=count, updated_at=Now())
+    return len(drifted)
+
+
+def iter_stored_blobs():
+    # Storages that aren't content-addressed have no blobs to scan
+    iter_blobs = getattr(default_storage, 'iter_blobs', None)
+    return iter_blobs() if iter_blobs is not None else iter(())
+
+
+def get_grace():
+    return datetime.timedelta(hours=getattr(settings, 'MEDIA_GC_GRACE_HOURS', 24))
+
+
+def find_garbage(now=None, grace=None):
+    """
+    (name, size) of blobs no row has used for the grace period: counted
+    blobs down to zero and stored blobs that were never counted, e.g. an
+    upload whose row wasn't saved. Files outside the blob prefix are only
+    removed once counted, see recount().
+    """
+    from .models import MediaBlob
+
+    cutoff = (now or timezone.now()) - (grace if grace is not None else get_grace())
+    unused = dict(
+        MediaBlob.objects.filter(ref_count=0, updated_at__lt=cutoff).values_list('name', 'size')
+    )
+    counted = set(MediaBlob.objects.values_list('name', flat=True))
+
+    garbage = []
+    for name, size, modified in iter_stored_blobs():
+        # A blob uploaded again within the grace period is fresh again
+        if modified >= cutoff:
+            unused.pop(name, None)
+        elif name not in counted:
+            garbage.append((name, size))
+    return garbage + list(unused.items())
+
+
+def collect_garbage(now=None, grace=None, dry_run=False):
+    """
+    Deletes unused blobs, returns their (name, size).
+    """
+    from .models import MediaBlob
+
+    now = now or timezone.now()
+    grace = grace if grace is not None else get_grace()
+    cutoff = now - grace
+    garbage = find_garbage(now, grace)
+    if dry_run:
+        return garbage
+
+    deleted = []
+    for name, size in garbage:
+        with transaction.atomic():
+            # Skips blobs that were used again since they were found
+            row = MediaBlob.objects.select_for_update().filter(name=name).first()
+            if row is not None and row.ref_count:
+                continue
+            if row is None and default_storage.get_modified_time(name) >= cutoff:
+                continue
+            default_storage.delete(name)
+            if row is not None:
+                row.delete()
+        deleted.append((name, size))
+    return deleted
+
+
+def usage():
+    """
+    Stored and referenced bytes, and what deduplication saves.
+    """
+    from .models import MediaBlob
+
+    blobs = MediaBlob.objects.all()
+    used = blobs.filter(ref_count__gt=0).aggregate(
+        count=Count('name'), stored=Sum('size'), logical=Sum(F('size') * F('ref_count')),
+    )
+    unused = blobs.filter(ref_count=0).aggregate(count=Count('name'), stored=Sum('size'))
+    counted = set(blobs.values_list('name', flat=True))
+    untracked = [size for name, size, _ in iter_stored_blobs() if name not in counted]
+    return {
+        'blobs': used['count'] or 0,
+        'stored_bytes': used['stored'] or 0,
+        'referenced_bytes': used['logical'] or 0,
+        'saved_bytes': (used['logical'] or 0) - (used['stored'] or 0),
+        'unused_blobs': unused['count'] or 0,
+        'unused_bytes': unused['stored'] or 0,
+        'untracked_blobs': len(untracked),
+        'untracked_bytes': sum(untracked),
+    }
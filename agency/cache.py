@@ -0,0 +1,256 @@
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags, quote_etag
+
+from .cdn import schedule_purge
+
+
+KEY_PREFIX = "agency"
+CATALOGUE_VERSION_KEY = f"{KEY_PREFIX}:trips:version"
+# When a trip was last deleted: it leaves no updated_at behind
+TRIP_DELETED_AT_KEY = f"{KEY_PREFIX}:trips:deleted_at"
+_local = threading.local()
+
+STATS_KEYS = {
+    "hits": f"{KEY_PREFIX}:stats:hits",
+    "misses": f"{KEY_PREFIX}:stats:misses",
+}
+
+
+def get_cache():
+    return caches[getattr(settings, "TRIP_CACHE_ALIAS", "default")]
+
+
+def get_timeout():
+    return getattr(settings, "TRIP_CACHE_TIMEOUT", 60 * 60)
+
+
+def trip_version_key(trip_id):
+    return f"{KEY_PREFIX}:trip:{trip_id}:version"
+
+
+def _initial_version():
+    # Time based start value, so a version key lost on eviction never
+    # comes back with a number that old entries were stored under.
+    return int(time.time() * 1000)
+
+
+def get_version(key):
+    cache = get_cache()
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _initial_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+async def aget_version(key):
+    cache = get_cache()
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, _initial_version(), timeout=None)
+        version = await cache.aget(key)
+    return version
+
+
+def bump_version(key):
+    cache = get_cache()
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Key is missing (never read or evicted)
+        version = _initial_version()
+        cache.set(key, version, timeout=None)
+        return version
+
+
+def _pending():
+    if not hasattr(_local, "keys"):
+        _local.keys = set()
+    return _local.keys
+
+
+def _bump_pending():
+    keys = set(_pending())
+    _pending().clear()
+    for key in keys:
+        bump_version(key)
+
+
+def invalidate_trip(trip_id):
+    """
+    Makes every cached response that depends on the trip stale:
+    the trip detail and the trip list, here and in the CDN.
+
+    The versions move right away and once more after commit: a response
+    or catalogue snapshot built from the old rows in between would
+    otherwise be kept under the new version.
+    """
+    keys = [CATALOGUE_VERSION_KEY] if trip_id is None else [trip_version_key(trip_id), CATALOGUE_VERSION_KEY]
+    for key in keys:
+        bump_version(key)
+    _pending().update(keys)
+    transaction.on_commit(_bump_pending)
+    schedule_purge(trip_id)
+
+
+def record_trip_deletion():
+    get_cache().set(TRIP_DELETED_AT_KEY, time.time(), timeout=None)
+
+
+def _count(name):
+    cache = get_cache()
+    key = STATS_KEYS[name]
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+async def _acount(name):
+    cache = get_cache()
+    key = STATS_KEYS[name]
+    try:
+        await cache.aincr(key)
+    except ValueError:
+        if not await cache.aadd(key, 1, timeout=None):
+            await cache.aincr(key)
+
+
+def get_cache_stats():
+    cache = get_cache()
+    return {name: cache.get(key, 0) for name, key in STATS_KEYS.items()}
+
+
+def reset_cache_stats():
+    get_cache().delete_many(list(STATS_KEYS.values()))
+
+
+def make_etag(content):
+    return quote_etag(hashlib.md5(content).hexdigest())
+
+
+def etag_matches(request, etag):
+    header = request.META.get("HTTP_IF_NONE_MATCH")
+    if not header:
+        return False
+    etags = [tag.removeprefix("W/") for tag in parse_etags(header)]
+    return "*" in etags or etag in etags
+
+
+class CachedResponseMixin:
+    """
+    Caches rendered `list` and `retrieve` responses of a viewset.
+
+    Detail keys carry the trip version, list keys carry the catalogue
+    version; both are bumped by the signal handlers in `agency.signals`,
+    so stale entries are simply never read again and expire by timeout.
+
+    `alist` and `aretrieve` do the same for the async views, see
+    `AsyncReadMixin`.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            request,
+            CATALOGUE_VERSION_KEY,
+            lambda: super(CachedResponseMixin, self).list(request, *args, **kwargs),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        return self.get_cached_response(
+            request,
+            trip_version_key(lookup),
+            lambda: super(CachedResponseMixin, self).retrieve(request, *args, **kwargs),
+        )
+
+    async def alist(self, request, *args, **kwargs):
+        return await self.aget_cached_response(
+            request,
+            CATALOGUE_VERSION_KEY,
+            lambda: super(CachedResponseMixin, self).alist(request, *args, **kwargs),
+        )
+
+    async def aretrieve(self, request, *args, **kwargs):
+        lookup = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        return await self.aget_cached_response(
+            request,
+            trip_version_key(lookup),
+            lambda: super(CachedResponseMixin, self).aretrieve(request, *args, **kwargs),
+        )
+
+    def get_cache_key(self, request, version_key, version=None):
+        variant = f"{request.accepted_media_type}|{request.get_full_path()}"
+        digest = hashlib.md5(variant.encode()).hexdigest()
+        if version is None:
+            version = get_version(version_key)
+        return f"{version_key}:{version}:{self.action}:{digest}"
+
+    def get_cached_response(self, request, version_key, build_response):
+        # The browsable API renders per-user forms, keep it out of the cache
+        if request.accepted_renderer.format == "api":
+            return build_response()
+
+        cache = get_cache()
+        key = self.get_cache_key(request, version_key)
+        entry = cache.get(key)
+
+        if entry is None:
+            _count("misses")
+            response = build_response()
+            if response.status_code != 200:
+                return response
+            entry = self.make_cache_entry(request, response)
+            cache.set(key, entry, get_timeout())
+        else:
+            _count("hits")
+            response = HttpResponse(entry["content"], content_type=entry["content_type"])
+
+        return self.get_conditional_response(request, entry, response)
+
+    async def aget_cached_response(self, request, version_key, build_response):
+        """
+        `get_cached_response` for an async `build_response`, which may
+        return None to hand the request back to the sync view.
+        """
+        cache = get_cache()
+        key = self.get_cache_key(request, version_key, await aget_version(version_key))
+        entry = await cache.aget(key)
+
+        if entry is None:
+            await _acount("misses")
+            response = await build_response()
+            if response is None or response.status_code != 200:
+                return response
+            entry = self.make_cache_entry(request, response)
+            await cache.aset(key, entry, get_timeout())
+        else:
+            await _acount("hits")
+            response = HttpResponse(entry["content"], content_type=entry["content_type"])
+
+        return self.get_conditional_response(request, entry, response)
+
+    def make_cache_entry(self, request, response):
+        response.accepted_renderer = request.accepted_renderer
+        response.accepted_media_type = request.accepted_media_type
+        response.renderer_context = self.get_renderer_context()
+        response.render()
+        return {
+            "etag": make_etag(response.content),
+            "content": response.content,
+            "content_type": response["Content-Type"],
+        }
+
+    def get_conditional_response(self, request, entry, response):
+        if etag_matches(request, entry["etag"]):
+            response = HttpResponseNotModified()
+        response["ETag"] = entry["etag"]
+        return response
@@ -0,0 +1,446 @@
+"""
+Bulk import/export of the trip catalogue.
+
+A record is one trip with its child rows:
+
+    {"slug": "iceland-winter", "title": "...", ...,
+     "trip_dates": [{"start_date": "2025-02-01", "end_date": "2025-02-08", "price": "1900"}],
+     "program_by_days": [...], "included_features": [...], "faqs": [...], "photos": [...]}
+
+JSONL has one record per line. CSV has one trip per row, child lists are
+JSON encoded in their own columns. Trips are matched by slug, child rows
+by their natural key within the trip. A missing key leaves the field or
+the child list untouched, an empty list removes every row of that kind.
+"""
+import csv
+import json
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.db.models import Q, UniqueConstraint
+from django.db.models.functions import Now
+
+from .blobs import add_references
+from .cache import invalidate_trip
+from .images import schedule_variants
+from .models import Trip, TripDate, ProgramByDay, IncludedFeature, FAQ, TripPhoto, CountryIndex, upcoming_summary
+from .search import schedule_reindex
+
+
+FORMATS = ('jsonl', 'csv')
+
+# Catalogue columns; created_at and the booking counter are not editable
+TRIP_FIELDS = [
+    f.name for f in Trip._meta.concrete_fields
+    if f.editable and not f.primary_key
+]
+
+
+@dataclass(frozen=True)
+class ChildSpec:
+    model: type
+    key: tuple
+    fields: tuple
+
+
+CHILDREN = {
+    'trip_dates': ChildSpec(TripDate, ('start_date',), ('start_date', 'end_date', 'price', 'is_special_offer', 'icon')),
+    'program_by_days': ChildSpec(
+        ProgramByDay, ('day_number',), ('day_number', 'title', 'description', 'accommodation', 'meal_plan'),
+    ),
+    'included_features': ChildSpec(IncludedFeature, ('title',), ('title', 'description', 'icon')),
+    'faqs': ChildSpec(FAQ, ('question',), ('question', 'answer', 'order')),
+    'photos': ChildSpec(TripPhoto, ('photo',), ('photo', 'type', 'caption')),
+}
+
+CSV_COLUMNS = TRIP_FIELDS + list(CHILDREN)
+
+
+@dataclass
+class TripDiff:
+    slug: str
+    created: bool = False
+    # Trip fields whose value changed
+    fields: list = field(default_factory=list)
+    # kind -> {'added': n, 'changed': n, 'removed': n}
+    children: dict = field(default_factory=dict)
+    warnings: list = field(default_factory=list)
+
+    @property
+    def changed(self):
+        return self.created or bool(self.fields) or any(any(c.values()) for c in self.children.values())
+
+    def __str__(self):
+        if self.created:
+            line = f"+ {self.slug}"
+        elif self.changed:
+            line = f"~ {self.slug}"
+        else:
+            line = f"= {self.slug}"
+        if self.fields and not self.created:
+            line += f" [{', '.join(self.fields)}]"
+        for kind, counts in self.children.items():
+            if any(counts.values()):
+                line += f" {kind} +{counts['added']} ~{counts['changed']} -{counts['removed']}"
+        return line
+
+
+@dataclass
+class ImportReport:
+    diffs: list = field(default_factory=list)
+    # (line number, message)
+    errors: list = field(default_factory=list)
+
+    def count(self, status):
+        if status == 'created':
+            return sum(diff.created for diff in self.diffs)
+        if status == 'updated':
+            return sum(diff.changed and not diff.created for diff in self.diffs)
+        return sum(not diff.changed for diff in self.diffs)
+
+    @property
+    def summary(self):
+        return (
+            f"{self.count('created')} created, {self.count('updated')} updated, "
+            f"{self.count('unchanged')} unchanged, {len(self.errors)} error(s)"
+        )
+
+
+def _to_python(model, name, value):
+    model_field = model._meta.get_field(name)
+    if value is None and model_field.has_default():
+        return model_field.get_default()
+    return model_field.to_python(value)
+
+
+def _error_message(e):
+    if isinstance(e, ValidationError):
+        return "; ".join(
+            f"{name}: {' '.join(messages)}" if name != '__all__' else ' '.join(messages)
+            for name, messages in e.message_dict.items()
+        ) if hasattr(e, 'error_dict') else ' '.join(e.messages)
+    return str(e)
+
+
+def _check_constraints(kind, spec, rows):
+    """
+    Checks the per-trip unique constraints of a child model, such as one
+    main photo, on the rows a trip will have. Conditions are `field=value`
+    lookups; the database still enforces anything more involved.
+    """
+    for constraint in spec.model._meta.constraints:
+        if not isinstance(constraint, UniqueConstraint) or 'trip' not in constraint.fields:
+            continue
+        condition = constraint.condition.children if constraint.condition is not None else []
+        if isinstance(constraint.condition, Q) and (
+            constraint.condition.connector != Q.AND or constraint.condition.negated
+            or not all(isinstance(child, tuple) and '__' not in child[0] for child in condition)
+        ):
+            continue
+        names = [name for name in constraint.fields if name != 'trip']
+        seen = set()
+        for row in rows:
+            if not all(row.get(name) == value for name, value in condition):
+                continue
+            key = tuple(row.get(name) for name in names)
+            if key in seen:
+                lookups = [*zip(names, key), *((name, value) for name, value in condition if name not in names)]
+                lookups = ', '.join(f"{name}={value!r}" for name, value in lookups)
+                raise ValidationError(f"{kind}: more than one row with {lookups or 'the same trip'}")
+            seen.add(key)
+
+
+# Reading
+
+def read_jsonl(stream):
+    """
+    Yields (line number, record or exception) for each non-empty line.
+    """
+    for number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("expected a JSON object")
+        except ValueError as e:
+            yield number, e
+            continue
+        yield number, record
+
+
+def read_csv(stream):
+    reader = csv.DictReader(stream)
+    for record in reader:
+        number = reader.line_num
+        try:
+            for kind in CHILDREN:
+                value = record.pop(kind, None)
+                if value:
+                    record[kind] = json.loads(value)
+        except ValueError as e:
+            yield number, ValueError(f"{kind}: {e}")
+            continue
+        # An empty cell keeps the stored value, same as a missing JSONL key
+        yield number, {name: value for name, value in record.items() if value not in (None, '')}
+
+
+READERS = {'jsonl': read_jsonl, 'csv': read_csv}
+
+
+# Import
+
+class CatalogueImporter:
+    """
+    Upserts trip records chunk by chunk, each chunk in its own transaction.
+
+    Existing trips and children of a chunk are read in one query per model,
+    trips are written with a single bulk_create(update_conflicts=True) on
+    slug, children with bulk_create/bulk_update. Bulk writes send no
+    signals, so caches, the country index and the search index are
+    refreshed explicitly.
+    """
+
+    def __init__(self, chunk_size=200, dry_run=False):
+        self.chunk_size = chunk_size
+        self.dry_run = dry_run
+        self.report = ImportReport()
+
+    def run(self, records):
+        chunk = []
+        for number, record in records:
+            if isinstance(record, Exception):
+                self.report.errors.append((number, _error_message(record)))
+                continue
+            chunk.append((number, record))
+            if len(chunk) >= self.chunk_size:
+                self.import_chunk(chunk)
+                chunk = []
+        if chunk:
+            self.import_chunk(chunk)
+        return self.report
+
+    def import_chunk(self, chunk):
+        slugs = [record.get('slug') for _, record in chunk]
+        existing = {
+            row['slug']: row
+            for row in Trip.objects.filter(slug__in=[s for s in slugs if s]).values('id', *TRIP_FIELDS)
+        }
+        trip_ids = [row['id'] for row in existing.values()]
+        kinds = {kind for _, record in chunk for kind in CHILDREN if kind in record}
+        existing_children = {kind: self.load_children(kind, trip_ids) for kind in kinds}
+
+        planned, seen = [], set()
+        for number, record in chunk:
+            slug = record.get('slug')
+            try:
+                if not slug:
+                    raise ValidationError("slug is required")
+                if slug in seen:
+                    raise ValidationError(f"duplicate slug {slug!r} in the same chunk")
+                seen.add(slug)
+                plan = self.plan_trip(record, existing.get(slug), existing_children)
+            except (ValidationError, ValueError, TypeError, AttributeError) as e:
+                self.report.errors.append((number, f"{slug or '?'}: {_error_message(e)}"))
+                continue
+            self.report.diffs.append(plan['diff'])
+            if plan['diff'].changed:
+                plan['number'] = number
+                planned.append(plan)
+
+        if not planned or self.dry_run:
+            return
+        try:
+            self.write(planned)
+        except IntegrityError:
+            # Find the records the database refused, the others still go in
+            for plan in planned:
+                try:
+                    self.write([plan])
+                except IntegrityError as e:
+                    self.report.diffs.remove(plan['diff'])
+                    self.report.errors.append((plan['number'], f"{plan['diff'].slug}: {e}"))
+
+    @staticmethod
+    def load_children(kind, trip_ids):
+        spec = CHILDREN[kind]
+        columns = ['id', 'trip_id', *spec.fields]
+        if spec.model is TripDate:
+            columns.append('current_members')
+        rows = defaultdict(dict)
+        for row in spec.model.objects.filter(trip_id__in=trip_ids).values(*columns):
+            rows[row['trip_id']][tuple(row[k] for k in spec.key)] = row
+        return rows
+
+    def plan_trip(self, record, current, existing_children):
+        values = {name: _to_python(Trip, name, record[name]) for name in TRIP_FIELDS if name in record}
+        diff = TripDiff(slug=record['slug'], created=current is None)
+
+        if current is None:
+            trip = Trip(**values)
+        else:
+            diff.fields = [name for name, value in values.items() if current[name] != value]
+            # No pk: the row is matched on slug by the upsert
+            trip = Trip(**{**{name: current[name] for name in TRIP_FIELDS}, **values})
+        trip.full_clean(validate_unique=False)
+
+        plan = {'trip': trip, 'diff': diff, 'previous_country': current and current['country'], 'children': {}}
+        for kind in CHILDREN:
+            if kind not in record:
+                continue
+            stored = existing_children[kind].get(current['id'], {}) if current else {}
+            plan['children'][kind] = self.plan_children(kind, record[kind], stored, diff)
+        return plan
+
+    @staticmethod
+    def plan_children(kind, rows, stored, diff):
+        spec = CHILDREN[kind]
+        if not isinstance(rows, list):
+            raise ValidationError(f"{kind}: expected a list")
+
+        added, changed, keys = [], [], set()
+        for row in rows:
+            values = {name: _to_python(spec.model, name, row[name]) for name in spec.fields if name in row}
+            key = tuple(values.get(k) for k in spec.key)
+            if key in keys:
+                raise ValidationError(f"{kind}: duplicate {', '.join(spec.key)} {key}")
+            keys.add(key)
+
+            current = stored.get(key)
+            if current is None:
+                instance = spec.model(**values)
+            elif any(current[name] != value for name, value in values.items()):
+                instance = spec.model(**{**{name: current[name] for name in spec.fields}, **values})
+                instance.pk = current['id']
+            else:
+                continue
+            try:
+                instance.full_clean(exclude=['trip'], validate_unique=False, validate_constraints=False)
+            except ValidationError as e:
+                raise ValidationError(f"{kind} {key}: {_error_message(e)}")
+            (added if current is None else changed).append(instance)
+
+        removed, kept = [], []
+        for key, current in stored.items():
+            if key in keys:
+                continue
+            # Dates with bookings are never dropped by an import
+            if current.get('current_members'):
+                diff.warnings.append(f"{kind} {key} kept: {current['current_members']} seat(s) booked")
+                kept.append(current)
+                continue
+            removed.append(current['id'])
+
+        # Rows of the trip after the import, for its unique constraints
+        changed_ids = {instance.pk for instance in changed}
+        final = [
+            *kept,
+            *({name: getattr(instance, name) for name in spec.fields} for instance in added + changed),
+            *(current for key, current in stored.items() if key in keys and current['id'] not in changed_ids),
+        ]
+        _check_constraints(kind, spec, final)
+
+        diff.children[kind] = {'added': len(added), 'changed': len(changed), 'removed': len(removed)}
+        return {'added': added, 'changed': changed, 'removed': removed}
+
+    def write(self, planned):
+        """
+        Writes the planned trips in one transaction. Removed children go
+        first, so their replacements don't collide with them.
+        """
+        trips = [plan['trip'] for plan in planned]
+        countries = set()
+        photos = Counter()
+        with transaction.atomic():
+            Trip.objects.bulk_create(
+                trips,
+                update_conflicts=True,
+                unique_fields=['slug'],
+                update_fields=[name for name in TRIP_FIELDS if name != 'slug'],
+            )
+            ids = dict(Trip.objects.filter(slug__in=[t.slug for t in trips]).values_list('slug', 'id'))
+
+            for plan in planned:
+                trip = plan['trip']
+                trip.pk = ids[trip.slug]
+                countries.update(filter(None, [trip.country, plan['previous_country']]))
+                for kind, children in plan['children'].items():
+                    spec = CHILDREN[kind]
+                    if children['removed']:
+                        spec.model.objects.filter(pk__in=children['removed']).delete()
+                    if children['changed']:
+                        spec.model.objects.bulk_update(
+                            children['changed'], [name for name in spec.fields if name not in spec.key],
+                        )
+                    for instance in children['added']:
+                        instance.trip = trip
+                    spec.model.objects.bulk_create(children['added'])
+                    if spec.model is TripPhoto:
+                        for instance in children['added']:
+                            photos[instance.photo.name] += 1
+                            schedule_variants(instance, 'photo')
+
+                schedule_reindex(trip.pk)
+
+            # Bulk writes send no signals
+            Trip.objects.filter(pk__in=ids.values()).update(updated_at=Now(), **upcoming_summary())
+            add_references(photos)
+            CountryIndex.refresh(*countries)
+
+        for trip in trips:
+            invalidate_trip(trip.pk)
+
+
+# Export
+
+def iter_records(chunk_size=500):
+    """
+    Yields one record per trip in id order, reading trips by keyset
+    chunks and their children with one query per kind and chunk.
+    """
+    trips = Trip.objects.order_by('pk').values('id', *TRIP_FIELDS)
+    last_id = 0
+    while True:
+        chunk = list(trips.filter(pk__gt=last_id)[:chunk_size])
+        if not chunk:
+            return
+        ids = [row['id'] for row in chunk]
+        last_id = ids[-1]
+
+        children = defaultdict(lambda: defaultdict(list))
+        for kind, spec in CHILDREN.items():
+            rows = spec.model.objects.filter(trip_id__in=ids).order_by('trip_id', *spec.key, 'id')
+            for row in rows.values('trip_id', *spec.fields):
+                children[row.pop('trip_id')][kind].append(row)
+
+        for row in chunk:
+            trip_id = row.pop('id')
+            yield {**row, **{kind: children[trip_id][kind] for kind in CHILDREN}}
+
+
+def write_jsonl(records, stream):
+    for record in records:
+        stream.write(json.dumps(record, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n')
+
+
+def write_csv(records, stream):
+    writer = csv.DictWriter(stream, fieldnames=CSV_COLUMNS)
+    writer.writeheader()
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    for record in records:
+        for kind in CHILDREN:
+            record[kind] = encoder.encode(record[kind])
+        writer.writerow(record)
+
+
+WRITERS = {'jsonl': write_jsonl, 'csv': write_csv}
+
+
+def guess_format(path, default='jsonl'):
+    for name in FORMATS:
+        if path and path.lower().endswith(f'.{name}'):
+            return name
+    return default
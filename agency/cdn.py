@@ -0,0 +1,181 @@
+"""
+Purging catalogue responses from the CDN.
+
+Responses are tagged with surrogate keys (see agency/http_cache.py):
+`trips` for everything built from the whole catalogue and `trip-<id>` for
+a trip detail. A trip change purges both once its transaction commits,
+from a background thread of the process so the CDN API never holds up the
+request.
+"""
+import atexit
+import logging
+import threading
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger(__name__)
+
+CATALOGUE_SURROGATE_KEY = 'trips'
+
+_backends = {}
+_local = threading.local()
+
+
+def trip_surrogate_key(trip_id):
+    return f"trip-{trip_id}"
+
+
+class NullPurgeBackend:
+    """
+    No CDN in front of the site: responses expire by their max-age.
+    """
+
+    def purge(self, keys):
+        pass
+
+
+class MemoryPurgeBackend:
+    """
+    Keeps the purged keys in this process: meant for tests and development.
+    """
+
+    def __init__(self):
+        self.purged = []
+        self.lock = threading.Lock()
+
+    def purge(self, keys):
+        with self.lock:
+            self.purged.append(sorted(keys))
+
+    def reset(self):
+        with self.lock:
+            self.purged.clear()
+
+
+class FastlyPurgeBackend:
+    """
+    Purges by surrogate key through the Fastly API, all keys in one request.
+    `CDN_PURGE_OPTIONS` needs `service_id` and `token`.
+    """
+    url = "https://api.fastly.com/service/{service_id}/purge"
+
+    def __init__(self, service_id=None, token=None, soft=True, timeout=5):
+        options = getattr(settings, 'CDN_PURGE_OPTIONS', {})
+        self.service_id = service_id or options['service_id']
+        self.token = token or options['token']
+        self.soft = options.get('soft', soft)
+        self.timeout = options.get('timeout', timeout)
+
+    def purge(self, keys):
+        headers = {'Fastly-Key': self.token, 'Surrogate-Key': ' '.join(sorted(keys))}
+        if self.soft:
+            # Marks the objects stale instead of evicting them, so
+            # stale-while-revalidate keeps serving while the origin refills
+            headers['Fastly-Soft-Purge'] = '1'
+        response = requests.post(self.url.format(service_id=self.service_id), headers=headers, timeout=self.timeout)
+        response.raise_for_status()
+
+
+def get_backend():
+    path = getattr(settings, 'CDN_PURGE_BACKEND', 'agency.cdn.NullPurgeBackend')
+    if path not in _backends:
+        _backends[path] = import_string(path)()
+    return _backends[path]
+
+
+def purge(keys):
+    """
+    Purges right away. A CDN outage must not fail the edit that caused
+    the purge: the error is logged and the responses expire by s-maxage.
+    """
+    if not keys:
+        return
+    try:
+        get_backend().purge(set(keys))
+    except Exception:
+        logger.exception("CDN purge of %s failed", ' '.join(sorted(keys)))
+
+
+def purge_trips(trip_ids):
+    purge({CATALOGUE_SURROGATE_KEY, *(trip_surrogate_key(trip_id) for trip_id in trip_ids)})
+
+
+class PurgeQueue:
+    """
+    Sends the purges of this process from one daemon thread. Keys queued
+    while a purge is in flight go out together in the next call.
+    """
+
+    def __init__(self):
+        self.keys = set()
+        self.sending = False
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def put(self, keys):
+        if not keys:
+            return
+        with self.condition:
+            self.keys.update(keys)
+            # Started on first use, and again in a forked worker
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name="cdn-purge", daemon=True)
+                self.thread.start()
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.keys)
+                keys, self.keys = self.keys, set()
+                self.sending = True
+            try:
+                purge(keys)
+            finally:
+                with self.condition:
+                    self.sending = False
+                    self.condition.notify_all()
+
+    def join(self, timeout=None):
+        """
+        Waits for the queued purges, False if they are still pending after `timeout` seconds.
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.keys and not self.sending, timeout)
+
+
+_queue = PurgeQueue()
+# Gives a stopping worker a moment to send what its last requests queued
+atexit.register(_queue.join, 5)
+
+
+def wait_for_purges(timeout=None):
+    return _queue.join(timeout)
+
+
+def _pending():
+    if not hasattr(_local, 'keys'):
+        _local.keys = set()
+    return _local.keys
+
+
+def _flush_pending():
+    keys = set(_pending())
+    _pending().clear()
+    _queue.put(keys)
+
+
+def schedule_purge(trip_id=None):
+    """
+    Queues a purge of the trip and the catalogue after commit, one per
+    transaction however many rows were saved.
+    """
+    keys = _pending()
+    keys.add(CATALOGUE_SURROGATE_KEY)
+    if trip_id is not None:
+        keys.add(trip_surrogate_key(trip_id))
+    transaction.on_commit(_flush_pending)
@@ -0,0 +1,80 @@
+"""
+Departure calendar: upcoming trip dates in a window, grouped by month
+and country, read in one range query over the TripDate indexes.
+"""
+from itertools import groupby
+
+from django.db.models import F
+
+from .models import Trip, TripDate
+
+
+COUNTRY_NAMES = dict(Trip.COUNTRY_CHOICES)
+
+COLUMNS = (
+    'id', 'start_date', 'end_date', 'price', 'is_special_offer',
+    'trip_id', 'trip__slug', 'trip__title', 'trip__country',
+)
+
+
+def find_departures(date_from, date_to, seats=1, return_by=None, price_min=None, price_max=None,
+                    countries=None, special_offer=False):
+    """
+    Dates starting within [date_from, date_to] with at least `seats` free,
+    ordered by start date and price.
+    """
+    # start_date bounds the scan of the (start_date, end_date, price) index,
+    # the other columns are checked on the index entries
+    queryset = TripDate.objects.filter(start_date__gte=date_from, start_date__lte=date_to)
+    if return_by is not None:
+        queryset = queryset.filter(end_date__lte=return_by)
+    if price_min is not None:
+        queryset = queryset.filter(price__gte=price_min)
+    if price_max is not None:
+        queryset = queryset.filter(price__lte=price_max)
+    if special_offer:
+        queryset = queryset.filter(is_special_offer=True)
+    if countries:
+        queryset = queryset.filter(trip__country__in=countries)
+
+    return (
+        queryset
+        .filter(current_members__lte=F('trip__group_size') - seats)
+        .annotate(free_seats=F('trip__group_size') - F('current_members'))
+        .order_by('start_date', 'price', 'id')
+        .values(*COLUMNS, 'free_seats')
+    )
+
+
+def departure_row(row):
+    return {
+        'id': row['id'],
+        'trip': row['trip_id'],
+        'slug': row['trip__slug'],
+        'title': row['trip__title'],
+        'start_date': row['start_date'].isoformat(),
+        'end_date': row['end_date'].isoformat(),
+        'price': float(row['price']),
+        'free_seats': row['free_seats'],
+        'is_special_offer': row['is_special_offer'],
+    }
+
+
+def group_departures(rows):
+    """
+    [{month, countries: [{country, country_name, departures}]}] out of
+    rows ordered by start date.
+    """
+    months = []
+    for month, month_rows in groupby(rows, key=lambda row: row['start_date'].strftime('%Y-%m')):
+        by_country = {}
+        for row in month_rows:
+            by_country.setdefault(row['trip__country'], []).append(departure_row(row))
+        months.append({
+            'month': month,
+            'countries': [
+                {'country': country, 'country_name': COUNTRY_NAMES.get(country, country), 'departures': departures}
+                for country, departures in sorted(by_country.items())
+            ],
+        })
+    return months
@@ -0,0 +1,48 @@
+from rest_framework.filters import BaseFilterBackend, OrderingFilter
+
+from .serializers import TripListQuerySerializer
+
+
+# Summary columns that are empty for trips without upcoming dates
+NULLABLE_ORDERING = {'next_start_date', 'min_price'}
+
+
+class TripSummaryFilter(BaseFilterBackend):
+    """
+    Filters the trip list on the stored summary of upcoming dates,
+    so no date rows are read.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        if view.action != 'list':
+            return queryset
+
+        params = TripListQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        filters = params.validated_data
+        lookups = {
+            'price_min': 'min_price__gte',
+            'price_max': 'min_price__lte',
+            'departure_from': 'next_start_date__gte',
+            'departure_to': 'next_start_date__lte',
+        }
+        queryset = queryset.filter(**{lookups[name]: value for name, value in filters.items() if name in lookups})
+        if filters.get('special_offer'):
+            queryset = queryset.filter(has_special_offer=True)
+        if filters.get('available'):
+            queryset = queryset.filter(free_seats__gt=0)
+        return queryset
+
+
+class TripOrderingFilter(OrderingFilter):
+    """
+    `?ordering=` over indexed columns. The cursor can't be positioned on
+    NULL, so ordering by a summary column leaves out trips without
+    upcoming dates.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        ordering = self.get_ordering(request, queryset, view) or ()
+        for name in NULLABLE_ORDERING.intersection(field.lstrip('-') for field in ordering):
+            queryset = queryset.filter(**{f"{name}__isnull": False})
+        return super().filter_queryset(request, queryset, view)
@@ -0,0 +1,172 @@
+"""
+HTTP caching of public GET responses by browsers and the CDN.
+
+A viewset names a `cache_policy`: its responses get `Cache-Control`,
+`Vary: Accept`, `Last-Modified` and `Surrogate-Key` headers, and a request
+whose `If-Modified-Since` is still current is answered 304 before the
+action runs. Responses cached by `CachedResponseMixin` also carry an ETag,
+which takes precedence over `If-Modified-Since`.
+"""
+import datetime
+
+from django.conf import settings
+from django.http import HttpResponseNotModified
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe
+from rest_framework.exceptions import APIException
+
+from .cache import (
+    CATALOGUE_VERSION_KEY, TRIP_DELETED_AT_KEY, aget_version, get_cache, get_timeout, get_version, trip_version_key,
+)
+from .cdn import CATALOGUE_SURROGATE_KEY, trip_surrogate_key
+
+
+DEFAULT_CACHE_CONTROL = {
+    'public': True,
+    'max_age': 60,
+    's_maxage': 600,
+    'stale_while_revalidate': 60,
+}
+
+
+class NotModified(APIException):
+    status_code = 304
+
+
+class HttpCachePolicy:
+    """
+    How browsers and the CDN may keep a viewset's GET responses.
+
+    `cache_control` are `patch_cache_control` kwargs, CATALOGUE_CACHE_CONTROL
+    by default. Subclasses give the Last-Modified time and surrogate keys.
+    """
+
+    def __init__(self, **cache_control):
+        self.cache_control = cache_control
+
+    def get_cache_control(self):
+        return self.cache_control or {**DEFAULT_CACHE_CONTROL, **getattr(settings, 'CATALOGUE_CACHE_CONTROL', {})}
+
+    def last_modified(self, view):
+        return None
+
+    async def alast_modified(self, view):
+        return None
+
+    def surrogate_keys(self, view):
+        return []
+
+
+class TripCachePolicy(HttpCachePolicy):
+    """
+    Trip details change with their trip, everything else with the whole
+    catalogue. Last-Modified is the newest `updated_at` involved, read once
+    per cache version, so cached responses stay free of queries.
+    """
+
+    def is_detail(self, view):
+        return view.action == 'retrieve'
+
+    def get_version_key(self, view):
+        if self.is_detail(view):
+            return trip_version_key(view.kwargs[view.lookup_url_kwarg or view.lookup_field])
+        return CATALOGUE_VERSION_KEY
+
+    def get_queryset(self, view):
+        from .models import Trip
+
+        queryset = Trip.objects.order_by('-updated_at').values_list('updated_at', flat=True)
+        if self.is_detail(view):
+            pk = view.kwargs[view.lookup_url_kwarg or view.lookup_field]
+            # Not an id: the view answers 404
+            queryset = queryset.filter(pk=pk) if str(pk).isdigit() else queryset.none()
+        return queryset[:1]
+
+    def combine(self, view, updated_at, deleted_at):
+        if updated_at is None:
+            return None
+        if deleted_at is not None and not self.is_detail(view):
+            # A deleted trip took its updated_at with it
+            updated_at = max(updated_at, datetime.datetime.fromtimestamp(deleted_at, datetime.timezone.utc))
+        return updated_at
+
+    def last_modified(self, view):
+        cache = get_cache()
+        version_key = self.get_version_key(view)
+        key = f"{version_key}:{get_version(version_key)}:last_modified"
+        value = cache.get(key)
+        if value is None:
+            value = {'updated_at': next(iter(self.get_queryset(view)), None)}
+            cache.set(key, value, get_timeout())
+        return self.combine(view, value['updated_at'], cache.get(TRIP_DELETED_AT_KEY))
+
+    async def alast_modified(self, view):
+        cache = get_cache()
+        version_key = self.get_version_key(view)
+        key = f"{version_key}:{await aget_version(version_key)}:last_modified"
+        value = await cache.aget(key)
+        if value is None:
+            value = {'updated_at': await self.get_queryset(view).afirst()}
+            await cache.aset(key, value, get_timeout())
+        return self.combine(view, value['updated_at'], await cache.aget(TRIP_DELETED_AT_KEY))
+
+    def surrogate_keys(self, view):
+        if self.is_detail(view):
+            return [trip_surrogate_key(view.kwargs[view.lookup_url_kwarg or view.lookup_field])]
+        return [CATALOGUE_SURROGATE_KEY]
+
+
+class HttpCacheMixin:
+    """
+    Applies the viewset's `cache_policy` to public GET responses.
+    Goes before `AsyncReadMixin`, whose `ainitial` it extends.
+    """
+    cache_policy = None
+
+    def get_cache_policy(self, request):
+        if self.cache_policy is None or request.method not in ('GET', 'HEAD'):
+            return None
+        # The browsable API renders per-user forms
+        if getattr(request, 'accepted_renderer', None) is not None and request.accepted_renderer.format == 'api':
+            return None
+        return self.cache_policy
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        policy = self.get_cache_policy(request)
+        self.last_modified = policy.last_modified(self) if policy is not None else None
+        self.check_not_modified(request)
+
+    async def ainitial(self, request):
+        await super().ainitial(request)
+        policy = self.get_cache_policy(request)
+        self.last_modified = await policy.alast_modified(self) if policy is not None else None
+        self.check_not_modified(request)
+
+    def check_not_modified(self, request):
+        # If-None-Match, when sent, is checked against the ETag instead
+        if self.last_modified is None or 'HTTP_IF_NONE_MATCH' in request.META:
+            return
+        since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        if since is not None and int(self.last_modified.timestamp()) <= since:
+            raise NotModified()
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return HttpResponseNotModified()
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        policy = self.get_cache_policy(request)
+        if policy is None or response.status_code not in (200, 304):
+            return response
+
+        patch_cache_control(response, **policy.get_cache_control())
+        patch_vary_headers(response, ['Accept'])
+        keys = policy.surrogate_keys(self)
+        if keys:
+            response['Surrogate-Key'] = ' '.join(keys)
+        if getattr(self, 'last_modified', None) is not None:
+            response['Last-Modified'] = http_date(self.last_modified.timestamp())
+        return response
@@ -0,0 +1,193 @@
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from io import BytesIO
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.db.models import F, Q
+
+from .blobs import references, replace_references
+from .storage import ContentAddressedMixin
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_VARIANTS = {
+    'thumb': (320, 320),
+    'card': (800, 600),
+    'hero': (1920, 1080),
+}
+
+FORMATS = [
+    # (key in `variants`, Pillow format, extension, save options)
+    ('jpeg', 'JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+    ('webp', 'WEBP', 'webp', {'quality': 80, 'method': 4}),
+]
+
+_executor = None
+
+
+def get_variant_sizes():
+    return getattr(settings, 'IMAGE_VARIANTS', DEFAULT_VARIANTS)
+
+
+def variant_name(name, variant, extension):
+    """
+    trip_1/slide/2025-01-01_00-00-00_x.png -> trip_1/slide/2025-01-01_00-00-00_x.thumb.jpg
+    """
+    base, _ = os.path.splitext(name)
+    return f"{base}.{variant}.{extension}"
+
+
+def render_variants(name):
+    """
+    Builds every size in JPEG and WebP next to the original file.
+
+    Runs in a worker process, so it only touches storage, never the database.
+    Returns the `variants` map to store on the model, or None when the
+    original can't be read.
+    """
+    try:
+        with default_storage.open(name) as source:
+            image = Image.open(source)
+            image = ImageOps.exif_transpose(image)
+            image.load()
+    except (OSError, UnidentifiedImageError) as e:
+        logger.warning(f"Can't build variants for {name}: {e}")
+        return None
+
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    variants = {'source': name}
+    for variant, size in get_variant_sizes().items():
+        resized = image.copy()
+        resized.thumbnail(size, Image.LANCZOS)
+        entry = {'width': resized.width}
+        for key, image_format, extension, options in FORMATS:
+            buffer = BytesIO()
+            resized.save(buffer, image_format, **options)
+            target = variant_name(name, variant, extension)
+            # Blob names come from the content, other storages would
+            # pick a new name next to the stale variant
+            if not isinstance(default_storage, ContentAddressedMixin) and default_storage.exists(target):
+                default_storage.delete(target)
+            entry[key] = default_storage.save(target, ContentFile(buffer.getvalue()))
+        variants[variant] = entry
+    return variants
+
+
+def store_variants(model, pk, field_name, name, variants):
+    if variants is None:
+        return
+    with transaction.atomic():
+        # Filtering on the file name keeps a late result from overwriting a newer upload
+        rows = model.objects.select_for_update().filter(pk=pk, **{field_name: name})
+        old = rows.values_list('variants', flat=True).first()
+        updated = rows.update(variants=variants)
+        if updated:
+            replace_references(references(name, old), references(name, variants))
+    if updated and hasattr(model, 'trip'):
+        from .cache import invalidate_trip
+        from .models import touch_trip
+        trip_id = model.objects.filter(pk=pk).values_list('trip_id', flat=True).first()
+        touch_trip(trip_id)
+        invalidate_trip(trip_id)
+
+
+def pending(model, field_name):
+    """
+    Rows whose variants weren't built for their current file yet.
+    """
+    return model.objects.exclude(**{field_name: ""}).filter(
+        Q(variants__source__isnull=True) | ~Q(variants__source=F(field_name))
+    )
+
+
+def init_worker():
+    import django
+    django.setup()
+
+
+# In-process pool of runserver (IMAGE_PROCESSING_POOL), web workers leave
+# the builds to `manage.py generate_image_variants --watch`
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=getattr(settings, 'IMAGE_PROCESSING_WORKERS', 2),
+            initializer=init_worker,
+        )
+    return _executor
+
+
+def _on_done(model, pk, field_name, name, caller, future):
+    # Normally runs in the executor's thread, which opens its own DB connection
+    try:
+        store_variants(model, pk, field_name, name, future.result())
+    except Exception:
+        logger.exception(f"Image variants for {model.__name__} #{pk} failed")
+    finally:
+        if threading.get_ident() != caller:
+            connections.close_all()
+
+
+def schedule_variants(instance, field_name):
+    """
+    Builds the variants for the file in `field_name` right away with
+    IMAGE_PROCESSING_SYNC, or in this process' pool once the transaction
+    commits with IMAGE_PROCESSING_POOL. Otherwise the row stays pending()
+    until the image worker gets to it.
+    """
+    name = getattr(instance, field_name).name
+    if not name or instance.variants.get('source') == name:
+        return
+
+    model, pk = type(instance), instance.pk
+    if getattr(settings, 'IMAGE_PROCESSING_SYNC', False):
+        store_variants(model, pk, field_name, name, render_variants(name))
+        return
+    if not getattr(settings, 'IMAGE_PROCESSING_POOL', False):
+        return
+
+    def submit():
+        future = get_executor().submit(render_variants, name)
+        future.add_done_callback(partial(_on_done, model, pk, field_name, name, threading.get_ident()))
+
+    transaction.on_commit(submit)
+
+
+def build_srcset(variants, request=None):
+    """
+    {'jpeg': 'url 320w, url 800w, ...', 'webp': '...'} for <picture>/<img srcset>,
+    None until the variants are generated.
+    """
+    if not variants:
+        return None
+
+    srcset = {}
+    for key, *_ in FORMATS:
+        candidates, widths = [], set()
+        for variant in get_variant_sizes():
+            entry = variants.get(variant)
+            # Small originals aren't upscaled, so sizes can collapse into one
+            if not entry or entry['width'] in widths:
+                continue
+            widths.add(entry['width'])
+            url = default_storage.url(entry[key])
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            candidates.append(f"{url} {entry['width']}w")
+        srcset[key] = ", ".join(candidates)
+    return srcset
+
+
+def variant_url(variants, variant='thumb', key='jpeg'):
+    entry = (variants or {}).get(variant)
+    return default_storage.url(entry[key]) if entry else None
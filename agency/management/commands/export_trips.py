@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from agency.catalogue import FORMATS, WRITERS, guess_format, iter_records
+
+
+class Command(BaseCommand):
+    help = "Streams the trip catalogue with its child rows as JSONL or CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output", "-o", help="Output file, stdout by default")
+        parser.add_argument("--format", choices=FORMATS, help="Output format, guessed from the extension by default")
+        parser.add_argument("--chunk-size", type=int, default=500, help="Trips read per query")
+
+    def handle(self, *args, **options):
+        path = options["output"]
+        writer = WRITERS[options["format"] or guess_format(path)]
+        records = iter_records(chunk_size=options["chunk_size"])
+
+        if path:
+            with open(path, "w", encoding="utf-8", newline="") as stream:
+                writer(records, stream)
+        else:
+            writer(records, self.stdout)
@@ -0,0 +1,33 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+from agency.blobs import collect_garbage, recount
+
+
+class Command(BaseCommand):
+    help = "Deletes media blobs no trip photo or review has used for MEDIA_GC_GRACE_HOURS (run daily)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Only list the blobs that would be deleted")
+        parser.add_argument("--recount", action="store_true", help="Rebuild the reference counts from the rows first")
+        parser.add_argument("--grace-hours", type=float, help="Override MEDIA_GC_GRACE_HOURS")
+
+    def handle(self, *args, **options):
+        if options["recount"]:
+            self.stdout.write(f"{recount()} reference count(s) fixed")
+
+        grace = options["grace_hours"]
+        garbage = collect_garbage(
+            grace=datetime.timedelta(hours=grace) if grace is not None else None,
+            dry_run=options["dry_run"],
+        )
+        for name, size in garbage:
+            self.stdout.write(f"{name} ({filesizeformat(size)})")
+
+        freed = filesizeformat(sum(size for _, size in garbage))
+        if options["dry_run"]:
+            self.stdout.write(f"{len(garbage)} blob(s) unused, {freed}")
+        else:
+            self.stdout.write(self.style.SUCCESS(f"{len(garbage)} blob(s) deleted, {freed} freed"))
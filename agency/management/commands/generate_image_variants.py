@@ -0,0 +1,69 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from agency.images import init_worker, pending, render_variants, store_variants
+from agency.models import Review, TripPhoto
+
+
+MODELS = {
+    'photos': (TripPhoto, 'photo'),
+    'reviews': (Review, 'avatar'),
+}
+
+
+class Command(BaseCommand):
+    help = "Builds thumb/card/hero JPEG and WebP copies for trip photos and review avatars"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4, help="Worker processes")
+        parser.add_argument("--force", action="store_true", help="Rebuild images that already have variants")
+        parser.add_argument("--only", choices=list(MODELS), help="Process only photos or only reviews")
+        parser.add_argument("--watch", action="store_true", help="Keep building new uploads")
+        parser.add_argument("--interval", type=float, default=5, help="Seconds to sleep when nothing is pending")
+        parser.add_argument("--batch-size", type=int, default=100, help="Images taken per batch with --watch")
+
+    def handle(self, *args, **options):
+        with ProcessPoolExecutor(max_workers=options["workers"], initializer=init_worker) as executor:
+            if not options["watch"]:
+                for key, (model, field_name) in self.get_models(options):
+                    queryset = model.objects.exclude(**{field_name: ""}) if options["force"] else pending(model, field_name)
+                    done, failed = self.build(executor, model, field_name, queryset)
+                    self.stdout.write(f"{key}: {done} processed, {failed} failed")
+                return
+
+            # Images that can't be read stay pending, they are tried once per run
+            failed_pks = {key: set() for key in MODELS}
+            while True:
+                busy = False
+                for key, (model, field_name) in self.get_models(options):
+                    queryset = pending(model, field_name).exclude(pk__in=failed_pks[key]).order_by("pk")
+                    done, failed = self.build(
+                        executor, model, field_name, queryset[:options["batch_size"]], failed_pks[key],
+                    )
+                    if done or failed:
+                        busy = True
+                        self.stdout.write(f"{key}: {done} processed, {failed} failed")
+                if not busy:
+                    time.sleep(options["interval"])
+
+    @staticmethod
+    def get_models(options):
+        return [(key, spec) for key, spec in MODELS.items() if not options["only"] or options["only"] == key]
+
+    @staticmethod
+    def build(executor, model, field_name, queryset, failed_pks=None):
+        rows = list(queryset.values_list("pk", field_name))
+        done = failed = 0
+        names = [name for _, name in rows]
+        # Images are resized in the pool, results are written from this process
+        for (pk, name), variants in zip(rows, executor.map(render_variants, names, chunksize=8)):
+            if variants is None:
+                failed += 1
+                if failed_pks is not None:
+                    failed_pks.add(pk)
+                continue
+            store_variants(model, pk, field_name, name, variants)
+            done += 1
+        return done, failed
@@ -0,0 +1,41 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from agency.catalogue import FORMATS, READERS, CatalogueImporter, guess_format
+
+
+class Command(BaseCommand):
+    help = "Upserts trips with their dates, program, features, FAQs and photos from JSONL or CSV, matched by slug"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Input file, '-' for stdin")
+        parser.add_argument("--format", choices=FORMATS, help="Input format, guessed from the extension by default")
+        parser.add_argument("--chunk-size", type=int, default=200, help="Trips per transaction")
+        parser.add_argument("--dry-run", action="store_true", help="Only report the changes")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        reader = READERS[options["format"] or guess_format(path)]
+        importer = CatalogueImporter(chunk_size=options["chunk_size"], dry_run=options["dry_run"])
+
+        if path == "-":
+            report = importer.run(reader(sys.stdin))
+        else:
+            try:
+                stream = open(path, encoding="utf-8", newline="")
+            except OSError as e:
+                raise CommandError(e)
+            with stream:
+                report = importer.run(reader(stream))
+
+        for diff in report.diffs:
+            if diff.changed or options["verbosity"] >= 2:
+                self.stdout.write(str(diff))
+            for warning in diff.warnings:
+                self.stdout.write(self.style.WARNING(f"  {diff.slug}: {warning}"))
+        for number, message in report.errors:
+            self.stderr.write(f"line {number}: {message}")
+
+        summary = report.summary + (" (dry run)" if options["dry_run"] else "")
+        self.stdout.write(self.style.SUCCESS(summary) if not report.errors else self.style.WARNING(summary))
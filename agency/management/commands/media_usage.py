@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+from agency.blobs import usage
+
+
+class Command(BaseCommand):
+    help = "Reports the space media blobs take and what deduplication saves"
+
+    def handle(self, *args, **options):
+        report = usage()
+        self.stdout.write(f"In use:    {report['blobs']} blob(s), {filesizeformat(report['stored_bytes'])}")
+        self.stdout.write(f"Referenced: {filesizeformat(report['referenced_bytes'])} "
+                          f"(saved {filesizeformat(report['saved_bytes'])} by deduplication)")
+        self.stdout.write(f"Unused:    {report['unused_blobs']} blob(s), {filesizeformat(report['unused_bytes'])}")
+        self.stdout.write(f"Untracked: {report['untracked_blobs']} blob(s), {filesizeformat(report['untracked_bytes'])}")
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from agency.notifications import get_transport, process_batch
+
+
+class Command(BaseCommand):
+    help = "Sends queued Telegram notifications for trip requests"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=None, help="Notifications taken per batch")
+        parser.add_argument("--workers", type=int, default=4, help="Threads sending a batch")
+        parser.add_argument("--interval", type=float, default=5, help="Seconds to sleep when the outbox is empty")
+        parser.add_argument("--once", action="store_true", help="Drain the due notifications and exit")
+
+    def handle(self, *args, **options):
+        transport = get_transport()
+        while True:
+            counts = process_batch(transport, options["batch_size"], options["workers"])
+            if any(counts.values()):
+                self.stdout.write(
+                    f"sent: {counts['sent']}, retried: {counts['retried']}, dead: {counts['dead']}"
+                )
+                continue
+            if options["once"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from agency.models import CountryIndex
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the per-country index behind /trips/countries/ (after bulk loads that skip signals)"
+
+    def handle(self, *args, **options):
+        CountryIndex.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"{CountryIndex.objects.count()} countries indexed"))
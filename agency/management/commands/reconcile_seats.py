@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models.functions import Now
+
+from agency.cache import invalidate_trip
+from agency.models import Trip, booked_seats_subquery
+
+
+class Command(BaseCommand):
+    help = "Recounts Trip.current_members from the bookings on its dates"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Only report trips with wrong counters")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            drifted = list(
+                Trip.objects.annotate(booked=booked_seats_subquery())
+                .values_list("pk", "title", "current_members", "booked")
+                .select_for_update()
+            )
+            drifted = [row for row in drifted if row[2] != row[3]]
+
+            for pk, title, stored, booked in drifted:
+                self.stdout.write(f"{title} (#{pk}): {stored} -> {booked}")
+
+            if drifted and not options["dry_run"]:
+                Trip.objects.filter(pk__in=[row[0] for row in drifted]).update(
+                    current_members=booked_seats_subquery(), updated_at=Now(),
+                )
+                for pk, *_ in drifted:
+                    invalidate_trip(pk)
+
+        if options["dry_run"]:
+            self.stdout.write(f"{len(drifted)} trip(s) out of sync")
+        else:
+            self.stdout.write(self.style.SUCCESS(f"{len(drifted)} trip(s) reconciled"))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db.models.functions import Now
+from django.utils import timezone
+
+from agency.cache import invalidate_trip
+from agency.models import Trip, upcoming_summary
+
+
+class Command(BaseCommand):
+    help = "Moves the next departure and prices of trips past dates that have started (run daily)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="Recompute every trip, e.g. after loads that skip signals")
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        trips = Trip.objects.all()
+        if not options["all"]:
+            # Later dates can only expire after the next one has
+            trips = trips.filter(next_start_date__lt=today)
+        ids = list(trips.values_list("pk", flat=True))
+
+        if ids:
+            Trip.objects.filter(pk__in=ids).update(updated_at=Now(), **upcoming_summary(today))
+            for pk in ids:
+                invalidate_trip(pk)
+        self.stdout.write(self.style.SUCCESS(f"{len(ids)} trip(s) refreshed"))
@@ -0,0 +1,53 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from agency.slow_queries import advise, group, read_log
+
+
+class Command(BaseCommand):
+    help = "Groups the slow-query log by SQL fingerprint and suggests the indexes the models are missing"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--log", help="Slow-query log, SLOW_QUERY_LOG by default")
+        parser.add_argument("--limit", type=int, default=20, help="Fingerprints shown, the most total time first")
+
+    def handle(self, *args, **options):
+        path = options["log"] or settings.SLOW_QUERY_LOG
+        if not path:
+            raise CommandError("Set SLOW_QUERY_LOG or pass --log")
+
+        summaries = group(read_log(path))
+        if not summaries:
+            self.stdout.write("No slow queries logged")
+            return
+
+        missing = {}
+        for summary in summaries[:options["limit"]]:
+            slowest = summary["slowest"]
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f"{summary['count']} x, {summary['total_ms']:.0f} ms in total, {summary['max_ms']:.0f} ms at most"
+            ))
+            self.stdout.write(f"  {summary['fingerprint']}")
+            for view, count in summary["views"].most_common(3):
+                self.stdout.write(f"  from {view} ({count})")
+            if slowest.get("serializer"):
+                self.stdout.write(f"  serializing {slowest['serializer']}")
+            if slowest.get("origin"):
+                self.stdout.write(f"  at {slowest['origin']}")
+            for line in slowest.get("plan") or []:
+                self.stdout.write(f"  | {line}")
+
+            hints, suggestions = advise(summary)
+            for hint in hints:
+                self.stdout.write(self.style.WARNING(f"  {hint}"))
+            for model, fields, partial in suggestions:
+                key = (model._meta.label, tuple(fields))
+                missing.setdefault(key, [partial, 0])[1] += summary["total_ms"]
+                self.stdout.write(self.style.WARNING(f"  no index on {model._meta.label} {fields}"))
+
+        if missing:
+            self.stdout.write(self.style.MIGRATE_HEADING("Suggested indexes"))
+        for (label, fields), (partial, total_ms) in sorted(missing.items(), key=lambda item: -item[1][1]):
+            self.stdout.write(f"  {label}.Meta.indexes: models.Index(fields={list(fields)!r})  # {total_ms:.0f} ms")
+            for index in partial:
+                self.stdout.write(f"    declared, covers it in part: {list(index)!r}")
@@ -0,0 +1,397 @@
+"""
+Request metrics in the Prometheus text format, served on /metrics.
+
+MetricsMiddleware times every request and labels it with the viewset
+action that answered it (`TripViewSet.list`, `TripRequestListCreateViewSet.create`)
+or the URL name of other views. An execute wrapper installed on every
+database connection adds the request's queries and their time,
+serialize() in agency/views.py its serializer time. The outbox worker
+records how long Telegram took.
+
+Metrics live in the memory of each process. Under several workers set
+METRICS_DIR: every process writes its samples there at most every
+METRICS_FLUSH_INTERVAL seconds, and /metrics adds up all the files.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+class Metric:
+    """
+    Samples of one metric per tuple of label values.
+    """
+    type = None
+
+    def __init__(self, name, documentation, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def snapshot(self):
+        with self.lock:
+            return {labels: self.copy(value) for labels, value in self.values.items()}
+
+    def reset(self):
+        with self.lock:
+            self.values.clear()
+
+    @staticmethod
+    def copy(value):
+        return value
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    @staticmethod
+    def merge(a, b):
+        return a + b
+
+    def samples(self, labels, value):
+        yield self.name, labels, value
+
+
+class Histogram(Metric):
+    """
+    Counts per bucket (not cumulative, the last one is +Inf) and the sum.
+    """
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames, buckets):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, labels, value):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [0] * (len(self.buckets) + 1) + [0]
+            counts[index] += 1
+            counts[-1] += value
+
+    @staticmethod
+    def copy(value):
+        return list(value)
+
+    @staticmethod
+    def merge(a, b):
+        return [x + y for x, y in zip(a, b)]
+
+    def samples(self, labels, counts):
+        total = 0
+        for bound, count in zip((*self.buckets, "+Inf"), counts):
+            total += count
+            yield f"{self.name}_bucket", (*labels, ("le", _format_number(bound))), total
+        yield f"{self.name}_sum", labels, counts[-1]
+        yield f"{self.name}_count", labels, total
+
+
+REQUEST_DURATION = Histogram(
+    "agency_request_duration_seconds", "Time to the response, by view action.",
+    ("view", "method", "status"), LATENCY_BUCKETS,
+)
+REQUEST_QUERIES = Histogram(
+    "agency_request_queries", "SQL queries per request.", ("view", ), QUERY_BUCKETS,
+)
+QUERY_DURATION = Counter(
+    "agency_db_query_duration_seconds_total", "Time spent in SQL queries.", ("view", ),
+)
+SERIALIZER_DURATION = Histogram(
+    "agency_serializer_duration_seconds", "Time spent serializing rows per request.", ("view", ), LATENCY_BUCKETS,
+)
+RESPONSE_BYTES = Histogram(
+    "agency_response_bytes", "Size of the response body.", ("view", ), BYTES_BUCKETS,
+)
+TELEGRAM_DURATION = Histogram(
+    "agency_telegram_request_duration_seconds", "Telegram Bot API calls of the outbox worker.",
+    ("outcome", ), LATENCY_BUCKETS,
+)
+METRICS = (REQUEST_DURATION, REQUEST_QUERIES, QUERY_DURATION, SERIALIZER_DURATION, RESPONSE_BYTES, TELEGRAM_DURATION)
+
+
+def reset():
+    for metric in METRICS:
+        metric.reset()
+
+
+# Per request
+
+class RequestMetrics:
+    __slots__ = ('queries', 'query_seconds', 'serializer_seconds')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.serializer_seconds = 0.0
+
+
+_current = ContextVar('agency_request_metrics', default=None)
+
+
+def execute_wrapper(execute, sql, params, many, context):
+    state = _current.get()
+    if state is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        state.queries += 1
+        state.query_seconds += time.perf_counter() - start
+
+
+def install_execute_wrapper(sender, connection, **kwargs):
+    """
+    connection_created receiver, see AgencyConfig.ready().
+    """
+    # Reconnects of the same connection send the signal again
+    if execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(execute_wrapper)
+
+
+@contextmanager
+def serializer_timer():
+    state = _current.get()
+    if state is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        state.serializer_seconds += time.perf_counter() - start
+
+
+def observe_telegram(seconds, ok):
+    TELEGRAM_DURATION.observe(("ok" if ok else "error", ), seconds)
+
+
+_view_names = {}
+
+
+def get_view_name(request):
+    """
+    `Viewset.action` for DRF viewsets, the URL name of other views.
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return "unmatched"
+    key = (match.func, request.method)
+    name = _view_names.get(key)
+    if name is None:
+        viewset = getattr(match.func, 'cls', None)
+        actions = getattr(match.func, 'actions', None)
+        if viewset is not None and actions:
+            action = actions.get(request.method.lower(), request.method.lower())
+            name = f"{viewset.__name__}.{action}"
+        else:
+            name = match.view_name or "unnamed"
+        _view_names[key] = name
+    return name
+
+
+class MetricsMiddleware:
+    """
+    Records the metrics of every request but the scrapes of /metrics.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        state, token, start = self.begin()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.end(request, response, state, start)
+
+    async def __acall__(self, request):
+        state, token, start = self.begin()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.end(request, response, state, start)
+
+    @staticmethod
+    def begin():
+        state = RequestMetrics()
+        return state, _current.set(state), time.perf_counter()
+
+    def end(self, request, response, state, start):
+        elapsed = time.perf_counter() - start
+        view = get_view_name(request)
+        if view == "agency:metrics":
+            return response
+
+        labels = (view, )
+        REQUEST_DURATION.observe((view, request.method, str(response.status_code)), elapsed)
+        REQUEST_QUERIES.observe(labels, state.queries)
+        if state.queries:
+            QUERY_DURATION.inc(labels, state.query_seconds)
+        if state.serializer_seconds:
+            SERIALIZER_DURATION.observe(labels, state.serializer_seconds)
+        if response.streaming:
+            # Counted as the server reads the body, async bodies aren't
+            if not response.is_async:
+                response.streaming_content = _count_bytes(response.streaming_content, labels)
+        else:
+            RESPONSE_BYTES.observe(labels, len(response.content))
+        maybe_flush()
+        return response
+
+
+def _count_bytes(content, labels):
+    size = 0
+    try:
+        for chunk in content:
+            size += len(chunk)
+            yield chunk
+    finally:
+        RESPONSE_BYTES.observe(labels, size)
+
+
+# Several processes
+
+_flushed_at = 0.0
+
+
+def get_metrics_dir():
+    path = getattr(settings, 'METRICS_DIR', None)
+    return Path(path) if path else None
+
+
+def maybe_flush():
+    if get_metrics_dir() is not None and time.monotonic() - _flushed_at >= getattr(settings, 'METRICS_FLUSH_INTERVAL', 5):
+        flush()
+
+
+def flush():
+    """
+    Writes this process' samples to METRICS_DIR.
+    """
+    global _flushed_at
+    directory = get_metrics_dir()
+    if directory is None:
+        return
+    _flushed_at = time.monotonic()
+    data = {metric.name: [[list(labels), value] for labels, value in metric.snapshot().items()] for metric in METRICS}
+    directory.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile('w', dir=directory, suffix='.tmp', delete=False) as file:
+        json.dump(data, file)
+    os.replace(file.name, directory / f"{os.getpid()}.json")
+
+
+def collect():
+    """
+    {metric: {labels: value}} of this process, or of every process that
+    wrote to METRICS_DIR.
+    """
+    directory = get_metrics_dir()
+    if directory is None:
+        return {metric: metric.snapshot() for metric in METRICS}
+
+    flush()
+    merged = {metric: {} for metric in METRICS}
+    by_name = {metric.name: metric for metric in METRICS}
+    for path in directory.glob("*.json"):
+        try:
+            data = json.loads(path.read_text())
+        except (OSError, ValueError):
+            # Being replaced right now
+            continue
+        for name, samples in data.items():
+            metric = by_name.get(name)
+            if metric is None:
+                continue
+            values = merged[metric]
+            for labels, value in samples:
+                labels = tuple(labels)
+                values[labels] = metric.merge(values[labels], value) if labels in values else value
+    return merged
+
+
+# Exposition
+
+def _format_number(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return repr(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _line(name, labels, value):
+    if labels:
+        labels = ",".join(f'{key}="{_escape(label)}"' for key, label in labels)
+        return f"{name}{{{labels}}} {_format_number(value)}"
+    return f"{name} {_format_number(value)}"
+
+
+def render():
+    from .cache import get_cache_stats
+
+    lines = []
+    for metric, values in collect().items():
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for labels in sorted(values):
+            named = tuple(zip(metric.labelnames, labels))
+            lines.extend(_line(*sample) for sample in metric.samples(named, values[labels]))
+
+    # Kept in the shared cache, so already the total of all processes
+    lines.append("# HELP agency_response_cache_requests_total Catalogue responses served from the response cache or built.")
+    lines.append("# TYPE agency_response_cache_requests_total counter")
+    for result, count in get_cache_stats().items():
+        lines.append(_line("agency_response_cache_requests_total", (("result", result), ), count))
+    return "\n".join(lines) + "\n"
+
+
+def metrics_view(request):
+    """
+    /metrics, behind `Authorization: Bearer <METRICS_TOKEN>` when it is set,
+    not served at all without a token unless METRICS_PUBLIC.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if not token and not getattr(settings, 'METRICS_PUBLIC', False):
+        raise Http404
+    if token and not constant_time_compare(request.headers.get('Authorization', ''), f"Bearer {token}"):
+        return HttpResponseForbidden()
+    return HttpResponse(render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,35 @@
+# Generated by Django 5.1.1 on 2026-10-17 00:00
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_current_members(apps, schema_editor):
+    Trip = apps.get_model("agency", "Trip")
+    TripDate = apps.get_model("agency", "TripDate")
+    booked = (
+        TripDate.objects.filter(trip=OuterRef("pk"))
+        .values("trip")
+        .annotate(total=Sum("current_members"))
+        .values("total")
+    )
+    Trip.objects.update(current_members=Coalesce(Subquery(booked), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("agency", "0003_notificationoutbox"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="trip",
+            name="current_members",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, verbose_name="Количество брони"
+            ),
+        ),
+        migrations.RunPython(fill_current_members, migrations.RunPython.noop),
+    ]
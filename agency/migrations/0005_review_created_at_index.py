@@ -0,0 +1,19 @@
+# Generated by Django 5.1.1 on 2026-10-17 00:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("agency", "0004_trip_current_members"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="review",
+            index=models.Index(
+                fields=["created_at"], name="agency_revi_created_4b0e42_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,86 @@
+# Generated by Django 5.1.1 on 2026-10-17 00:04
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def fill_country_index(apps, schema_editor):
+    Trip = apps.get_model("agency", "Trip")
+    TripPhoto = apps.get_model("agency", "TripPhoto")
+    CountryIndex = apps.get_model("agency", "CountryIndex")
+
+    summaries = Trip.objects.values("country").annotate(
+        trip_count=Count("id", distinct=True),
+        min_price=Min("trip_dates__price"),
+    )
+    for summary in summaries:
+        photos = TripPhoto.objects.filter(
+            trip__country=summary["country"], type="gallery"
+        ).order_by("id")
+        CountryIndex.objects.create(
+            gallery_photos=list(photos.values_list("photo", flat=True)), **summary
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("agency", "0005_review_created_at_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CountryIndex",
+            fields=[
+                (
+                    "country",
+                    models.CharField(
+                        choices=[
+                            ("cz", "Чехия"),
+                            ("it", "Италия"),
+                            ("is", "Исландия"),
+                            ("eg", "Египет"),
+                            ("pt", "Португалия"),
+                            ("es", "Испания"),
+                            ("jo", "Иордания"),
+                            ("fr", "Франция"),
+                            ("nl", "Нидерланды"),
+                            ("no", "Норвегия"),
+                        ],
+                        max_length=2,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="Страна",
+                    ),
+                ),
+                (
+                    "trip_count",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="Количество туров"
+                    ),
+                ),
+                (
+                    "min_price",
+                    models.DecimalField(
+                        blank=True,
+                        decimal_places=0,
+                        max_digits=10,
+                        null=True,
+                        verbose_name="Мин. цена",
+                    ),
+                ),
+                (
+                    "gallery_photos",
+                    models.JSONField(
+                        blank=True, default=list, verbose_name="Фото галереи"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Страна",
+                "verbose_name_plural": "Индекс стран",
+                "ordering": ["country"],
+            },
+        ),
+        migrations.RunPython(fill_country_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.1 on 2026-10-17 00:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("agency", "0006_countryindex"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="review",
+            name="variants",
+            field=models.JSONField(
+                blank=True, default=dict, editable=False, verbose_name="Размеры"
+            ),
+        ),
+        migrations.AddField(
+            model_name="tripphoto",
+            name="variants",
+            field=models.JSONField(
+                blank=True, default=dict, editable=False, verbose_name="Размеры"
+            ),
+        ),
+    ]
@@ -0,0 +1,103 @@
+# Generated by Django 5.1.1 on 2026-10-17 00:23
+
+from django.db import migrations, models
+
+
+# The keywords TripRequest.clean() used to check in notes
+LEGACY_KEYWORDS = ["http", "www", "куплю", "продам"]
+
+
+def create_legacy_rules(apps, schema_editor):
+    SpamRule = apps.get_model("agency", "SpamRule")
+    SpamRule.objects.bulk_create(
+        SpamRule(pattern=keyword, kind="keyword", field="notes", weight=1.0)
+        for keyword in LEGACY_KEYWORDS
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("agency", "0007_image_variants"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SpamRule",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("pattern", models.CharField(max_length=255, verbose_name="Шаблон")),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[
+                            ("keyword", "Слово или фраза"),
+                            ("regex", "Регулярное выражение"),
+                        ],
+                        default="keyword",
+                        max_length=7,
+                        verbose_name="Тип",
+                    ),
+                ),
+                (
+                    "field",
+                    models.CharField(
+                        choices=[
+                            ("any", "Любое поле"),
+                            ("name", "Имя"),
+                            ("notes", "Комментарий"),
+                            ("email", "Email"),
+                            ("phone", "Телефон"),
+                        ],
+                        default="any",
+                        max_length=5,
+                        verbose_name="Поле",
+                    ),
+                ),
+                ("weight", models.FloatField(default=1.0, verbose_name="Вес")),
+                (
+                    "is_active",
+                    models.BooleanField(default=True, verbose_name="Активно"),
+                ),
+            ],
+            options={
+                "verbose_name": "Правило спама",
+                "verbose_name_plural": "Правила спама",
+                "ordering": ["id"],
+            },
+        ),
+        migrations.CreateModel(
+            name="SpamToken",
+            fields=[
+                (
+                    "token",
+                    models.CharField(max_length=64, primary_key=True, serialize=False),
+                ),
+                ("spam_count", models.PositiveIntegerField(default=0)),
+                ("ham_count", models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="triprequest",
+            name="spam_reviewed",
+            field=models.BooleanField(
+                default=False, editable=False, verbose_name="Проверено"
+            ),
+        ),
+        migrations.AddField(
+            model_name="triprequest",
+            name="spam_score",
+            field=models.FloatField(
+                default=0, editable=False, verbose_name="Оценка спама"
+            ),
+        ),
+        migrations.RunPython(create_legacy_rules, migrations.RunPython.noop),
+    ]
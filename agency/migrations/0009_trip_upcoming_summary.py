@@ -0,0 +1,102 @@
+# Generated by Django 5.1.1 on 2026-10-17 00:48
+
+from django.db import migrations, models
+from django.db.models import Count, Exists, F, Max, Min, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+
+def fill_upcoming_summary(apps, schema_editor):
+    Trip = apps.get_model("agency", "Trip")
+    TripDate = apps.get_model("agency", "TripDate")
+    upcoming = TripDate.objects.filter(trip=OuterRef("pk"), start_date__gte=timezone.localdate()).order_by()
+    next_date = upcoming.order_by("start_date", "id")
+
+    def aggregate(expression):
+        return Subquery(upcoming.values("trip").annotate(value=expression).values("value"))
+
+    Trip.objects.update(
+        next_start_date=Subquery(next_date.values("start_date")[:1]),
+        next_end_date=Subquery(next_date.values("end_date")[:1]),
+        min_price=aggregate(Min("price")),
+        max_price=aggregate(Max("price")),
+        has_special_offer=Exists(upcoming.filter(is_special_offer=True)),
+        free_seats=Greatest(
+            F("group_size") * Coalesce(aggregate(Count("id")), Value(0))
+            - Coalesce(aggregate(Sum("current_members")), Value(0)),
+            Value(0),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("agency", "0008_spam_scoring"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="trip",
+            name="free_seats",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, verbose_name="Свободных мест"
+            ),
+        ),
+        migrations.AddField(
+            model_name="trip",
+            name="has_special_offer",
+            field=models.BooleanField(
+                default=False, editable=False, verbose_name="Есть спецпредложение"
+            ),
+        ),
+        migrations.AddField(
+            model_name="trip",
+            name="max_price",
+            field=models.DecimalField(
+                decimal_places=0,
+                editable=False,
+                max_digits=10,
+                null=True,
+                verbose_name="Макс. цена",
+            ),
+        ),
+        migrations.AddField(
+            model_name="trip",
+            name="min_price",
+            field=models.DecimalField(
+                decimal_places=0,
+                editable=False,
+                max_digits=10,
+                null=True,
+                verbose_name="Мин. цена",
+            ),
+        ),
+        migrations.AddField(
+            model_name="trip",
+            name="next_end_date",
+            field=models.DateField(
+                editable=False, null=True, verbose_name="Окончание ближайшего выезда"
+            ),
+        ),
+        migrations.AddField(
+            model_name="trip",
+            name="next_start_date",
+            field=models.DateField(
+                editable=False, null=True, verbose_name="Ближайший выезд"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="trip",
+            index=models.Index(
+                fields=["next_start_date"], name="agency_trip_next_st_72de3a_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="trip",
+            index=models.Index(
+                fields=["min_price"], name="agency_trip_min_pri_16f881_idx"
+            ),
+        ),
+        migrations.RunPython(fill_upcoming_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.1.1 on 2026-10-17 00:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("agency", "0009_trip_upcoming_summary"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="tripdate",
+            index=models.Index(
+                fields=["start_date", "end_date", "price"],
+                name="agency_trip_start_d_f171c1_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="tripdate",
+            index=models.Index(
+                fields=["trip", "start_date"], name="agency_trip_trip_id_0c194c_idx"
+            ),
+        ),
+    ]
@@ -1,18 +1,69 @@
 import re
+import random
 import logging
-import requests
 
-from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.db import models
-from django.db.models import Sum
+from django.db import models, transaction
+from django.db.models import Count, Exists, F, Max, Min, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest, Now
 from django.utils import timezone
 from django.urls import reverse
 
+from .cache import invalidate_trip
+from .spam import compile_rule, score_request
+
 
 logger = logging.getLogger(__name__)
 
 
+def booked_seats_subquery():
+    """
+    Correlated subquery with the seats booked over all dates of the outer Trip.
+    """
+    return Coalesce(
+        Subquery(
+            TripDate.objects.filter(trip=OuterRef('pk'))
+            .values('trip')
+            .annotate(total=Sum('current_members'))
+            .values('total')
+        ),
+        Value(0),
+    )
+
+
+def upcoming_summary(today=None):
+    """
+    `Trip.objects.update()` kwargs recomputing the stored summary of the
+    outer Trip's upcoming dates (starting today or later) in one UPDATE.
+    """
+    upcoming = TripDate.objects.filter(trip=OuterRef('pk'), start_date__gte=today or timezone.localdate()).order_by()
+    next_date = upcoming.order_by('start_date', 'id')
+
+    def aggregate(expression):
+        return Subquery(upcoming.values('trip').annotate(value=expression).values('value'))
+
+    return {
+        'next_start_date': Subquery(next_date.values('start_date')[:1]),
+        'next_end_date': Subquery(next_date.values('end_date')[:1]),
+        'min_price': aggregate(Min('price')),
+        'max_price': aggregate(Max('price')),
+        'has_special_offer': Exists(upcoming.filter(is_special_offer=True)),
+        'free_seats': Greatest(
+            F('group_size') * Coalesce(aggregate(Count('id')), Value(0))
+            - Coalesce(aggregate(Sum('current_members')), Value(0)),
+            Value(0),
+        ),
+    }
+
+
+def touch_trip(trip_id):
+    """
+    Moves the trip's updated_at forward after a change to one of its rows:
+    a deleted row leaves no timestamp of its own behind.
+    """
+    Trip.objects.filter(pk=trip_id).update(updated_at=Now())
+
+
 # Must be to connect to img models these functions!
 def image_upload_path(instance, filename):
 
@@ -52,25 +103,60 @@ class Trip(models.Model):
     ask_title = models.CharField("Вопрос", max_length=60)
     description = models.TextField("Описания тура")
     created_at = models.DateTimeField(auto_now_add=True)
+    # Last change of the trip or any of its rows, see touch_trip(); the
+    # Last-Modified of catalogue responses, see agency/http_cache.py
+    updated_at = models.DateTimeField(auto_now=True)
     slug = models.SlugField(unique=True, blank=True)
     seo_title = models.CharField(max_length=60, blank=True)
     seo_description = models.TextField(blank=True)
+    # Sum of TripDate.current_members, kept by TripDate.reserve() and signals
+    current_members = models.PositiveIntegerField("Количество брони", default=0, editable=False)
+    # Summary of the upcoming dates, see upcoming_summary(); kept by the
+    # TripDate signals and refreshed daily by `manage.py refresh_trip_summaries`
+    next_start_date = models.DateField("Ближайший выезд", null=True, editable=False)
+    next_end_date = models.DateField("Окончание ближайшего выезда", null=True, editable=False)
+    min_price = models.DecimalField("Мин. цена", max_digits=10, decimal_places=0, null=True, editable=False)
+    max_price = models.DecimalField("Макс. цена", max_digits=10, decimal_places=0, null=True, editable=False)
+    has_special_offer = models.BooleanField("Есть спецпредложение", default=False, editable=False)
+    free_seats = models.PositiveIntegerField("Свободных мест", default=0, editable=False)
+
+    # Only changed through UPDATE queries
+    COMPUTED_FIELDS = (
+        'current_members', 'next_start_date', 'next_end_date', 'min_price', 'max_price',
+        'has_special_offer', 'free_seats',
+    )
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        # Computed fields only change through F() and subquery updates,
+        # never write back a copy that may be stale by now
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COMPUTED_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
     def get_absolute_url(self):
         return reverse('trip_detail', kwargs={'pk': self.pk})
 
-    @property
-    def current_members(self):
-        return self.trip_dates.aggregate(total=Sum('current_numbers'))['total'] or 0
+    def refresh_current_members(self):
+        """
+        Recounts booked seats over all dates in a single UPDATE.
+        """
+        Trip.objects.filter(pk=self.pk).update(current_members=booked_seats_subquery(), updated_at=Now())
+        self.refresh_from_db(fields=['current_members'])
 
     class Meta:
         indexes = [
             models.Index(fields=['title']),
             models.Index(fields=['country']),
-            models.Index(fields=['created_at'])
+            models.Index(fields=['created_at']),
+            models.Index(fields=['updated_at']),
+            models.Index(fields=['next_start_date']),
+            models.Index(fields=['min_price']),
         ]
 
 
@@ -85,6 +171,9 @@ class TripPhoto(models.Model):
     photo = models.ImageField(upload_to=image_upload_path)
     type = models.CharField(max_length=7, choices=PHOTO_TYPE_CHOICES)
     caption = models.CharField("Подпись", max_length=100, blank=True)
+    # Resized JPEG/WebP copies, filled in by agency.images
+    variants = models.JSONField("Размеры", default=dict, blank=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         constraints = [
@@ -106,6 +195,7 @@ class ProgramByDay(models.Model):
     description = models.TextField("Описание дня")
     accommodation = models.TextField("Проживание", blank=True)
     meal_plan = models.CharField("Питание", max_length=100, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['day_number']
@@ -118,6 +208,7 @@ class IncludedFeature(models.Model):
     title = models.CharField("Пункт", max_length=60)
     description = models.CharField("Описание", max_length=200)
     icon = models.CharField("Иконка (FontAwesome)", max_length=30, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"{self.title} ({self.trip.title})"
@@ -134,6 +225,7 @@ class TripDate(models.Model):
     current_members = models.PositiveIntegerField("Количество брони", default=0)
     is_special_offer = models.BooleanField("Спецпредложение", default=False)
     icon = models.CharField("Иконка офера (FontAwesome)", max_length=30, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def clean(self):
         if self.start_date >= self.end_date:
@@ -146,9 +238,62 @@ class TripDate(models.Model):
     def available_spots(self):
         return self.trip.group_size - self.current_members
 
+    def reserve(self, seats):
+        """
+        Books `seats` on this date, raises ValidationError if they don't fit.
+
+        The check and the increment happen in one conditional UPDATE on the
+        locked row, so concurrent bookings can never oversell the date.
+        """
+        if seats < 1:
+            raise ValidationError("Количество мест должно быть положительным.")
+
+        with transaction.atomic():
+            trip_date = TripDate.objects.select_for_update().get(pk=self.pk)
+            updated = TripDate.objects.filter(
+                pk=self.pk,
+                current_members__lte=F('trip__group_size') - seats,
+            ).update(current_members=F('current_members') + seats, updated_at=Now())
+            if not updated:
+                raise ValidationError("Недостаточно свободных мест.")
+            Trip.objects.filter(pk=trip_date.trip_id).update(
+                current_members=F('current_members') + seats, updated_at=Now(), **upcoming_summary(),
+            )
+
+        # .update() sends no signals
+        invalidate_trip(trip_date.trip_id)
+        self.refresh_from_db(fields=['current_members'])
+
+    def release(self, seats):
+        """
+        Cancels `seats` booked seats on this date.
+        """
+        with transaction.atomic():
+            trip_date = TripDate.objects.select_for_update().get(pk=self.pk)
+            updated = TripDate.objects.filter(
+                pk=self.pk,
+                current_members__gte=seats,
+            ).update(current_members=F('current_members') - seats, updated_at=Now())
+            if not updated:
+                raise ValidationError("Нельзя отменить больше мест, чем забронировано.")
+            Trip.objects.filter(pk=trip_date.trip_id).update(
+                current_members=F('current_members') - seats, updated_at=Now(), **upcoming_summary(),
+            )
+
+        invalidate_trip(trip_date.trip_id)
+        self.refresh_from_db(fields=['current_members'])
+
     def __str__(self):
         return f"{self.start_date} - {self.end_date} ({self.price}€)"
 
+    class Meta:
+        indexes = [
+            # Range scans of the departure calendar
+            models.Index(fields=['start_date', 'end_date', 'price']),
+            # Upcoming dates of one trip, see upcoming_summary()
+            models.Index(fields=['trip', 'start_date']),
+        ]
+
 
 class TripRequest(models.Model):
     CONTACT_METHODS = [
@@ -165,26 +310,17 @@ class TripRequest(models.Model):
     notes = models.TextField("Комментарий", blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     is_spam = models.BooleanField(default=False)
+    spam_score = models.FloatField("Оценка спама", default=0, editable=False)
+    # Marked by an operator, counted in the naive Bayes stats
+    spam_reviewed = models.BooleanField("Проверено", default=False, editable=False)
 
     def clean(self):
-        # Проверка на частые запросы
-        recent_requests = TripRequest.objects.filter(
-            phone=self.phone,
-            created_at__gte=timezone.now() - timezone.timedelta(hours=1)
-        ).count()
-
-        if recent_requests >= 3:
-            raise ValidationError("Слишком много запросов. Попробуйте позже.")
-
-        spam_keywords = ['http', 'www', 'куплю', 'продам']
-        if any(keyword in self.notes.lower() for keyword in spam_keywords):
-            self.is_spam = True
-
+        # Submission rate is limited by agency.throttles, spam is scored in save()
         if not re.match(r'^\+?[1-9]\d{7,14}$', self.phone):
             raise ValidationError("Некорректный номер телефона.")
 
-    def send_telegram_notification(self):
-        message = (
+    def get_telegram_message(self):
+        return (
             f"🚀 Новая заявка!\n"
             f"Тур: {self.trip.title}\n"
             f"Имя: {self.name}\n"
@@ -192,24 +328,19 @@ class TripRequest(models.Model):
             f"Способ связи: {self.get_preferred_contact_display()}"
         )
 
-        url = f"https://api.telegram.org/bot{settings.TELEGRAM_BOT_TOKEN}/sendMessage"
-        payload = {
-            "chat_id": settings.TELEGRAM_CHAT_ID,
-            "text": message,
-            "parse_mode": "HTML"
-        }
-
-        try:
-            response = requests.post(url, json=payload, timeout=5)
-            response.raise_for_status()  # check HTTP status
-        except Exception as e:
-            logger.error(f"Telegram notification failed: {str(e)}")
-
     def save(self, *args, **kwargs):
         is_new = self._state.adding
-        super().save(*args, **kwargs)
-        if is_new and not self.is_spam:
-            self.send_telegram_notification()
+        if is_new and not self.spam_reviewed:
+            result = score_request(self)
+            self.spam_score = result.score
+            self.is_spam = self.is_spam or result.is_spam
+
+        # Notification is queued in the same transaction and sent by
+        # `manage.py process_outbox`, never inside the request cycle
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if is_new and not self.is_spam:
+                NotificationOutbox.objects.create(trip_request=self, text=self.get_telegram_message())
 
     class Meta:
         indexes = [
@@ -221,11 +352,88 @@ class TripRequest(models.Model):
         return f"Request for {self.trip.title} by {self.name}"
 
 
+class NotificationOutbox(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'В очереди'),
+        ('sent', 'Отправлено'),
+        ('dead', 'Не доставлено'),
+    ]
+
+    trip_request = models.ForeignKey(TripRequest, on_delete=models.CASCADE, related_name='notifications')
+    text = models.TextField("Сообщение")
+    status = models.CharField("Статус", max_length=7, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField("Попытки", default=0)
+    next_attempt_at = models.DateTimeField("Следующая попытка", default=timezone.now)
+    last_error = models.TextField("Последняя ошибка", blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField("Отправлено", null=True, blank=True)
+
+    class Meta:
+        ordering = ['next_attempt_at', 'id']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+        verbose_name = "Уведомление"
+        verbose_name_plural = "Очередь уведомлений"
+
+    def __str__(self):
+        return f"Notification #{self.pk} ({self.status})"
+
+
+class SpamRule(models.Model):
+    KIND_CHOICES = [
+        ('keyword', 'Слово или фраза'),
+        ('regex', 'Регулярное выражение'),
+    ]
+    FIELD_CHOICES = [
+        ('any', 'Любое поле'),
+        ('name', 'Имя'),
+        ('notes', 'Комментарий'),
+        ('email', 'Email'),
+        ('phone', 'Телефон'),
+    ]
+
+    pattern = models.CharField("Шаблон", max_length=255)
+    kind = models.CharField("Тип", max_length=7, choices=KIND_CHOICES, default='keyword')
+    field = models.CharField("Поле", max_length=5, choices=FIELD_CHOICES, default='any')
+    weight = models.FloatField("Вес", default=1.0)
+    is_active = models.BooleanField("Активно", default=True)
+
+    class Meta:
+        ordering = ['id']
+        verbose_name = "Правило спама"
+        verbose_name_plural = "Правила спама"
+
+    def clean(self):
+        # Compiled exactly as the scorer does
+        try:
+            compile_rule(self.pattern, self.kind)
+        except re.error as e:
+            raise ValidationError({'pattern': f"Некорректное выражение: {e}"})
+
+    def __str__(self):
+        return self.pattern
+
+
+class SpamToken(models.Model):
+    """
+    Naive Bayes counts: in how many spam and not-spam requests
+    marked by an operator the token occurred.
+    """
+    token = models.CharField(max_length=64, primary_key=True)
+    spam_count = models.PositiveIntegerField(default=0)
+    ham_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.token} ({self.spam_count}/{self.ham_count})"
+
+
 class FAQ(models.Model):
     trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name='faqs')
     question = models.CharField("Вопрос", max_length=255)
     answer = models.TextField("Ответ")
     order = models.PositiveIntegerField("Порядок", default=0)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"Вопрос: {self.question} (Тур: {self.trip.title})"
@@ -234,6 +442,120 @@ class FAQ(models.Model):
         ordering = ['order']
 
 
+class RandomElement(models.Func):
+    """
+    A random element of a JSON array, NULL for an empty one.
+    """
+    output_field = models.CharField()
+
+    def compile_array(self, compiler, connection):
+        return compiler.compile(self.get_source_expressions()[0])
+
+    def as_sql(self, compiler, connection, **extra_context):
+        array, params = self.compile_array(compiler, connection)
+        return f"({array} ->> floor(random() * jsonb_array_length({array}))::int)", (*params, *params)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        array, params = self.compile_array(compiler, connection)
+        return (
+            f"json_extract({array}, '$[' || (abs(random()) % max(json_array_length({array}), 1)) || ']')",
+            (*params, *params),
+        )
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        array, params = self.compile_array(compiler, connection)
+        return (
+            f"JSON_UNQUOTE(JSON_EXTRACT({array}, CONCAT('$[', FLOOR(RAND() * JSON_LENGTH({array})), ']')))",
+            (*params, *params),
+        )
+
+
+class CountryIndex(models.Model):
+    """
+    Per-country summary behind /trips/countries/, kept up to date
+    from Trip, TripDate and TripPhoto signals.
+    """
+    country = models.CharField("Страна", max_length=2, choices=Trip.COUNTRY_CHOICES, primary_key=True)
+    trip_count = models.PositiveIntegerField("Количество туров", default=0)
+    min_price = models.DecimalField("Мин. цена", max_digits=10, decimal_places=0, null=True, blank=True)
+    gallery_photos = models.JSONField("Фото галереи", default=list, blank=True)
+
+    class Meta:
+        ordering = ['country']
+        verbose_name = "Страна"
+        verbose_name_plural = "Индекс стран"
+
+    def __str__(self):
+        return self.get_country_display()
+
+    def random_photo(self):
+        # Picked by the database when listed with_random_photo()
+        if 'picked_photo' in self.__dict__:
+            return self.picked_photo
+        return random.choice(self.gallery_photos) if self.gallery_photos else None
+
+    @classmethod
+    def with_random_photo(cls):
+        """
+        The entries with a random photo of their pool each, leaving the
+        pools themselves in the database.
+        """
+        return cls.objects.defer('gallery_photos').annotate(picked_photo=RandomElement('gallery_photos'))
+
+    @classmethod
+    def refresh(cls, *countries):
+        """
+        Recounts the given countries, drops the ones left without trips.
+        """
+        for country in set(countries):
+            summary = Trip.objects.filter(country=country).aggregate(
+                trip_count=Count('id', distinct=True),
+                min_price=Min('trip_dates__price'),
+            )
+            if not summary['trip_count']:
+                cls.objects.filter(country=country).delete()
+                continue
+
+            photos = TripPhoto.objects.filter(trip__country=country, type='gallery').order_by('id')
+            summary['gallery_photos'] = list(photos.values_list('photo', flat=True))
+            if not cls.objects.filter(country=country).update(**summary):
+                cls.objects.create(country=country, **summary)
+
+    @classmethod
+    def change(cls, country, trips=0, add_photo=None, remove_photo=None, price=None, removed_price=None):
+        """
+        Applies one saved or deleted row to the country's entry without
+        rescanning the country: a trip more or less, a gallery photo into
+        or out of the pool, the price of a date that was added or removed.
+        """
+        with transaction.atomic():
+            index = cls.objects.select_for_update().filter(country=country).first()
+            if index is None:
+                cls.refresh(country)
+                return
+
+            index.trip_count += trips
+            if index.trip_count <= 0:
+                index.delete()
+                return
+            if remove_photo is not None and remove_photo in index.gallery_photos:
+                index.gallery_photos.remove(remove_photo)
+            if add_photo is not None:
+                index.gallery_photos.append(add_photo)
+            if removed_price is not None and index.min_price is not None and removed_price <= index.min_price:
+                # It may have been the cheapest date of the country
+                index.min_price = TripDate.objects.filter(trip__country=country).aggregate(price=Min('price'))['price']
+            if price is not None and (index.min_price is None or price < index.min_price):
+                index.min_price = price
+            index.save()
+
+    @classmethod
+    def rebuild(cls):
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.refresh(*Trip.objects.values_list('country', flat=True).distinct())
+
+
 class Sociallink(models.Model):
     name = models.CharField(max_length=60)
     icon = models.CharField("FontAwesome", max_length=30, blank=True)
@@ -247,9 +569,33 @@ class Review(models.Model):
     name = models.CharField(max_length=60)
     avatar = models.ImageField(upload_to='reviews')
     text = models.TextField()
+    variants = models.JSONField("Размеры", default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at']),
+        ]
+
     def __str__(self):
         return f"Review by {self.avatar.name}"
 
 
+class MediaBlob(models.Model):
+    """
+    A stored media file and how many rows use it (the file itself or one
+    of its variants), kept by agency.blobs. Unused ones are removed by
+    `manage.py gc_media`.
+    """
+    name = models.CharField(max_length=255, primary_key=True)
+    size = models.PositiveBigIntegerField(default=0)
+    ref_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['ref_count', 'updated_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count})"
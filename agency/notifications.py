@@ -0,0 +1,120 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import metrics
+from .models import NotificationOutbox
+
+
+logger = logging.getLogger(__name__)
+
+
+class TelegramTransport:
+    """
+    Sends a message through the Telegram Bot API.
+    `api_url` can point to a local fake server in tests.
+    """
+
+    def __init__(self, token=None, chat_id=None, api_url=None, timeout=5):
+        self.token = token or settings.TELEGRAM_BOT_TOKEN
+        self.chat_id = chat_id or settings.TELEGRAM_CHAT_ID
+        self.api_url = (api_url or getattr(settings, "TELEGRAM_API_URL", "https://api.telegram.org")).rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def send(self, text):
+        url = f"{self.api_url}/bot{self.token}/sendMessage"
+        payload = {
+            "chat_id": self.chat_id,
+            "text": text,
+            "parse_mode": "HTML",
+        }
+        response = self.session.post(url, json=payload, timeout=self.timeout)
+        response.raise_for_status()  # check HTTP status
+
+
+def get_transport():
+    transport_class = getattr(settings, "TELEGRAM_TRANSPORT", "agency.notifications.TelegramTransport")
+    return import_string(transport_class)()
+
+
+def get_backoff(attempts):
+    base = getattr(settings, "TELEGRAM_OUTBOX_BACKOFF", 30)
+    return timedelta(seconds=min(base * 2 ** (attempts - 1), 60 * 60))
+
+
+def claim_batch(batch_size, lease=timedelta(minutes=5)):
+    """
+    Takes due notifications and pushes their next attempt past the lease,
+    so another worker won't pick them up while they are being sent.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        batch = list(
+            NotificationOutbox.objects
+            .select_for_update(skip_locked=True)
+            .filter(status='pending', next_attempt_at__lte=now)
+            [:batch_size]
+        )
+        NotificationOutbox.objects.filter(pk__in=[n.pk for n in batch]).update(next_attempt_at=now + lease)
+    return batch
+
+
+def _send(transport, notification):
+    start = time.perf_counter()
+    try:
+        transport.send(notification.text)
+    except Exception as e:
+        metrics.observe_telegram(time.perf_counter() - start, ok=False)
+        return e
+    metrics.observe_telegram(time.perf_counter() - start, ok=True)
+    return None
+
+
+def process_batch(transport=None, batch_size=None, workers=4):
+    """
+    Sends one batch of due notifications in a thread pool.
+    Returns counts of sent, retried and dead notifications.
+    """
+    transport = transport or get_transport()
+    batch_size = batch_size or getattr(settings, "TELEGRAM_OUTBOX_BATCH_SIZE", 50)
+    max_attempts = getattr(settings, "TELEGRAM_OUTBOX_MAX_ATTEMPTS", 5)
+
+    batch = claim_batch(batch_size)
+    counts = {'sent': 0, 'retried': 0, 'dead': 0}
+    if not batch:
+        return counts
+
+    # Threads only talk to the transport, the DB is updated from this thread
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        errors = list(executor.map(lambda n: _send(transport, n), batch))
+
+    now = timezone.now()
+    for notification, error in zip(batch, errors):
+        notification.attempts += 1
+        if error is None:
+            notification.status = 'sent'
+            notification.sent_at = now
+            notification.last_error = ""
+            counts['sent'] += 1
+        elif notification.attempts >= max_attempts:
+            notification.status = 'dead'
+            notification.last_error = str(error)
+            counts['dead'] += 1
+            logger.error(f"Telegram notification {notification.pk} is dead: {error}")
+        else:
+            notification.next_attempt_at = now + get_backoff(notification.attempts)
+            notification.last_error = str(error)
+            counts['retried'] += 1
+            logger.warning(f"Telegram notification {notification.pk} failed: {error}")
+        notification.save(update_fields=['status', 'attempts', 'next_attempt_at', 'last_error', 'sent_at'])
+
+    metrics.maybe_flush()
+    return counts
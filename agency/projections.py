@@ -0,0 +1,234 @@
+"""
+Compiled read serializers: the output of a ModelSerializer without DRF's
+per-row field machinery.
+
+`compile_serializer(TripListSerializer)` builds the serializer once,
+reads its fields and turns each into a plain function of the row: an
+attribute read and the field's conversion, picked for its type. Method
+fields are called directly, nested serializers are compiled too. Rows are
+model instances or `.values()` dicts, the output is the dict the
+serializer's `.data` holds, key for key.
+
+    project = compile_serializer(TripListSerializer, fields).bind(context)
+    data = [project(trip) for trip in trips]
+
+Serializers that override `to_representation()` can't be compiled.
+"""
+import inspect
+from functools import lru_cache, partialmethod
+from operator import attrgetter
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from django.utils.encoding import force_str
+from rest_framework import fields as drf_fields, serializers
+from rest_framework.settings import api_settings
+
+from .serializers import check_requested_fields
+
+
+class Row(dict):
+    """
+    A `.values()` row read like the model instance it came from, with its
+    `get_FOO_display()`. Columns of the row only: what method fields read
+    off related objects has to be put in it.
+    """
+    model = None
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            pass
+        if name.startswith('get_') and name.endswith('_display'):
+            try:
+                field = self.model._meta.get_field(name[4:-8])
+            except FieldDoesNotExist:
+                pass
+            else:
+                if field.flatchoices:
+                    value = self[field.attname]
+                    return lambda: force_str(dict(field.flatchoices).get(value, value), strings_only=True)
+        raise AttributeError(f"{self.model.__name__} row has no {name!r}")
+
+
+@lru_cache(maxsize=None)
+def row_class(model):
+    return type(f"{model.__name__}Row", (Row, ), {'model': model})
+
+
+class MethodSelf:
+    """
+    `self` of method fields: the compiled serializer's instance with the
+    context of the call.
+    """
+    __slots__ = ('serializer', 'context')
+
+    def __init__(self, serializer, context):
+        self.serializer = serializer
+        self.context = context
+
+    def __getattr__(self, name):
+        return getattr(self.serializer, name)
+
+
+class Projection:
+    """
+    A compiled serializer, see compile_serializer().
+    """
+
+    def __init__(self, serializer_class, fields=None):
+        if serializer_class.to_representation is not serializers.Serializer.to_representation:
+            raise TypeError(f"{serializer_class.__name__} overrides to_representation()")
+        self.serializer_class = serializer_class
+        self.model = serializer_class.Meta.model
+        # Built without a request, so SparseFieldsetMixin leaves the fields be
+        self.serializer = serializer_class()
+        readable = list(self.serializer._readable_fields)
+        if fields is not None:
+            check_requested_fields(fields, {field.field_name for field in readable})
+            readable = [field for field in readable if field.field_name in fields]
+        self.steps = [(field.field_name, self.compile_field(field)) for field in readable]
+
+    def bind(self, context=None):
+        """
+        The function of one row for the serializer context `context`.
+        """
+        context = context or {}
+        method_self = MethodSelf(self.serializer, context)
+        readers = [(name, make(context, method_self)) for name, make in self.steps]
+        rows = row_class(self.model)
+
+        def project(obj):
+            if type(obj) is dict:
+                obj = rows(obj)
+            return {name: read(obj) for name, read in readers}
+
+        return project
+
+    def __call__(self, instance, context=None):
+        return self.bind(context)(instance)
+
+    def many(self, instances, context=None):
+        project = self.bind(context)
+        return [project(instance) for instance in instances]
+
+    # Fields, each compiled to make(context, method_self) -> read(obj)
+
+    def compile_field(self, field):
+        if isinstance(field, drf_fields.SerializerMethodField):
+            return self.compile_method(field)
+
+        get = self.compile_source(field)
+        if isinstance(field, serializers.ListSerializer):
+            child = compile_serializer(type(field.child))
+
+            def make(context, method_self):
+                project = child.bind(context)
+
+                def read(obj):
+                    value = get(obj)
+                    if value is None:
+                        return None
+                    if isinstance(value, models.manager.BaseManager):
+                        value = value.all()
+                    return [project(item) for item in value]
+                return read
+            return make
+
+        if isinstance(field, serializers.BaseSerializer):
+            child = compile_serializer(type(field))
+            return self.compile_value(get, lambda context: child.bind(context))
+
+        if isinstance(field, drf_fields.FileField):
+            return self.compile_file(field, get)
+
+        convert = field.to_representation
+        method = type(field).to_representation
+        if method is drf_fields.CharField.to_representation:
+            convert = str
+        elif method is drf_fields.IntegerField.to_representation:
+            convert = int
+        elif method is drf_fields.ReadOnlyField.to_representation:
+            convert = None
+        return self.compile_value(get, lambda context: convert)
+
+    def compile_source(self, field):
+        """
+        The attribute read of `field`, as DRF's `get_attribute()` does it.
+        """
+        if field.source == '*':
+            return lambda obj: obj
+        if len(field.source_attrs) > 1:
+            return field.get_attribute
+        name = field.source
+        # Model methods such as get_country_display are called, as DRF does
+        method = inspect.getattr_static(self.model, name, None)
+        if callable(method) or isinstance(method, partialmethod):
+            return lambda obj: getattr(obj, name)()
+        return attrgetter(name)
+
+    @staticmethod
+    def compile_value(get, bind_convert):
+        def make(context, method_self):
+            convert = bind_convert(context)
+            if convert is None:
+                return get
+
+            def read(obj):
+                value = get(obj)
+                return None if value is None else convert(value)
+            return read
+        return make
+
+    def compile_method(self, field):
+        name = field.method_name
+        function = inspect.getattr_static(self.serializer_class, name)
+        static = isinstance(function, staticmethod)
+        function = getattr(self.serializer_class, name)
+
+        def make(context, method_self):
+            if static:
+                return function
+            return lambda obj: function(method_self, obj)
+        return make
+
+    def compile_file(self, field, get):
+        if not getattr(field, 'use_url', api_settings.UPLOADED_FILES_USE_URL):
+            return self.compile_value(get, lambda context: lambda value: value if isinstance(value, str) else value.name)
+        # `.values()` rows hold the file name
+        storage = self.model._meta.get_field(field.source).storage
+
+        def make(context, method_self):
+            request = context.get('request')
+
+            def read(obj):
+                value = get(obj)
+                if not value:
+                    return None
+                try:
+                    url = storage.url(value) if isinstance(value, str) else value.url
+                except AttributeError:
+                    return None
+                return request.build_absolute_uri(url) if request is not None else url
+            return read
+        return make
+
+
+@lru_cache(maxsize=256)
+def _compile(serializer_class, fields):
+    return Projection(serializer_class, fields)
+
+
+def compile_serializer(serializer_class, fields=None):
+    """
+    The Projection of `serializer_class` limited to `fields`, cached.
+    """
+    return _compile(serializer_class, frozenset(fields) if fields is not None else None)
+
+
+def can_compile(serializer_class):
+    return (
+        issubclass(serializer_class, serializers.ModelSerializer)
+        and serializer_class.to_representation is serializers.Serializer.to_representation
+    )
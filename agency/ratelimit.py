@@ -0,0 +1,110 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+from .cache import KEY_PREFIX
+
+
+DURATIONS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+_backends = {}
+
+
+def parse_rate(rate):
+    """
+    '3/hour' -> (3, 3600), same format as DRF throttle rates.
+    """
+    count, period = rate.split('/')
+    return int(count), DURATIONS[period[0]]
+
+
+class CacheRateLimitBackend:
+    """
+    Sliding window counter in a shared cache.
+
+    Hits are counted per fixed window with atomic `incr`, the previous
+    window is weighted by how much of it still overlaps the sliding one.
+    A hit is counted before it's checked, so concurrent requests can't
+    both slip under the limit; a rejected hit is taken back.
+    """
+
+    def __init__(self, alias=None, clock=time.time):
+        self.alias = alias or getattr(settings, 'RATE_LIMIT_CACHE_ALIAS', 'default')
+        self.clock = clock
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def key(self, key, window_number):
+        return f"{KEY_PREFIX}:ratelimit:{key}:{window_number}"
+
+    def hit(self, key, limit, window):
+        """
+        Returns (allowed, seconds to wait or None).
+        """
+        cache = self.cache
+        now = self.clock()
+        number, offset = divmod(now, window)
+        current_key = self.key(key, int(number))
+
+        # Two windows of lifetime: the next one still reads this as its previous
+        cache.add(current_key, 0, timeout=window * 2)
+        try:
+            count = cache.incr(current_key)
+        except ValueError:
+            # Evicted between add and incr
+            cache.set(current_key, 1, timeout=window * 2)
+            count = 1
+        previous = cache.get(self.key(key, int(number) - 1), 0)
+
+        overlap = 1 - offset / window
+        if previous * overlap + count <= limit:
+            return True, None
+
+        cache.decr(current_key)
+        if count > limit or not previous:
+            # The current window alone is full
+            return False, window - offset
+        # Wait until the previous window has slid far enough out
+        return False, max(0.0, (1 - (limit - count) / previous) * window - offset)
+
+
+class TokenBucketRateLimitBackend:
+    """
+    In-process token bucket, `limit` tokens refilled over `window` seconds.
+
+    State lives in this process only: meant for tests and single-process
+    development servers.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def hit(self, key, limit, window):
+        rate = limit / window
+        with self.lock:
+            now = self.clock()
+            tokens, updated = self.buckets.get(key, (limit, now))
+            tokens = min(limit, tokens + (now - updated) * rate)
+            if tokens < 1:
+                self.buckets[key] = (tokens, now)
+                return False, (1 - tokens) / rate
+            self.buckets[key] = (tokens - 1, now)
+            return True, None
+
+    def reset(self):
+        with self.lock:
+            self.buckets.clear()
+
+
+def get_backend():
+    path = getattr(settings, 'RATE_LIMIT_BACKEND', 'agency.ratelimit.CacheRateLimitBackend')
+    if path not in _backends:
+        _backends[path] = import_string(path)()
+    return _backends[path]
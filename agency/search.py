@@ -0,0 +1,376 @@
+import re
+import threading
+import time
+from collections import defaultdict
+from functools import lru_cache
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from .cache import KEY_PREFIX, bump_version, get_cache, get_version
+from .models import Trip, ProgramByDay, FAQ, TripDate
+
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+CYRILLIC_RE = re.compile(r"[а-я]")
+
+# Light suffix stripping, longest endings first
+RUSSIAN_ENDINGS = sorted([
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ией', 'иях', 'ях', 'ах',
+    'ов', 'ев', 'ей', 'ий', 'ый', 'ой', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ую', 'юю', 'ом',
+    'ем', 'ам', 'им', 'ым', 'их', 'ых', 'ия', 'ии', 'ья', 'ье', 'ию', 'ью', 'ть', 'ет', 'ут',
+    'ют', 'ит', 'ат', 'ят', 'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+], key=len, reverse=True)
+ENGLISH_ENDINGS = ['ing', 'ed', 'es', 's']
+MIN_STEM = 3
+
+# Field weights for ranking
+WEIGHTS = {
+    'title': 3,
+    'welcome_message': 2,
+    'description': 1,
+    'program': 1,
+    'faq': 1,
+}
+
+# (from, to exclusive, label)
+DURATION_BUCKETS = [(0, 4, '1-3'), (4, 8, '4-7'), (8, 15, '8-14'), (15, None, '15+')]
+PRICE_BUCKETS = [(0, 500, '0-500'), (500, 1000, '500-1000'), (1000, 2000, '1000-2000'), (2000, None, '2000+')]
+
+# Numbered log of reindexed trip ids shared by the processes, see TripSearchIndex
+CHANGES_SEQ_KEY = f"{KEY_PREFIX}:search:seq"
+CHANGES_TIMEOUT = 24 * 60 * 60
+
+
+def change_key(seq):
+    return f"{KEY_PREFIX}:search:change:{seq}"
+
+
+@lru_cache(maxsize=100_000)
+def stem(word):
+    endings = RUSSIAN_ENDINGS if CYRILLIC_RE.search(word) else ENGLISH_ENDINGS
+    for ending in endings:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(text):
+    """
+    Lowercased, ё-folded, stemmed tokens of `text`.
+    """
+    text = (text or '').lower().replace('ё', 'е')
+    return [stem(token) for token in TOKEN_RE.findall(text)]
+
+
+def _bucket(value, buckets):
+    for low, high, label in buckets:
+        if value >= low and (high is None or value < high):
+            return label
+    return None
+
+
+@dataclass
+class TripDocument:
+    id: int
+    country: str
+    duration_days: int
+    duration_bucket: str
+    # (start_date, price, 'YYYY-MM') per TripDate
+    dates: list = field(default_factory=list)
+    # token -> weight, kept to unlink the trip from the postings on update
+    tokens: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_row(cls, row, texts, dates):
+        """
+        `row` is (id, title, welcome_message, description, country, duration_days),
+        `texts` are (field name, text) pairs of program days and FAQs,
+        `dates` are (start_date, price) pairs.
+        """
+        trip_id, title, welcome_message, description, country, duration_days = row
+        tokens = defaultdict(int)
+        texts = [('title', title), ('welcome_message', welcome_message), ('description', description), *texts]
+        for name, text in texts:
+            weight = WEIGHTS[name]
+            for token in set(tokenize(text)):
+                if tokens[token] < weight:
+                    tokens[token] = weight
+
+        return cls(
+            id=trip_id,
+            country=country,
+            duration_days=duration_days,
+            duration_bucket=_bucket(duration_days, DURATION_BUCKETS),
+            dates=[(start, price, start.strftime('%Y-%m')) for start, price in dates],
+            tokens=dict(tokens),
+        )
+
+
+def load_documents(trip_ids=None, chunk_size=500):
+    """
+    Yields a TripDocument per trip, reading plain rows in chunks of trips.
+    """
+    trips = Trip.objects.order_by('pk').values_list(
+        'id', 'title', 'welcome_message', 'description', 'country', 'duration_days',
+    )
+    if trip_ids is not None:
+        trips = trips.filter(pk__in=trip_ids)
+
+    last_id = 0
+    while True:
+        chunk = list(trips.filter(pk__gt=last_id)[:chunk_size])
+        if not chunk:
+            return
+        ids = [row[0] for row in chunk]
+        last_id = ids[-1]
+
+        texts, dates = defaultdict(list), defaultdict(list)
+        for trip_id, title, description in ProgramByDay.objects.filter(trip_id__in=ids) \
+                .values_list('trip_id', 'title', 'description'):
+            texts[trip_id].append(('program', f"{title} {description}"))
+        for trip_id, question, answer in FAQ.objects.filter(trip_id__in=ids) \
+                .values_list('trip_id', 'question', 'answer'):
+            texts[trip_id].append(('faq', f"{question} {answer}"))
+        for trip_id, start, price in TripDate.objects.filter(trip_id__in=ids) \
+                .values_list('trip_id', 'start_date', 'price'):
+            dates[trip_id].append((start, price))
+
+        for row in chunk:
+            yield TripDocument.from_row(row, texts[row[0]], dates[row[0]])
+
+
+@dataclass
+class SearchFilters:
+    countries: set = None
+    duration_min: int = None
+    duration_max: int = None
+    price_min: float = None
+    price_max: float = None
+    date_from: object = None
+    date_to: object = None
+
+    def country_ok(self, doc):
+        return not self.countries or doc.country in self.countries
+
+    def duration_ok(self, doc):
+        return (
+            (self.duration_min is None or doc.duration_days >= self.duration_min)
+            and (self.duration_max is None or doc.duration_days <= self.duration_max)
+        )
+
+    def in_window(self, start):
+        return (self.date_from is None or start >= self.date_from) and (self.date_to is None or start <= self.date_to)
+
+    def in_price(self, price):
+        return (self.price_min is None or price >= self.price_min) and (self.price_max is None or price <= self.price_max)
+
+
+class TripSearchIndex:
+    """
+    Inverted index over the trip catalogue, held in process memory.
+
+    The process that saves a trip reindexes it and appends its id to a
+    numbered change log in the shared cache. The other processes replay
+    the entries they haven't seen on their next search. When entries are
+    missing (evicted, or too many) the index is rebuilt in a background
+    thread, and the old one answers until the new one is ready.
+    """
+
+    def __init__(self):
+        self.postings = defaultdict(dict)  # token -> {trip_id: weight}
+        self.docs = {}
+        self.lock = threading.RLock()
+        self.seq = None
+        self.built_at = None
+        self.rebuilding = None
+
+    def build(self):
+        postings, docs = defaultdict(dict), {}
+        # Read first: changes saved during the build are replayed afterwards
+        seq = get_version(CHANGES_SEQ_KEY)
+        for doc in load_documents():
+            docs[doc.id] = doc
+            for token, weight in doc.tokens.items():
+                postings[token][doc.id] = weight
+
+        with self.lock:
+            self.postings, self.docs = postings, docs
+            self.seq, self.built_at = seq, time.monotonic()
+
+    def add(self, doc):
+        with self.lock:
+            self.remove(doc.id)
+            self.docs[doc.id] = doc
+            for token, weight in doc.tokens.items():
+                self.postings[token][doc.id] = weight
+
+    def remove(self, trip_id):
+        with self.lock:
+            doc = self.docs.pop(trip_id, None)
+            if doc is None:
+                return
+            for token in doc.tokens:
+                trips = self.postings.get(token)
+                if trips is not None:
+                    trips.pop(trip_id, None)
+                    if not trips:
+                        del self.postings[token]
+
+    def reindex(self, trip_ids):
+        docs = {doc.id: doc for doc in load_documents(trip_ids)}
+        for trip_id in trip_ids:
+            if trip_id in docs:
+                self.add(docs[trip_id])
+            else:
+                self.remove(trip_id)
+
+    def catch_up(self):
+        """
+        Replays the change log up to its current number, or starts a
+        rebuild when part of it is gone.
+        """
+        seq = get_version(CHANGES_SEQ_KEY)
+        with self.lock:
+            applied = self.seq
+        if applied is None or seq == applied or self.rebuilding is not None:
+            return
+
+        missing = seq < applied or seq - applied > getattr(settings, 'SEARCH_INDEX_MAX_CHANGES', 500)
+        if not missing:
+            keys = [change_key(number) for number in range(applied + 1, seq + 1)]
+            changes = get_cache().get_many(keys)
+            missing = len(changes) < len(keys)
+        if missing:
+            self.start_rebuild()
+            return
+
+        self.reindex({trip_id for trip_ids in changes.values() for trip_id in trip_ids})
+        with self.lock:
+            self.seq = max(self.seq, seq)
+
+    def start_rebuild(self):
+        def rebuild():
+            try:
+                self.build()
+            finally:
+                self.rebuilding = None
+                connections.close_all()
+
+        with _build_lock:
+            if self.rebuilding is None:
+                self.rebuilding = threading.Thread(target=rebuild, name="search-index-rebuild", daemon=True)
+                self.rebuilding.start()
+
+    def match(self, query):
+        """
+        {trip_id: score} of trips containing every query token.
+        """
+        tokens = tokenize(query)
+        with self.lock:
+            if not tokens:
+                return {trip_id: 0 for trip_id in self.docs}
+            postings = sorted((self.postings.get(token, {}) for token in set(tokens)), key=len)
+            scores = dict(postings[0])
+            for trips in postings[1:]:
+                scores = {trip_id: score + trips[trip_id] for trip_id, score in scores.items() if trip_id in trips}
+            return scores
+
+    def search(self, query, filters):
+        """
+        Returns ranked trip ids and facet counts. Each facet is counted
+        with every filter applied except its own.
+        """
+        scores = self.match(query)
+        with self.lock:
+            docs = [self.docs[trip_id] for trip_id in scores]
+
+        has_window = filters.date_from is not None or filters.date_to is not None
+        has_price = filters.price_min is not None or filters.price_max is not None
+
+        ids = []
+        country_facet, duration_facet = defaultdict(int), defaultdict(int)
+        price_facet, month_facet = defaultdict(int), defaultdict(int)
+        # One pass per document: each check is done once and reused by the facets
+        for doc in docs:
+            country_ok = filters.country_ok(doc)
+            duration_ok = filters.duration_ok(doc)
+            in_window = [d for d in doc.dates if filters.in_window(d[0])] if has_window else doc.dates
+            in_price = [d for d in doc.dates if filters.in_price(d[1])] if has_price else doc.dates
+            if has_window and has_price:
+                dates_ok = any(filters.in_price(d[1]) for d in in_window)
+            else:
+                dates_ok = not (has_window or has_price) or bool(in_window if has_window else in_price)
+
+            if country_ok and duration_ok and dates_ok:
+                ids.append(doc.id)
+            if duration_ok and dates_ok:
+                country_facet[doc.country] += 1
+            if country_ok and dates_ok:
+                duration_facet[doc.duration_bucket] += 1
+            if country_ok and duration_ok:
+                if in_window:
+                    price_facet[_bucket(min(d[1] for d in in_window), PRICE_BUCKETS)] += 1
+                for month in {d[2] for d in in_price}:
+                    month_facet[month] += 1
+
+        ids.sort(key=lambda trip_id: (-scores[trip_id], -trip_id))
+        facets = {'country': country_facet, 'duration': duration_facet, 'price': price_facet, 'month': month_facet}
+        return ids, {name: dict(sorted(counts.items())) for name, counts in facets.items()}
+
+
+_index = TripSearchIndex()
+_build_lock = threading.Lock()
+_local = threading.local()
+
+
+def get_index():
+    if _index.built_at is None:
+        with _build_lock:
+            if _index.built_at is None:
+                _index.build()
+    else:
+        _index.catch_up()
+    return _index
+
+
+def _pending():
+    if not hasattr(_local, 'trip_ids'):
+        _local.trip_ids = set()
+    return _local.trip_ids
+
+
+def publish_changes(trip_ids):
+    """
+    Appends the trip ids to the change log the other processes replay.
+    """
+    seq = bump_version(CHANGES_SEQ_KEY)
+    get_cache().set(change_key(seq), sorted(trip_ids), timeout=CHANGES_TIMEOUT)
+    return seq
+
+
+def _flush_pending():
+    trip_ids = list(_pending())
+    _pending().clear()
+    if not trip_ids:
+        return
+    seq = publish_changes(trip_ids)
+    if _index.built_at is not None:
+        _index.reindex(trip_ids)
+        with _index.lock:
+            # Only this entry was new to it, the others are replayed on the next search
+            if _index.seq == seq - 1:
+                _index.seq = seq
+
+
+def schedule_reindex(trip_id):
+    """
+    Reindexes the trip after commit, here and in the other processes, once
+    per transaction however many of its rows were saved.
+    """
+    if trip_id is None:
+        return
+    _pending().add(trip_id)
+    # The first callback to run flushes the whole set, the rest find it empty
+    transaction.on_commit(_flush_pending)
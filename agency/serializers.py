@@ -1,5 +1,72 @@
+import datetime
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.utils import timezone
 from rest_framework import serializers
-from .models import Review, Sociallink, FAQ, TripRequest, TripDate, IncludedFeature, ProgramByDay, TripPhoto, Trip
+
+from .images import build_srcset
+from .models import (
+    Review, Sociallink, FAQ, TripRequest, TripDate, IncludedFeature, ProgramByDay, TripPhoto, Trip, CountryIndex
+)
+
+
+COUNTRY_NAMES = dict(Trip.COUNTRY_CHOICES)
+
+
+def get_requested_fields(request):
+    """
+    Field names from `?fields=a,b` of a GET request, None when not given.
+    """
+    if request is None or request.method != 'GET':
+        return None
+    fields = request.query_params.get('fields')
+    if not fields:
+        return None
+    return {name.strip() for name in fields.split(',') if name.strip()}
+
+
+def check_requested_fields(requested, available):
+    unknown = requested - set(available)
+    if unknown:
+        raise serializers.ValidationError({'fields': f"Неизвестные поля: {', '.join(sorted(unknown))}"})
+
+
+class SparseFieldsetMixin:
+    """
+    Builds only the fields listed in `?fields=`.
+
+    `Meta.field_columns` maps fields that aren't plain model columns
+    (method fields, nested serializers, related slugs) to the columns they read,
+    so the view can `.only()`-load the queryset.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested = get_requested_fields(self.context.get('request'))
+        if requested is None:
+            return
+
+        check_requested_fields(requested, self.fields)
+        for name in set(self.fields) - requested:
+            self.fields.pop(name)
+
+    @classmethod
+    def get_model_columns(cls, requested):
+        model = cls.Meta.model
+        field_columns = getattr(cls.Meta, 'field_columns', {})
+        columns = {model._meta.pk.name}
+        for name in requested & set(cls.Meta.fields):
+            if name in field_columns:
+                columns.update(field_columns[name])
+                continue
+            try:
+                field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                continue
+            if field.concrete:
+                columns.add(name)
+        return columns
 
 
 class FAQSerializer(serializers.ModelSerializer):
@@ -29,13 +96,21 @@ class ProgramByDaySerializer(serializers.ModelSerializer):
         fields = ['id', 'day_number', 'title', 'description', 'accommodation', 'meal_plan', ]
 
 
-class TripPhotoSerializer(serializers.ModelSerializer):
+class TripPhotoSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    srcset = serializers.SerializerMethodField()
+
     class Meta:
         model = TripPhoto
-        fields = ['id', 'photo', 'type']
+        fields = ['id', 'photo', 'type', 'srcset']
+        field_columns = {
+            'srcset': ['variants'],
+        }
 
+    def get_srcset(self, obj):
+        return build_srcset(obj.variants, self.context.get('request'))
 
-class TripRetrieveSerializer(serializers.ModelSerializer):
+
+class TripRetrieveSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     photos = TripPhotoSerializer(many=True)
     program_by_days = ProgramByDaySerializer(many=True)
     included_features = IncludedFeatureSerializer(many=True)
@@ -55,29 +130,46 @@ class TripRetrieveSerializer(serializers.ModelSerializer):
             'leaders', 'ask_title', 'description', 'created_at', 'photos',
             'program_by_days','included_features', 'trip_dates', 'faqs',
         ]
+        field_columns = {
+            'available_spots': ['group_size', 'current_members'],
+            'formatted_start_date': ['next_start_date'],
+            'formatted_end_date': ['next_end_date'],
+            'trip_dates': ['group_size'],  # TripDate.available_spots
+        }
 
     @staticmethod
     def get_available_spots(obj):
-        total_members = sum(trip_date.current_members for trip_date in obj.trip_dates_list)
-        # Calculate available spots
-        return max(0, obj.group_size - total_members)
+        # current_members is the stored sum over all trip dates
+        return max(0, obj.group_size - obj.current_members)
+
+    # Dates of the next departure, None when there's no upcoming one
 
     @staticmethod
     def get_formatted_start_date(obj):
-        return obj.trip_dates_list[0].start_date.strftime('%d %b, %Y')
+        return obj.next_start_date.strftime('%d %b, %Y') if obj.next_start_date else None
 
     @staticmethod
     def get_formatted_end_date(obj):
-        return obj.trip_dates_list[0].end_date.strftime('%d %b, %Y')
+        return obj.next_end_date.strftime('%d %b, %Y') if obj.next_end_date else None
 
 class TripListSerializer(TripRetrieveSerializer):
     photo = serializers.SerializerMethodField()
+    photo_srcset = serializers.SerializerMethodField()
     price = serializers.SerializerMethodField(read_only=True)
     country = serializers.SerializerMethodField()
 
     class Meta:
         model = Trip
-        fields = ['id', 'formatted_start_date', 'price', 'available_spots', 'photo', 'status', 'title', 'country', 'duration_days', 'group_size', ]
+        fields = [
+            'id', 'formatted_start_date', 'price', 'available_spots', 'photo', 'photo_srcset',
+            'status', 'title', 'country', 'duration_days', 'group_size',
+            'next_start_date', 'min_price', 'max_price', 'has_special_offer', 'free_seats',
+        ]
+        field_columns = {
+            'available_spots': ['group_size', 'current_members'],
+            'formatted_start_date': ['next_start_date'],
+            'price': ['min_price'],
+        }
 
     @staticmethod
     def get_photo(obj):
@@ -85,44 +177,116 @@ class TripListSerializer(TripRetrieveSerializer):
         slide_photo = slide_photos[0] if slide_photos else None
         return slide_photo.photo.url if slide_photo else None
 
+    @staticmethod
+    def get_photo_srcset(obj):
+        slide_photos = getattr(obj, 'slide_photos', [])
+        return build_srcset(slide_photos[0].variants) if slide_photos else None
+
     @staticmethod
     def get_price(obj):
-        trip_dates = getattr(obj, 'trip_dates_list', [])
-        price = trip_dates[0].price
-        return price if price else 0.00
+        # Lowest upcoming price
+        return obj.min_price if obj.min_price else 0.00
 
     @staticmethod
     def get_country(obj):
-        return obj.get_country_display()
+        # get_country_display() without its per-call lookup of the choices
+        return COUNTRY_NAMES.get(obj.country, obj.country)
 
 
-class TripRequestSerializer(serializers.ModelSerializer):
+class TripRequestSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     trip = serializers.SlugRelatedField(queryset=Trip.objects.all(), slug_field='slug', )
 
     class Meta:
         model = TripRequest
         fields = ['trip', 'name', 'phone', 'email', 'preferred_contact', 'notes', 'created_at', ]
         read_only_fields = ['created_at', ]
+        field_columns = {
+            'trip': ['trip__slug'],
+        }
 
 
-class CountrySerializer(serializers.Serializer):
-    country = serializers.CharField()
-    country_name = serializers.SerializerMethodField()
-    photo = serializers.CharField()
+class TripSearchQuerySerializer(serializers.Serializer):
+    """
+    Query parameters of /trips/search/.
+    """
+    q = serializers.CharField(required=False, allow_blank=True, default='')
+    country = serializers.CharField(required=False)
+    duration_min = serializers.IntegerField(required=False, min_value=0)
+    duration_max = serializers.IntegerField(required=False, min_value=0)
+    price_min = serializers.DecimalField(max_digits=10, decimal_places=0, required=False)
+    price_max = serializers.DecimalField(max_digits=10, decimal_places=0, required=False)
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
 
     @staticmethod
-    def get_country_name(obj):
-        return dict(Trip.COUNTRY_CHOICES).get(obj["country"], obj["country"])
+    def validate_country(value):
+        return {code.strip() for code in value.split(',') if code.strip()}
+
+
+class TripListQuerySerializer(serializers.Serializer):
+    """
+    Filters of /trips/ over the stored summary of upcoming dates.
+    """
+    price_min = serializers.DecimalField(max_digits=10, decimal_places=0, required=False)
+    price_max = serializers.DecimalField(max_digits=10, decimal_places=0, required=False)
+    departure_from = serializers.DateField(required=False)
+    departure_to = serializers.DateField(required=False)
+    special_offer = serializers.BooleanField(required=False, default=False)
+    available = serializers.BooleanField(required=False, default=False)
+
+
+class CalendarQuerySerializer(serializers.Serializer):
+    """
+    Query parameters of /trips/calendar/, a window of departure dates.
+    """
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+    return_by = serializers.DateField(required=False)
+    seats = serializers.IntegerField(required=False, min_value=1, default=1)
+    price_min = serializers.DecimalField(max_digits=10, decimal_places=0, required=False)
+    price_max = serializers.DecimalField(max_digits=10, decimal_places=0, required=False)
+    country = serializers.CharField(required=False)
+    special_offer = serializers.BooleanField(required=False, default=False)
 
+    validate_country = staticmethod(TripSearchQuerySerializer.validate_country)
+
+    def validate(self, attrs):
+        today = timezone.localdate()
+        max_days = getattr(settings, 'CALENDAR_MAX_DAYS', 366)
+        attrs['date_from'] = max(attrs.get('date_from', today), today)
+        attrs.setdefault('date_to', attrs['date_from'] + datetime.timedelta(days=max_days - 1))
+        if attrs['date_to'] < attrs['date_from']:
+            raise serializers.ValidationError({'date_to': "Дата должна быть не раньше date_from."})
+        if (attrs['date_to'] - attrs['date_from']).days >= max_days:
+            raise serializers.ValidationError({'date_to': f"Окно календаря не больше {max_days} дней."})
+        return attrs
+
+
+class CountrySerializer(serializers.ModelSerializer):
+    country_name = serializers.CharField(source='get_country_display')
+    photo = serializers.CharField(source='random_photo')
+
+    class Meta:
+        model = CountryIndex
+        fields = ['country', 'country_name', 'photo', 'trip_count', 'min_price', ]
+
+
+class ReviewSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    avatar_srcset = serializers.SerializerMethodField()
 
-class ReviewSerializer(serializers.ModelSerializer):
     class Meta:
         model = Review
-        fields = ['id', 'name', 'avatar', 'text', 'created_at']
+        fields = ['id', 'name', 'avatar', 'avatar_srcset', 'text', 'created_at']
         read_only_fields = ['created_at']
+        field_columns = {
+            'avatar_srcset': ['variants'],
+        }
+
+    def get_avatar_srcset(self, obj):
+        return build_srcset(obj.variants, self.context.get('request'))
 
 
-class SocialLinkSerializer(serializers.ModelSerializer):
+class SocialLinkSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = Sociallink
         fields = ['id', 'name', 'icon', 'url', ]
@@ -0,0 +1,203 @@
+from collections import Counter
+
+from django.db.models.functions import Now
+from django.db.models.signals import pre_delete, pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from .blobs import get_media_models, instance_references, references, release_references, replace_references
+from .cache import invalidate_trip, record_trip_deletion
+from .images import schedule_variants
+from .search import schedule_reindex
+from .spam import reload_scorer
+from .models import (
+    Trip, TripPhoto, TripDate, ProgramByDay, IncludedFeature, FAQ, CountryIndex, Review, SpamRule,
+    booked_seats_subquery, touch_trip, upcoming_summary,
+)
+
+
+@receiver([post_save, post_delete], sender=Trip)
+def invalidate_trip_cache(sender, instance, **kwargs):
+    invalidate_trip(instance.pk)
+
+
+@receiver(post_delete, sender=Trip)
+def remember_trip_deletion(sender, instance, **kwargs):
+    # Keeps the catalogue Last-Modified from going back, see agency/http_cache.py
+    record_trip_deletion()
+
+
+@receiver([post_save, post_delete], sender=TripPhoto)
+@receiver([post_save, post_delete], sender=TripDate)
+@receiver([post_save, post_delete], sender=ProgramByDay)
+@receiver([post_save, post_delete], sender=IncludedFeature)
+@receiver([post_save, post_delete], sender=FAQ)
+def invalidate_trip_child_cache(sender, instance, **kwargs):
+    invalidate_trip(instance.trip_id)
+
+
+@receiver([post_save, post_delete], sender=TripDate)
+def refresh_trip_current_members(sender, instance, origin=None, **kwargs):
+    # Skip cascades from a Trip delete, the trip row is going away as well
+    if isinstance(origin, Trip):
+        return
+    Trip.objects.filter(pk=instance.trip_id).update(
+        current_members=booked_seats_subquery(), updated_at=Now(), **upcoming_summary(),
+    )
+
+
+@receiver([post_save, post_delete], sender=TripPhoto)
+@receiver([post_save, post_delete], sender=ProgramByDay)
+@receiver([post_save, post_delete], sender=IncludedFeature)
+@receiver([post_save, post_delete], sender=FAQ)
+def touch_parent_trip(sender, instance, origin=None, **kwargs):
+    # Dates stamp the trip together with its summary, see above
+    if isinstance(origin, Trip):
+        return
+    touch_trip(instance.trip_id)
+
+
+@receiver(pre_save, sender=Trip)
+def remember_trip_country(sender, instance, **kwargs):
+    # The old country loses a trip when the country is changed,
+    # free seats are recounted when the group size is
+    instance._old_country, instance._old_group_size = (
+        Trip.objects.filter(pk=instance.pk).values_list('country', 'group_size').first()
+        if instance.pk else None
+    ) or (None, None)
+
+
+@receiver(post_save, sender=Trip)
+def refresh_trip_free_seats(sender, instance, created=False, **kwargs):
+    if not created and getattr(instance, '_old_group_size', None) not in (None, instance.group_size):
+        Trip.objects.filter(pk=instance.pk).update(updated_at=Now(), **upcoming_summary())
+
+
+@receiver(post_save, sender=Trip)
+def count_trip_in_country_index(sender, instance, created=False, **kwargs):
+    old_country = getattr(instance, '_old_country', None)
+    if created:
+        CountryIndex.change(instance.country, trips=1)
+    elif old_country not in (None, instance.country):
+        # Its photos and dates move along, both countries are recounted
+        CountryIndex.refresh(old_country, instance.country)
+
+
+@receiver(post_delete, sender=Trip)
+def refresh_trip_country_index(sender, instance, **kwargs):
+    CountryIndex.refresh(instance.country)
+
+
+@receiver(pre_save, sender=TripPhoto)
+def remember_gallery_photo(sender, instance, **kwargs):
+    instance._old_gallery_photo = (
+        TripPhoto.objects.filter(pk=instance.pk, type='gallery').values_list('photo', 'trip__country').first()
+        if instance.pk else None
+    )
+
+
+@receiver(post_save, sender=TripPhoto)
+def update_country_photo_pool(sender, instance, **kwargs):
+    old = getattr(instance, '_old_gallery_photo', None)
+    new = (instance.photo.name, instance.trip.country) if instance.type == 'gallery' else None
+    if old == new:
+        return
+    if old is not None and (new is None or old[1] != new[1]):
+        CountryIndex.change(old[1], remove_photo=old[0])
+        old = None
+    if new is not None:
+        CountryIndex.change(new[1], add_photo=new[0], remove_photo=old[0] if old else None)
+
+
+@receiver(post_delete, sender=TripPhoto)
+def remove_from_country_photo_pool(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Trip) or instance.type != 'gallery':
+        return
+    CountryIndex.change(instance.trip.country, remove_photo=instance.photo.name)
+
+
+@receiver(pre_save, sender=TripDate)
+def remember_date_price(sender, instance, **kwargs):
+    instance._old_price = (
+        TripDate.objects.filter(pk=instance.pk).values_list('price', 'trip__country').first()
+        if instance.pk else None
+    )
+
+
+@receiver(post_save, sender=TripDate)
+def update_country_min_price(sender, instance, **kwargs):
+    old = getattr(instance, '_old_price', None)
+    country = instance.trip.country
+    if old is not None and old[1] != country:
+        CountryIndex.change(old[1], removed_price=old[0])
+        old = None
+    CountryIndex.change(country, price=instance.price, removed_price=old[0] if old else None)
+
+
+@receiver(post_delete, sender=TripDate)
+def drop_country_min_price(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Trip):
+        return
+    CountryIndex.change(instance.trip.country, removed_price=instance.price)
+
+
+@receiver(post_save, sender=TripPhoto)
+def build_trip_photo_variants(sender, instance, raw=False, **kwargs):
+    if not raw:
+        schedule_variants(instance, 'photo')
+
+
+@receiver(post_save, sender=Review)
+def build_review_avatar_variants(sender, instance, raw=False, **kwargs):
+    if not raw:
+        schedule_variants(instance, 'avatar')
+
+
+@receiver([post_save, post_delete], sender=Trip)
+def reindex_trip(sender, instance, **kwargs):
+    schedule_reindex(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=TripDate)
+@receiver([post_save, post_delete], sender=ProgramByDay)
+@receiver([post_save, post_delete], sender=FAQ)
+def reindex_trip_child(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Trip):
+        return
+    schedule_reindex(instance.trip_id)
+
+
+@receiver([post_save, post_delete], sender=SpamRule)
+def reload_spam_rules(sender, **kwargs):
+    # Every process recompiles its rules on the next version check
+    reload_scorer()
+
+
+@receiver(pre_save, sender=TripPhoto)
+@receiver(pre_save, sender=Review)
+def remember_media_references(sender, instance, **kwargs):
+    field_name = get_media_models()[sender]
+    old = sender.objects.filter(pk=instance.pk).values_list(field_name, 'variants').first() if instance.pk else None
+    instance._old_references = references(*old) if old else set()
+
+
+@receiver(post_save, sender=TripPhoto)
+@receiver(post_save, sender=Review)
+def count_media_references(sender, instance, **kwargs):
+    replace_references(getattr(instance, '_old_references', set()), instance_references(instance))
+
+
+@receiver(post_delete, sender=TripPhoto)
+@receiver(post_delete, sender=Review)
+def release_media_references(sender, instance, origin=None, **kwargs):
+    # Released all at once in release_trip_media_references
+    if isinstance(origin, Trip):
+        return
+    release_references(instance_references(instance))
+
+
+@receiver(pre_delete, sender=Trip)
+def release_trip_media_references(sender, instance, **kwargs):
+    counts = Counter()
+    for name, variants in TripPhoto.objects.filter(trip=instance).values_list('photo', 'variants'):
+        counts.update(references(name, variants))
+    release_references(counts)
@@ -0,0 +1,313 @@
+"""
+Slow-query log and the index advice of `manage.py slow_query_report`.
+
+An execute wrapper on every database connection times each query. A
+SELECT slower than SLOW_QUERY_THRESHOLD_MS is, for SLOW_QUERY_SAMPLE_RATE
+of them, explained right away and written as one JSON line to
+SLOW_QUERY_LOG: the SQL, the viewset and serializer that ran it, the
+innermost frame of our code and the plan. Parameters carry customer data
+(names, phones of trip requests), they are written only for SELECTs and
+only with SLOW_QUERY_LOG_PARAMS. The file is rotated at
+SLOW_QUERY_LOG_MAX_BYTES, keeping SLOW_QUERY_LOG_BACKUPS.
+
+The report groups the entries by fingerprint, the SQL without its
+values, and compares the columns they filter and sort on with the
+indexes the models declare.
+"""
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+
+from django.apps import apps
+from django.conf import settings
+from django.db.models import UniqueConstraint
+from django.utils import timezone
+from rest_framework.serializers import BaseSerializer, ListSerializer
+from rest_framework.views import APIView
+
+from .metrics import execute_wrapper as metrics_execute_wrapper
+
+
+logger = logging.getLogger(__name__)
+
+SAVEPOINT = "slow_query_explain"
+
+
+def execute_wrapper(execute, sql, params, many, context):
+    path = getattr(settings, 'SLOW_QUERY_LOG', None)
+    if not path:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    result = execute(sql, params, many, context)
+    elapsed = (time.perf_counter() - start) * 1000
+    if elapsed >= settings.SLOW_QUERY_THRESHOLD_MS and not many and random.random() < settings.SLOW_QUERY_SAMPLE_RATE:
+        try:
+            record(context['connection'], sql, params, elapsed, sys._getframe(1))
+        except Exception:
+            # The query itself succeeded, the log never fails it
+            logger.exception("Could not record a slow query")
+    return result
+
+
+def install_execute_wrapper(sender, connection, **kwargs):
+    """
+    connection_created receiver, see AgencyConfig.ready().
+    """
+    if execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(execute_wrapper)
+
+
+def is_select(sql):
+    return sql.split(None, 1)[0].upper() in ("SELECT", "WITH")
+
+
+def record(connection, sql, params, elapsed, frame):
+    view, serializer, origin = get_callers(frame)
+    log_params = params is not None and getattr(settings, 'SLOW_QUERY_LOG_PARAMS', False) and is_select(sql)
+    entry = {
+        'time': timezone.now().isoformat(),
+        'ms': round(elapsed, 3),
+        'database': connection.alias,
+        'vendor': connection.vendor,
+        'fingerprint': fingerprint(sql),
+        'sql': sql,
+        'params': list(params) if log_params else None,
+        'view': view,
+        'serializer': serializer,
+        'origin': origin,
+        'plan': explain(connection, sql, params),
+    }
+    write(json.dumps(entry, ensure_ascii=False, default=str))
+
+
+def explain(connection, sql, params):
+    """
+    The plan lines of a SELECT, [] for other statements.
+
+    Runs on the DB-API cursor, past the execute wrappers and the query log,
+    inside a savepoint so a failing EXPLAIN can't break the transaction.
+    """
+    if not connection.features.supports_explaining_query_execution:
+        return []
+    if not is_select(sql):
+        return []
+    savepoint = connection.in_atomic_block and connection.features.uses_savepoints
+    with connection.cursor() as cursor, connection.wrap_database_errors:
+        cursor = cursor.cursor
+        if savepoint:
+            cursor.execute(connection.ops.savepoint_create_sql(SAVEPOINT))
+        try:
+            cursor.execute(f"{connection.ops.explain_query_prefix()} {sql}", params)
+            rows = cursor.fetchall()
+        except Exception:
+            if savepoint:
+                cursor.execute(connection.ops.savepoint_rollback_sql(SAVEPOINT))
+            raise
+        if savepoint:
+            cursor.execute(connection.ops.savepoint_commit_sql(SAVEPOINT))
+    # The detail column of SQLite's plan, the text line of PostgreSQL's
+    return [str(row[-1]) for row in rows]
+
+
+_wrapper_code = {execute_wrapper.__code__, metrics_execute_wrapper.__code__}
+
+
+def get_callers(frame):
+    """
+    The innermost viewset action, serializer and frame of our code on the stack.
+    """
+    base_dir = str(settings.BASE_DIR)
+    view = serializer = origin = None
+    while frame is not None and view is None:
+        code = frame.f_code
+        filename = code.co_filename
+        if (
+            origin is None and code not in _wrapper_code
+            and filename.startswith(base_dir) and "site-packages" not in filename
+        ):
+            origin = f"{os.path.relpath(filename, base_dir)}:{frame.f_lineno} {code.co_name}"
+        owner = frame.f_locals.get('self')
+        if serializer is None and isinstance(owner, BaseSerializer):
+            serializer = (
+                f"{type(owner.child).__name__}(many=True)" if isinstance(owner, ListSerializer) else type(owner).__name__
+            )
+        elif isinstance(owner, APIView):
+            view = f"{type(owner).__name__}.{getattr(owner, 'action', None) or code.co_name}"
+        frame = frame.f_back
+    return view, serializer, origin
+
+
+_handler = None
+_handler_lock = threading.Lock()
+
+
+def write(line):
+    global _handler
+    path = settings.SLOW_QUERY_LOG
+    with _handler_lock:
+        if _handler is None or _handler.baseFilename != os.path.abspath(path):
+            if _handler is not None:
+                _handler.close()
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            _handler = RotatingFileHandler(
+                path, maxBytes=settings.SLOW_QUERY_LOG_MAX_BYTES, backupCount=settings.SLOW_QUERY_LOG_BACKUPS,
+                encoding='utf-8', delay=True,
+            )
+        handler = _handler
+    handler.handle(logging.makeLogRecord({'msg': line, 'levelno': logging.INFO, 'levelname': 'INFO'}))
+
+
+# Fingerprints
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w\"`.])-?\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%s|\?")
+_VALUES = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_SPACE = re.compile(r"\s+")
+
+
+def fingerprint(sql):
+    """
+    The SQL with every value a `?` and value lists `(...)`, so queries
+    that differ only in their values are counted together.
+    """
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _PLACEHOLDER.sub("?", sql)
+    sql = _VALUES.sub("(...)", sql)
+    return _SPACE.sub(" ", sql).strip()
+
+
+# Report
+
+def read_log(path):
+    """
+    The entries of the log and of its rotated files, oldest file first.
+    """
+    path = Path(path)
+    rotated = [file for file in path.parent.glob(f"{path.name}.*") if file.suffix[1:].isdigit()]
+    for file in [*sorted(rotated, key=lambda file: -int(file.suffix[1:])), path]:
+        if not file.exists():
+            continue
+        with file.open(encoding='utf-8') as lines:
+            for line in lines:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # Cut off by a crash or a rotation
+                    continue
+
+
+def group(entries):
+    """
+    One summary per fingerprint, the most total time first.
+    """
+    groups = {}
+    for entry in entries:
+        summary = groups.get(entry['fingerprint'])
+        if summary is None:
+            summary = groups[entry['fingerprint']] = {
+                'fingerprint': entry['fingerprint'], 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                'slowest': entry, 'views': Counter(), 'origins': Counter(),
+            }
+        summary['count'] += 1
+        summary['total_ms'] += entry['ms']
+        if entry['ms'] >= summary['max_ms']:
+            summary['max_ms'] = entry['ms']
+            summary['slowest'] = entry
+        summary['views'][entry.get('view') or entry.get('origin') or "?"] += 1
+        if entry.get('origin'):
+            summary['origins'][entry['origin']] += 1
+    return sorted(groups.values(), key=lambda summary: -summary['total_ms'])
+
+
+_COLUMN = r'[`"](\w+)[`"]\.[`"](\w+)[`"]'
+_PREDICATE = re.compile(_COLUMN + r"\s*(=|<>|!=|<=|>=|<|>|IN\b|LIKE\b|BETWEEN\b|IS\b)", re.IGNORECASE)
+_ORDER_BY = re.compile(r"\bORDER BY\b(.*?)(?:\bLIMIT\b|\bOFFSET\b|\bFOR UPDATE\b|$)", re.IGNORECASE)
+_RANDOM = re.compile(r"\bORDER BY\b[^)]*\bRAND(?:OM)?\(\)", re.IGNORECASE)
+_FULL_SCAN = re.compile(r"^(?:SCAN (\w+)(?:$| AS)|.*Seq Scan on (\w+))")
+
+
+def declared_indexes(model):
+    """
+    Column tuples of every index a model has: Meta.indexes, unique
+    constraints and the implicit ones of primary keys, unique fields,
+    foreign keys and db_index.
+    """
+    meta = model._meta
+    indexes = [(field.column, ) for field in meta.local_fields if field.primary_key or field.unique or field.db_index]
+    for index in meta.indexes:
+        if index.fields:
+            indexes.append(tuple(meta.get_field(name.lstrip('-')).column for name in index.fields))
+    for constraint in meta.constraints:
+        if isinstance(constraint, UniqueConstraint) and constraint.fields:
+            indexes.append(tuple(meta.get_field(name).column for name in constraint.fields))
+    for fields in meta.unique_together:
+        indexes.append(tuple(meta.get_field(name).column for name in fields))
+    return indexes
+
+
+def get_columns(sql):
+    """
+    {table: (equality columns, range columns, LIKE columns, ORDER BY columns)}
+    """
+    tables = {}
+
+    def columns(table):
+        return tables.setdefault(table, ([], [], [], []))
+
+    for table, column, operator in _PREDICATE.findall(sql):
+        operator = operator.upper()
+        kind = 0 if operator in ("=", "IN", "IS") else 2 if operator == "LIKE" else 1
+        if column not in columns(table)[kind]:
+            columns(table)[kind].append(column)
+    for clause in _ORDER_BY.findall(sql):
+        for table, column in re.findall(_COLUMN, clause):
+            if column not in columns(table)[3]:
+                columns(table)[3].append(column)
+    return tables
+
+
+def advise(summary):
+    """
+    Hints and missing indexes for one fingerprint, as
+    ([hint, ...], [(model, field names, partially covering indexes), ...]).
+    """
+    sql = summary['fingerprint']
+    models = {model._meta.db_table: model for model in apps.get_models()}
+    hints, suggestions = [], []
+
+    if _RANDOM.search(sql):
+        hints.append("order_by('?') sorts every matching row by a random key, no index helps")
+    for line in summary['slowest'].get('plan') or []:
+        match = _FULL_SCAN.match(line.strip())
+        if match:
+            hints.append(f"full scan of {match.group(1) or match.group(2)}")
+
+    for table, (equal, ranges, likes, order) in get_columns(sql).items():
+        model = models.get(table)
+        if model is None:
+            continue
+        for column in likes:
+            hints.append(f"LIKE on {table}.{column} uses an index only for prefix patterns")
+        columns = [*equal, *(ranges[:1] or order[:1])]
+        if not columns:
+            continue
+        indexes = declared_indexes(model)
+        if any(index[:len(columns)] == tuple(columns) for index in indexes):
+            continue
+        partial = [index for index in indexes if index[0] in columns]
+        if partial and not (ranges or order) and len(columns) > 1:
+            # Equality on several columns, one of them already narrows it down
+            continue
+        names = {field.column: field.name for field in model._meta.local_fields}
+        suggestions.append((model, [names.get(column, column) for column in columns], partial))
+    return hints, suggestions
@@ -0,0 +1,343 @@
+"""
+In-memory snapshot of the public catalogue, an optional read engine
+for /trips/, /trips/<id>/ and /trips/countries/ (CATALOGUE_SNAPSHOT).
+
+Each worker loads every trip with its dates, photos, program, features
+and FAQs once, serializes them with the API's own serializers and keeps
+the result in read-only `__slots__` records: the field names of each
+payload once per kind, the values of each row as a tuple. Requests then
+filter, order and page the records in Python, without queries or DRF
+fields. Only what depends on the request (absolute photo URLs, the
+random country photo) is filled in per request.
+
+The snapshot is tagged with the catalogue version it was loaded at, see
+agency/cache.py. A request that finds a newer version loads a new one and
+swaps it in whole, so readers never see half of one.
+"""
+import random
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Prefetch
+from django.db.models.fields.files import FieldFile
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+
+from .cache import CATALOGUE_VERSION_KEY, aget_version, get_version
+from .filters import NULLABLE_ORDERING
+from .images import build_srcset
+from .serializers import (
+    CountrySerializer, TripListQuerySerializer, TripListSerializer, TripRetrieveSerializer, get_requested_fields,
+)
+
+
+_lock = threading.Lock()
+_current = None
+
+
+def is_enabled():
+    return getattr(settings, 'CATALOGUE_SNAPSHOT', False)
+
+
+class Record:
+    """
+    Read-only attributes in `__slots__`.
+    """
+    __slots__ = ()
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            object.__setattr__(self, name, values[name])
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+
+class Rows(Record):
+    """
+    Serialized rows of one kind: the names once, the values per row.
+    """
+    __slots__ = ('names', 'values')
+
+    @classmethod
+    def from_data(cls, data, names):
+        return cls(names=tuple(names), values=tuple(tuple(row[name] for name in names) for row in data))
+
+    def as_data(self):
+        return [dict(zip(self.names, values)) for values in self.values]
+
+
+class PhotoRecord(Record):
+    __slots__ = ('id', 'url', 'type', 'variants')
+
+
+class TripRecord(Record):
+    """
+    One trip: what the list filters and orders on, its list item and its
+    detail without the photos, which carry request-dependent URLs.
+    """
+    __slots__ = (
+        'id', 'created_at', 'next_start_date', 'min_price', 'has_special_offer', 'free_seats',
+        'item', 'detail', 'photos', 'children',
+    )
+
+
+class CountryRecord(Record):
+    __slots__ = ('values', 'photos')
+
+
+class Snapshot(Record):
+    __slots__ = ('version', 'trips', 'by_id', 'item_names', 'detail_names', 'countries', 'country_names')
+
+    @classmethod
+    def load(cls, version):
+        from .models import FAQ, CountryIndex, IncludedFeature, ProgramByDay, Trip, TripDate, TripPhoto
+
+        trips = list(Trip.objects.order_by('-created_at', '-id').prefetch_related(
+            Prefetch('trip_dates', TripDate.objects.all()),
+            Prefetch('photos', TripPhoto.objects.all()),
+            Prefetch('program_by_days', ProgramByDay.objects.all()),
+            Prefetch('included_features', IncludedFeature.objects.all()),
+            Prefetch('faqs', FAQ.objects.all()),
+        ))
+        item_names = tuple(TripListSerializer.Meta.fields)
+        detail_names = tuple(TripRetrieveSerializer.Meta.fields)
+        children = ('program_by_days', 'included_features', 'trip_dates', 'faqs')
+        child_fields = {name: TripRetrieveSerializer().fields[name].child.Meta.fields for name in children}
+
+        records = []
+        for trip in trips:
+            photos = list(trip.photos.all())
+            # What the list queryset prefetches
+            trip.slide_photos = [photo for photo in photos if photo.type == 'slide']
+            item = TripListSerializer(trip).data
+            detail = TripRetrieveSerializer(trip).data
+            records.append(TripRecord(
+                id=trip.id,
+                created_at=trip.created_at,
+                next_start_date=trip.next_start_date,
+                min_price=trip.min_price,
+                has_special_offer=trip.has_special_offer,
+                free_seats=trip.free_seats,
+                item=tuple(item[name] for name in item_names),
+                # Photos and children are kept apart, see trip_detail()
+                detail=tuple(None if name in children or name == 'photos' else detail[name] for name in detail_names),
+                photos=tuple(
+                    PhotoRecord(id=photo.id, url=_url(photo.photo), type=photo.type, variants=photo.variants)
+                    for photo in photos
+                ),
+                children=tuple((name, Rows.from_data(detail[name], child_fields[name])) for name in children),
+            ))
+
+        country_names = tuple(CountrySerializer.Meta.fields)
+        countries = []
+        for index in CountryIndex.objects.all():
+            data = CountrySerializer(index).data
+            countries.append(CountryRecord(
+                values=tuple(data[name] for name in country_names), photos=tuple(index.gallery_photos),
+            ))
+
+        return cls(
+            version=version,
+            trips=tuple(records),
+            by_id={record.id: record for record in records},
+            item_names=item_names,
+            detail_names=detail_names,
+            countries=tuple(countries),
+            country_names=country_names,
+        )
+
+    # Payloads, shaped like the serializers' output
+
+    def trip_item(self, record, fields=None):
+        return _pick(dict(zip(self.item_names, record.item)), fields)
+
+    def trip_detail(self, record, request, fields=None):
+        data = dict(zip(self.detail_names, record.detail))
+        for name, rows in record.children:
+            data[name] = rows.as_data()
+        data['photos'] = [
+            {
+                'id': photo.id,
+                'photo': request.build_absolute_uri(photo.url) if photo.url else None,
+                'type': photo.type,
+                'srcset': build_srcset(photo.variants, request),
+            }
+            for photo in record.photos
+        ]
+        return _pick(data, fields)
+
+    def country_list(self):
+        data = []
+        for country in self.countries:
+            item = dict(zip(self.country_names, country.values))
+            item['photo'] = random.choice(country.photos) if country.photos else None
+            data.append(item)
+        return data
+
+
+def _url(file):
+    return file.url if isinstance(file, FieldFile) and file else None
+
+
+def _pick(data, fields):
+    return data if fields is None else {name: value for name, value in data.items() if name in fields}
+
+
+def get_snapshot():
+    """
+    The snapshot of the current catalogue version, None when disabled.
+    """
+    global _current
+    if not is_enabled():
+        return None
+    version = get_version(CATALOGUE_VERSION_KEY)
+    snapshot = _current
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+    with _lock:
+        # Another thread may have loaded it meanwhile
+        if _current is None or _current.version != version:
+            _current = Snapshot.load(version)
+        return _current
+
+
+async def aget_snapshot():
+    if not is_enabled():
+        return None
+    version = await aget_version(CATALOGUE_VERSION_KEY)
+    snapshot = _current
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+    return await sync_to_async(get_snapshot)()
+
+
+def reset():
+    global _current
+    with _lock:
+        _current = None
+
+
+def get_cursor_rows(snapshot, paginator, request, view):
+    """
+    The records `paginator.get_page_queryset()` would read for the list:
+    TripSummaryFilter and TripOrderingFilter applied in Python. None when
+    the request has to go to the database.
+    """
+    from .models import Trip
+
+    params = TripListQuerySerializer(data=request.query_params)
+    if not params.is_valid():
+        # The ORM path answers with the errors
+        return None
+    filters = params.validated_data
+
+    paginator.request = request
+    paginator.page_size = paginator.get_page_size(request)
+    if not paginator.page_size:
+        return None
+    paginator.base_url = request.build_absolute_uri()
+    paginator.ordering = paginator.get_ordering(request, Trip.objects.none(), view)
+    try:
+        paginator.cursor = paginator.decode_cursor(request)
+    except NotFound:
+        return None
+    offset, reverse, position = paginator.cursor or (0, False, None)
+
+    tests = []
+    if 'price_min' in filters:
+        tests.append(lambda record: record.min_price is not None and record.min_price >= filters['price_min'])
+    if 'price_max' in filters:
+        tests.append(lambda record: record.min_price is not None and record.min_price <= filters['price_max'])
+    if 'departure_from' in filters:
+        tests.append(lambda record: record.next_start_date is not None
+                     and record.next_start_date >= filters['departure_from'])
+    if 'departure_to' in filters:
+        tests.append(lambda record: record.next_start_date is not None
+                     and record.next_start_date <= filters['departure_to'])
+    if filters.get('special_offer'):
+        tests.append(lambda record: record.has_special_offer)
+    if filters.get('available'):
+        tests.append(lambda record: record.free_seats > 0)
+    for name in NULLABLE_ORDERING.intersection(field.lstrip('-') for field in paginator.ordering):
+        tests.append(lambda record, name=name: getattr(record, name) is not None)
+
+    ordering = paginator.ordering
+    if reverse:
+        ordering = tuple(field[1:] if field.startswith('-') else f"-{field}" for field in ordering)
+    if position is not None:
+        order = paginator.ordering[0]
+        name = order.lstrip('-')
+        value = Trip._meta.get_field(name).to_python(position)
+        # (cursor reversed) XOR (queryset reversed), as in get_page_queryset
+        if paginator.cursor.reverse != order.startswith('-'):
+            tests.append(lambda record: getattr(record, name) is not None and getattr(record, name) < value)
+        else:
+            tests.append(lambda record: getattr(record, name) is not None and getattr(record, name) > value)
+
+    rows = [record for record in snapshot.trips if all(test(record) for test in tests)]
+    # Stable sorts from the last key to the first
+    for field in reversed(ordering):
+        rows.sort(key=lambda record, name=field.lstrip('-'): getattr(record, name), reverse=field.startswith('-'))
+
+    paginator.offset, paginator.reverse, paginator.current_position = offset, reverse, position
+    return rows[offset:offset + paginator.page_size + 1]
+
+
+class SnapshotReadMixin:
+    """
+    Answers `list` and `retrieve` of TripViewSet from the snapshot when
+    CATALOGUE_SNAPSHOT is on, the database otherwise. Goes after
+    CachedResponseMixin: rendered responses are still cached, the
+    snapshot only replaces the queries and serializers behind a miss.
+    """
+
+    def get_requested_fields(self, request, serializer_class):
+        """
+        `?fields=` when all are known, False to hand unknown ones to the ORM path.
+        """
+        fields = get_requested_fields(request)
+        if fields is not None and not fields <= set(serializer_class.Meta.fields):
+            return False
+        return fields
+
+    def snapshot_list(self, snapshot, request):
+        fields = self.get_requested_fields(request, TripListSerializer)
+        if snapshot is None or fields is False or self.paginator is None:
+            return None
+        rows = get_cursor_rows(snapshot, self.paginator, request, self)
+        if rows is None:
+            return None
+        page = self.paginator.set_page(rows)
+        return self.get_paginated_response([snapshot.trip_item(record, fields) for record in page])
+
+    def snapshot_retrieve(self, snapshot, request):
+        fields = self.get_requested_fields(request, TripRetrieveSerializer)
+        if snapshot is None or fields is False:
+            return None
+        lookup = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        record = snapshot.by_id.get(int(lookup)) if str(lookup).isdigit() else None
+        if record is None:
+            # The ORM path answers 404
+            return None
+        return Response(snapshot.trip_detail(record, request, fields))
+
+    def list(self, request, *args, **kwargs):
+        response = self.snapshot_list(get_snapshot(), request)
+        return response if response is not None else super().list(request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        response = self.snapshot_retrieve(get_snapshot(), request)
+        return response if response is not None else super().retrieve(request, *args, **kwargs)
+
+    async def alist(self, request, *args, **kwargs):
+        response = self.snapshot_list(await aget_snapshot(), request)
+        return response if response is not None else await super().alist(request, *args, **kwargs)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        response = self.snapshot_retrieve(await aget_snapshot(), request)
+        return response if response is not None else await super().aretrieve(request, *args, **kwargs)
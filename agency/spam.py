@@ -0,0 +1,262 @@
+import logging
+import math
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .cache import KEY_PREFIX, bump_version, get_cache, get_version
+
+
+logger = logging.getLogger(__name__)
+
+SPAM_VERSION_KEY = f"{KEY_PREFIX}:spam:version"
+
+FIELDS = ('name', 'notes', 'email', 'phone')
+TOKEN_RE = re.compile(r"\w{2,}", re.UNICODE)
+URL_RE = re.compile(
+    r"https?://|www\.|t\.me/|@\w+bot\b|\b[\w-]+\.(?:ru|com|net|org|info|biz|xyz|top|online|site|io|me)\b",
+    re.IGNORECASE,
+)
+
+DEFAULT_WEIGHTS = {
+    # Scaled by links per word, full weight from one link per 5 words
+    'links': 2.0,
+    # Per earlier submission from the same phone within a day
+    'duplicate_phone': 0.25,
+    # Naive Bayes adds from -weight (surely ham) to +weight (surely spam)
+    'bayes': 1.5,
+}
+
+
+def normalize(text):
+    return (text or '').lower().replace('ё', 'е')
+
+
+def _features(words, email):
+    tokens = {word[:64] for word in words}
+    if '@' in email:
+        tokens.add(f"@{email.rsplit('@', 1)[1]}"[:64])
+    return tokens
+
+
+def get_tokens(name, notes, email):
+    """
+    Naive Bayes features: words of name and notes plus the email domain.
+    """
+    return _features(TOKEN_RE.findall(normalize(f"{name} {notes}")), normalize(email))
+
+
+def compile_rule(pattern, kind):
+    """
+    The regex a rule is matched with, raises re.error for a bad one.
+    """
+    expression = re.escape(normalize(pattern)) if kind == 'keyword' else pattern
+    return re.compile(expression, re.IGNORECASE | re.UNICODE)
+
+
+@dataclass
+class SpamScore:
+    score: float
+    is_spam: bool
+    reasons: list = field(default_factory=list)
+
+
+class SpamScorer:
+    """
+    Rules compiled one regex each, plus link density, duplicate phone
+    and naive Bayes signals.
+
+    `rules` are (pattern, kind, field, weight), `kind` is 'keyword'
+    or 'regex', a rule for 'any' field is matched against every field.
+    `tokens` maps a token to its (spam, ham) counts.
+    """
+
+    def __init__(self, rules=(), tokens=None, spam_docs=0, ham_docs=0, threshold=None, weights=None):
+        self.threshold = threshold if threshold is not None else getattr(settings, 'SPAM_THRESHOLD', 1.0)
+        self.weights = {**DEFAULT_WEIGHTS, **(weights or getattr(settings, 'SPAM_SIGNAL_WEIGHTS', {}))}
+        self.min_docs = getattr(settings, 'SPAM_BAYES_MIN_DOCS', 5)
+        self.spam_docs, self.ham_docs = spam_docs, ham_docs
+        # Per-token log likelihood ratios with Laplace smoothing, summed at score time
+        spam_total, ham_total = math.log(spam_docs + 2), math.log(ham_docs + 2)
+        self.log_ratios = {
+            token: math.log(spam + 1) - spam_total - math.log(ham + 1) + ham_total
+            for token, (spam, ham) in (tokens or {}).items()
+        }
+
+        self.rules = []
+        # field -> [(rule index, regex)]; each rule is searched on its own,
+        # so overlapping rules all count and flags or backreferences stay valid
+        self.patterns = defaultdict(list)
+        for pattern, kind, rule_field, weight in rules:
+            try:
+                compiled = compile_rule(pattern, kind)
+            except re.error as e:
+                # Saved before validation or by an older version, the other rules still apply
+                logger.warning(f"Spam rule {pattern!r} skipped: {e}")
+                continue
+            index = len(self.rules)
+            self.rules.append((pattern, weight))
+            for name in (FIELDS if rule_field == 'any' else (rule_field, )):
+                self.patterns[name].append((index, compiled))
+
+    def match_rules(self, texts):
+        """
+        Indexes of the rules matching any of the {field: text} values.
+        """
+        matched = set()
+        for name, text in texts.items():
+            if not text:
+                continue
+            for index, pattern in self.patterns.get(name, ()):
+                if index not in matched and pattern.search(text):
+                    matched.add(index)
+        return matched
+
+    def bayes_probability(self, tokens):
+        """
+        P(spam | tokens), None until enough marks are learned.
+        """
+        if self.spam_docs < self.min_docs or self.ham_docs < self.min_docs:
+            return None
+        log_ratios = self.log_ratios
+        log_odds = math.log(self.spam_docs / self.ham_docs) + sum(
+            log_ratios[token] for token in tokens if token in log_ratios
+        )
+        log_odds = max(-30.0, min(30.0, log_odds))
+        return 1 / (1 + math.exp(-log_odds))
+
+    def score(self, name='', notes='', email='', phone='', phone_count=1):
+        name, notes, email = normalize(name), normalize(notes), normalize(email)
+        score, reasons = 0.0, []
+
+        for index in sorted(self.match_rules({'name': name, 'notes': notes, 'email': email, 'phone': phone or ''})):
+            pattern, weight = self.rules[index]
+            score += weight
+            reasons.append(f"rule:{pattern}")
+
+        text = f"{name} {notes}"
+        words = TOKEN_RE.findall(text)
+        links = len(URL_RE.findall(text))
+        if links:
+            score += self.weights['links'] * min(1.0, links * 5 / max(len(words), 1))
+            reasons.append(f"links:{links}")
+
+        if phone_count > 1:
+            score += self.weights['duplicate_phone'] * (phone_count - 1)
+            reasons.append(f"phone:{phone_count}")
+
+        probability = self.bayes_probability(_features(words, email))
+        if probability is not None:
+            score += self.weights['bayes'] * (2 * probability - 1)
+            reasons.append(f"bayes:{probability:.2f}")
+
+        return SpamScore(score=round(score, 3), is_spam=score >= self.threshold, reasons=reasons)
+
+
+def load_scorer():
+    from .models import SpamRule, SpamToken, TripRequest
+
+    rules = SpamRule.objects.filter(is_active=True).order_by('id').values_list('pattern', 'kind', 'field', 'weight')
+    tokens = {token: (spam, ham) for token, spam, ham in SpamToken.objects.values_list('token', 'spam_count', 'ham_count')}
+    reviewed = Counter(TripRequest.objects.filter(spam_reviewed=True).values_list('is_spam', flat=True))
+    return SpamScorer(list(rules), tokens, spam_docs=reviewed[True], ham_docs=reviewed[False])
+
+
+_scorer = None
+_scorer_version = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def get_scorer():
+    """
+    The compiled scorer of this process. Rule or learning changes bump
+    the shared version; it's checked every SPAM_RULES_CHECK_INTERVAL seconds
+    and the scorer is rebuilt when it moved, no restart needed.
+    """
+    global _scorer, _scorer_version, _checked_at
+    interval = getattr(settings, 'SPAM_RULES_CHECK_INTERVAL', 5)
+    if _scorer is not None and time.monotonic() - _checked_at < interval:
+        return _scorer
+
+    with _lock:
+        version = get_version(SPAM_VERSION_KEY)
+        if _scorer is None or version != _scorer_version:
+            _scorer, _scorer_version = load_scorer(), version
+        _checked_at = time.monotonic()
+    return _scorer
+
+
+def reload_scorer():
+    bump_version(SPAM_VERSION_KEY)
+
+
+def count_phone(phone):
+    """
+    Submissions from this phone today, the current one included.
+    """
+    digits = re.sub(r'\D', '', phone or '')
+    if not digits:
+        return 1
+    cache = get_cache()
+    key = f"{KEY_PREFIX}:spam:phone:{digits}:{int(time.time() // 86400)}"
+    cache.add(key, 0, timeout=86400)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        return 1
+
+
+def score_request(trip_request):
+    return get_scorer().score(
+        name=trip_request.name,
+        notes=trip_request.notes,
+        email=trip_request.email,
+        phone=trip_request.phone,
+        phone_count=count_phone(trip_request.phone),
+    )
+
+
+def learn(queryset, is_spam):
+    """
+    Applies an admin spam/not-spam mark to the requests and updates the
+    naive Bayes counts: a request counts once, under its latest label.
+    """
+    from .models import SpamToken, TripRequest
+
+    with transaction.atomic():
+        requests = list(queryset.select_for_update().only('name', 'notes', 'email', 'is_spam', 'spam_reviewed'))
+        deltas = Counter()
+        for trip_request in requests:
+            if trip_request.spam_reviewed and trip_request.is_spam == is_spam:
+                continue
+            for token in get_tokens(trip_request.name, trip_request.notes, trip_request.email):
+                if trip_request.spam_reviewed:
+                    # Relabelled: take it back from the old side
+                    deltas[token, not is_spam] -= 1
+                deltas[token, is_spam] += 1
+
+        # One UPDATE per distinct (spam, ham) change
+        changes = defaultdict(list)
+        tokens = {token for token, _ in deltas}
+        for token in tokens:
+            changes[deltas[token, True], deltas[token, False]].append(token)
+        if changes:
+            SpamToken.objects.bulk_create(
+                [SpamToken(token=token) for token in tokens], ignore_conflicts=True,
+            )
+        for (spam, ham), changed in changes.items():
+            SpamToken.objects.filter(token__in=changed).update(
+                spam_count=F('spam_count') + spam, ham_count=F('ham_count') + ham,
+            )
+
+        TripRequest.objects.filter(pk__in=[r.pk for r in requests]).update(is_spam=is_spam, spam_reviewed=True)
+
+    reload_scorer()
+    return len(requests)
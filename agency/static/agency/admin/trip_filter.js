@@ -0,0 +1,12 @@
+'use strict';
+{
+    const $ = django.jQuery;
+
+    // Reload the changelist filtered by the trip picked in the search box
+    $(document).on('change', '.trip-autocomplete-filter', function() {
+        const queryString = this.value
+            ? this.dataset.queryString.replace('__trip__', encodeURIComponent(this.value))
+            : this.dataset.clearQueryString;
+        window.location.search = queryString;
+    });
+}
@@ -0,0 +1,308 @@
+"""
+Content-addressed media storage.
+
+Every saved file is named by the SHA-256 of its bytes,
+`blobs/ab/cd/<sha256>.<ext>`, whatever name `upload_to` suggested: the
+same photo uploaded to several trips is stored once. Which rows use a
+blob is counted in `MediaBlob`, see agency/blobs.py; blobs nobody uses
+are removed by `manage.py gc_media`.
+
+`LocalBlobStorage` keeps blobs under MEDIA_ROOT, `S3BlobStorage` in an
+S3-compatible bucket (AWS, MinIO, ...) through its REST API.
+"""
+import datetime
+import hashlib
+import hmac
+import mimetypes
+import os
+import tempfile
+from urllib.parse import quote
+from xml.etree import ElementTree
+
+import requests
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, Storage
+from django.utils.deconstruct import deconstructible
+from django.utils.http import parse_http_date
+
+
+BLOB_PREFIX = 'blobs'
+# Blobs never change under their name
+BLOB_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def blob_name(digest, name):
+    extension = os.path.splitext(name)[1].lower()
+    return f"{BLOB_PREFIX}/{digest[:2]}/{digest[2:4]}/{digest}{extension}"
+
+
+def is_blob(name):
+    return name.startswith(f"{BLOB_PREFIX}/")
+
+
+class ContentAddressedMixin:
+    """
+    Names files by their content. Backends give `_put` (write a new blob),
+    `refresh` (mark an existing one as just used) and `iter_blobs`.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # The name is only known once the content is read, see _save()
+        return name
+
+    def _save(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk if isinstance(chunk, bytes) else chunk.encode())
+        content.seek(0)
+
+        name = blob_name(digest.hexdigest(), name)
+        if not self.refresh(name):
+            self._put(name, content)
+        return name
+
+    def refresh(self, name):
+        """
+        True when the blob is already stored; its age is reset, so a
+        garbage collection running now doesn't take it from the new upload.
+        """
+        raise NotImplementedError
+
+    def _put(self, name, content):
+        raise NotImplementedError
+
+    def iter_blobs(self):
+        """
+        Yields (name, size, modified time) of every stored blob.
+        """
+        raise NotImplementedError
+
+
+@deconstructible(path='agency.storage.LocalBlobStorage')
+class LocalBlobStorage(ContentAddressedMixin, FileSystemStorage):
+
+    def refresh(self, name):
+        try:
+            os.utime(self.path(name))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _put(self, name, content):
+        path = self.path(name)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # Written aside and moved in, readers never see half a blob
+        fd, temporary = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                for chunk in content.chunks():
+                    file.write(chunk if isinstance(chunk, bytes) else chunk.encode())
+            os.chmod(temporary, self.file_permissions_mode or 0o644)
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+    def iter_blobs(self):
+        root = self.path(BLOB_PREFIX)
+        for directory, _, files in os.walk(root):
+            for file_name in files:
+                if file_name.startswith('.upload-'):
+                    continue
+                path = os.path.join(directory, file_name)
+                stat = os.stat(path)
+                name = os.path.relpath(path, self.location).replace(os.sep, '/')
+                yield name, stat.st_size, datetime.datetime.fromtimestamp(stat.st_mtime, datetime.timezone.utc)
+
+
+class S3Client:
+    """
+    The few S3 REST calls the storage needs, signed with AWS Signature V4.
+    Path-style URLs, so any S3-compatible endpoint works.
+    """
+
+    def __init__(self, endpoint_url, bucket, access_key, secret_key, region='us-east-1', timeout=10):
+        self.endpoint_url = endpoint_url.rstrip('/')
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def sign(self, method, path, query, headers, payload_hash, now):
+        amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+        scope = f"{now:%Y%m%d}/{self.region}/s3/aws4_request"
+        headers = {**headers, 'x-amz-date': amz_date, 'x-amz-content-sha256': payload_hash}
+        signed = {name.lower(): str(value).strip() for name, value in headers.items()}
+        signed_names = ';'.join(sorted(signed))
+        canonical_request = '\n'.join([
+            method,
+            path,
+            query,
+            ''.join(f"{name}:{signed[name]}\n" for name in sorted(signed)),
+            signed_names,
+            payload_hash,
+        ])
+        string_to_sign = '\n'.join([
+            'AWS4-HMAC-SHA256', amz_date, scope, hashlib.sha256(canonical_request.encode()).hexdigest(),
+        ])
+
+        key = f"AWS4{self.secret_key}".encode()
+        for part in (f"{now:%Y%m%d}", self.region, 's3', 'aws4_request'):
+            key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+        signature = hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+        headers['Authorization'] = (
+            f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, "
+            f"SignedHeaders={signed_names}, Signature={signature}"
+        )
+        return headers
+
+    def request(self, method, key='', params=None, body=b'', headers=None):
+        path = quote(f"/{self.bucket}/{key}", safe='/-_.~')
+        query = '&'.join(
+            f"{quote(name, safe='-_.~')}={quote(str(value), safe='-_.~')}"
+            for name, value in sorted((params or {}).items())
+        )
+        host = self.endpoint_url.split('://', 1)[1]
+        headers = self.sign(
+            method, path, query, {'host': host, **(headers or {})},
+            hashlib.sha256(body).hexdigest(), datetime.datetime.now(datetime.timezone.utc),
+        )
+        url = f"{self.endpoint_url}{path}" + (f"?{query}" if query else '')
+        return self.session.request(method, url, data=body, headers=headers, timeout=self.timeout)
+
+    def head(self, key):
+        response = self.request('HEAD', key)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.headers
+
+    def get(self, key):
+        response = self.request('GET', key)
+        if response.status_code == 404:
+            raise FileNotFoundError(key)
+        response.raise_for_status()
+        return response.content
+
+    def put(self, key, body, content_type, cache_control):
+        response = self.request('PUT', key, body=body, headers={
+            'content-type': content_type, 'cache-control': cache_control,
+        })
+        response.raise_for_status()
+
+    def copy(self, key, source, content_type, cache_control):
+        """
+        Server-side copy; with the same key it rewrites only the metadata
+        and LastModified, the bytes stay where they are.
+        """
+        response = self.request('PUT', key, headers={
+            'x-amz-copy-source': quote(f"/{self.bucket}/{source}", safe='/-_.~'),
+            'x-amz-metadata-directive': 'REPLACE',
+            'content-type': content_type, 'cache-control': cache_control,
+        })
+        if response.status_code == 404:
+            raise FileNotFoundError(source)
+        response.raise_for_status()
+        # A copy that fails midway still answers 200, with an <Error> body
+        if b'<Error>' in response.content:
+            raise requests.HTTPError(f"Copy of {source} failed: {response.text}", response=response)
+
+    def delete(self, key):
+        response = self.request('DELETE', key)
+        if response.status_code != 404:
+            response.raise_for_status()
+
+    def list(self, prefix='', delimiter=None):
+        """
+        Yields ('key', key, size, modified) and, with a delimiter, ('prefix', prefix, None, None).
+        """
+        params = {'list-type': '2', 'prefix': prefix}
+        if delimiter:
+            params['delimiter'] = delimiter
+        while True:
+            response = self.request('GET', params=params)
+            response.raise_for_status()
+            root = ElementTree.fromstring(response.content)
+            namespace = root.tag[:root.tag.index('}') + 1] if root.tag.startswith('{') else ''
+            for item in root.iter(f"{namespace}Contents"):
+                modified = datetime.datetime.fromisoformat(item.findtext(f"{namespace}LastModified").replace('Z', '+00:00'))
+                yield 'key', item.findtext(f"{namespace}Key"), int(item.findtext(f"{namespace}Size")), modified
+            for item in root.iter(f"{namespace}CommonPrefixes"):
+                yield 'prefix', item.findtext(f"{namespace}Prefix"), None, None
+            token = root.findtext(f"{namespace}NextContinuationToken")
+            if root.findtext(f"{namespace}IsTruncated") != 'true' or not token:
+                return
+            params['continuation-token'] = token
+
+
+@deconstructible(path='agency.storage.S3BlobStorage')
+class S3BlobStorage(ContentAddressedMixin, Storage):
+    """
+    Blobs in an S3-compatible bucket. `public_url` is where the bucket is
+    served from (a CDN in front of it), the endpoint itself by default.
+    """
+
+    def __init__(self, endpoint_url, bucket, access_key, secret_key, region='us-east-1', public_url=None, timeout=10):
+        self.client = S3Client(endpoint_url, bucket, access_key, secret_key, region=region, timeout=timeout)
+        self.public_url = (public_url or f"{self.client.endpoint_url}/{bucket}").rstrip('/')
+
+    def refresh(self, name):
+        # S3 can't touch an object, a copy onto itself resets LastModified
+        # without sending the bytes again
+        headers = self.client.head(name)
+        if headers is None:
+            return False
+        content_type = headers.get('Content-Type') or mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        try:
+            self.client.copy(name, name, content_type, BLOB_CACHE_CONTROL)
+        except FileNotFoundError:
+            # Collected between the two requests
+            return False
+        return True
+
+    def _put(self, name, content):
+        body = b''.join(chunk if isinstance(chunk, bytes) else chunk.encode() for chunk in content.chunks())
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        self.client.put(name, body, content_type, BLOB_CACHE_CONTROL)
+
+    def _open(self, name, mode='rb'):
+        return ContentFile(self.client.get(name), name=name)
+
+    def exists(self, name):
+        return self.client.head(name) is not None
+
+    def delete(self, name):
+        self.client.delete(name)
+
+    def size(self, name):
+        headers = self.client.head(name)
+        if headers is None:
+            raise FileNotFoundError(name)
+        return int(headers['Content-Length'])
+
+    def get_modified_time(self, name):
+        headers = self.client.head(name)
+        if headers is None:
+            raise FileNotFoundError(name)
+        return datetime.datetime.fromtimestamp(parse_http_date(headers['Last-Modified']), datetime.timezone.utc)
+
+    def url(self, name):
+        return f"{self.public_url}/{quote(name)}"
+
+    def listdir(self, path):
+        prefix = f"{path.strip('/')}/" if path.strip('/') else ''
+        directories, files = [], []
+        for kind, key, _, _ in self.client.list(prefix, delimiter='/'):
+            if kind == 'prefix':
+                directories.append(key[len(prefix):].rstrip('/'))
+            else:
+                files.append(key[len(prefix):])
+        return directories, files
+
+    def iter_blobs(self):
+        for _, key, size, modified in self.client.list(f"{BLOB_PREFIX}/"):
+            yield key, size, modified
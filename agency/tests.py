@@ -1,3 +1,2454 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import decimal
+import importlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Prefetch
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import clear_url_caches, resolve, reverse
+from django.utils import timezone
+from django.utils.http import http_date, parse_http_date
+from django.utils.translation import gettext_lazy
+from asgiref.sync import sync_to_async
+from rest_framework.exceptions import ValidationError as DRFValidationError
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework.throttling import BaseThrottle
+
+from .blobs import collect_garbage, recount, usage
+from .cache import get_cache_stats, reset_cache_stats
+from .catalogue import CatalogueImporter
+from .cdn import get_backend as get_purge_backend, wait_for_purges
+from .models import (
+    Trip, TripPhoto, TripDate, ProgramByDay, IncludedFeature, FAQ, TripRequest, NotificationOutbox, Review, Sociallink,
+    CountryIndex, SpamRule, SpamToken, MediaBlob, upcoming_summary,
+)
+from . import metrics
+from .images import pending, render_variants
+from .notifications import TelegramTransport, process_batch
+from .projections import compile_serializer
+from .renderers import ORJSONRenderer, msgpack
+from .ratelimit import CacheRateLimitBackend, get_backend as get_rate_limit_backend
+from .departures import find_departures
+from .search import TripSearchIndex, change_key, get_index, tokenize
+from .serializers import (
+    CountrySerializer, ReviewSerializer, SocialLinkSerializer, TripListSerializer, TripPhotoSerializer,
+    TripRequestSerializer, TripRetrieveSerializer,
+)
+from . import slow_queries, snapshot, urls as agency_urls
+from .spam import SpamScorer, get_scorer, learn
+from .storage import S3BlobStorage
+from .views import ReviewViewSet, TripViewSet
+
+
+def make_trip(title="Тур", country="it", dates=1, photos=1, days=1, features=1, faqs=1, **kwargs):
+    trip = Trip.objects.create(
+        title=title,
+        slug=kwargs.pop("slug", None) or f"trip-{Trip.objects.count() + 1}",
+        country=country,
+        welcome_message="Добро пожаловать",
+        duration_days=7,
+        group_size=12,
+        ask_title="Вопрос",
+        description="Описание",
+        **kwargs,
+    )
+    start = datetime.date.today() + datetime.timedelta(days=30)
+    for i in range(dates):
+        TripDate.objects.create(
+            trip=trip,
+            start_date=start + datetime.timedelta(days=i * 10),
+            end_date=start + datetime.timedelta(days=i * 10 + 7),
+            price=1000 + i * 100,
+        )
+    for i in range(photos):
+        TripPhoto.objects.create(trip=trip, photo=f"trip_{trip.id}/slide/{i}.jpg", type="slide")
+    for i in range(days):
+        ProgramByDay.objects.create(trip=trip, day_number=i + 1, title=f"День {i + 1}", description="...")
+    for i in range(features):
+        IncludedFeature.objects.create(trip=trip, title=f"Пункт {i}", description="...")
+    for i in range(faqs):
+        FAQ.objects.create(trip=trip, question=f"Вопрос {i}", answer="Ответ", order=i)
+    return trip
+
+
+def make_image(name="avatar.png", size=(4, 4)):
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", size).save(buffer, "PNG")
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/png")
+
+
+@contextmanager
+def async_read_routes():
+    """
+    Routes the reads to the async views, as asgi.py does: urls.py picks
+    them when it's imported.
+    """
+    def reload():
+        # The project urls hold the resolver of the included ones
+        for module in (agency_urls, importlib.import_module(settings.ROOT_URLCONF)):
+            importlib.reload(module)
+        clear_url_caches()
+
+    try:
+        with override_settings(ASYNC_READ_VIEWS=True):
+            reload()
+            yield
+    finally:
+        reload()
+
+
+class TripResponseCacheTests(TestCase):
+    def setUp(self):
+        caches["default"].clear()
+        reset_cache_stats()
+        self.client = APIClient()
+        self.trip = make_trip()
+
+    def test_list_is_served_from_cache(self):
+        first = self.client.get("/trips/", format="json")
+        with self.assertNumQueries(0):
+            second = self.client.get("/trips/", format="json")
+
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first["ETag"], second["ETag"])
+        self.assertEqual(get_cache_stats(), {"hits": 1, "misses": 1})
+
+    def test_child_change_invalidates_list_and_detail(self):
+        url = f"/trips/{self.trip.pk}/"
+        self.client.get("/trips/")
+        self.client.get(url)
+
+        FAQ.objects.create(trip=self.trip, question="Новый вопрос", answer="Ответ")
+
+        self.assertContains(self.client.get(url), "Новый вопрос")
+        self.client.get("/trips/")
+        self.assertEqual(get_cache_stats(), {"hits": 0, "misses": 4})
+
+    def test_other_trip_change_keeps_detail_cached(self):
+        url = f"/trips/{self.trip.pk}/"
+        self.client.get(url)
+        make_trip(slug="other")
+
+        self.client.get(url)
+        self.assertEqual(get_cache_stats()["hits"], 1)
+
+    def test_if_none_match_returns_not_modified(self):
+        url = f"/trips/{self.trip.pk}/"
+        etag = self.client.get(url)["ETag"]
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(response.content, b"")
+
+    def test_missing_trip_is_not_cached(self):
+        self.assertEqual(self.client.get("/trips/0/").status_code, 404)
+        self.assertEqual(self.client.get("/trips/0/").status_code, 404)
+        self.assertEqual(get_cache_stats(), {"hits": 0, "misses": 2})
+
+
+class FileBasedTripResponseCacheTests(TripResponseCacheTests):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        settings_override = override_settings(CACHES={
+            "default": {
+                "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                "LOCATION": self.cache_dir.name,
+            }
+        })
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(self.cache_dir.cleanup)
+        super().setUp()
+
+
+class FakeTelegramServer(ThreadingHTTPServer):
+    """Stands in for api.telegram.org, answers `fail_with` while it is set."""
+
+    def __init__(self):
+        self.messages = []
+        self.fail_with = None
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                status = server.fail_with or 200
+                if status == 200:
+                    server.messages.append((self.path, body))
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.end_headers()
+                self.wfile.write(b'{"ok": true}')
+
+            def log_message(self, *args):
+                pass
+
+        super().__init__(("127.0.0.1", 0), Handler)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+@override_settings(TELEGRAM_OUTBOX_MAX_ATTEMPTS=3, TELEGRAM_OUTBOX_BACKOFF=30)
+class NotificationOutboxTests(TestCase):
+    def setUp(self):
+        self.server = FakeTelegramServer()
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        self.transport = TelegramTransport(token="token", chat_id="42", api_url=self.server.url)
+        self.trip = make_trip(slug="iceland")
+        # Submission rate counters live in the cache
+        caches["default"].clear()
+
+    def post_request(self, **data):
+        payload = {"trip": "iceland", "name": "Анна", "phone": "+420777123456", "preferred_contact": "tg"}
+        payload.update(data)
+        return APIClient().post("/request/", payload, format="json")
+
+    def test_request_is_queued_without_calling_telegram(self):
+        response = self.post_request()
+
+        self.assertEqual(response.status_code, 201)
+        notification = NotificationOutbox.objects.get()
+        self.assertEqual(notification.status, "pending")
+        self.assertIn("Анна", notification.text)
+        self.assertEqual(self.server.messages, [])
+
+    def test_spam_request_is_not_queued(self):
+        TripRequest.objects.create(trip=self.trip, name="Бот", phone="+420777123456", preferred_contact="tg", is_spam=True)
+        self.assertFalse(NotificationOutbox.objects.exists())
+
+    def test_worker_sends_batch(self):
+        for i in range(5):
+            self.post_request(name=f"Клиент {i}", phone=f"+42077712345{i}")
+
+        counts = process_batch(self.transport, batch_size=10, workers=3)
+
+        self.assertEqual(counts, {"sent": 5, "retried": 0, "dead": 0})
+        self.assertEqual(len(self.server.messages), 5)
+        path, body = self.server.messages[0]
+        self.assertEqual(path, "/bottoken/sendMessage")
+        self.assertEqual(body["chat_id"], "42")
+        self.assertFalse(NotificationOutbox.objects.exclude(status="sent").exists())
+
+    def test_failed_notification_is_retried_with_backoff_then_dead(self):
+        self.post_request()
+        self.server.fail_with = 502
+
+        with self.assertLogs("agency.notifications", level="WARNING"):
+            self.assertEqual(process_batch(self.transport)["retried"], 1)
+        notification = NotificationOutbox.objects.get()
+        self.assertEqual(notification.attempts, 1)
+        self.assertIn("502", notification.last_error)
+        self.assertGreater(notification.next_attempt_at, notification.created_at + datetime.timedelta(seconds=29))
+
+        # not due yet
+        self.assertEqual(process_batch(self.transport), {"sent": 0, "retried": 0, "dead": 0})
+
+        for expected in ("retried", "dead"):
+            NotificationOutbox.objects.update(next_attempt_at=notification.created_at)
+            with self.assertLogs("agency.notifications", level="WARNING"):
+                self.assertEqual(process_batch(self.transport)[expected], 1)
+
+        notification.refresh_from_db()
+        self.assertEqual(notification.status, "dead")
+        self.assertEqual(notification.attempts, 3)
+        self.assertEqual(self.server.messages, [])
+
+    def test_command_drains_outbox(self):
+        self.post_request()
+        with override_settings(TELEGRAM_API_URL=self.server.url):
+            call_command("process_outbox", "--once", stdout=io.StringIO())
+
+        self.assertEqual(NotificationOutbox.objects.get().status, "sent")
+        self.assertEqual(len(self.server.messages), 1)
+
+
+@override_settings(SPAM_RULES_CHECK_INTERVAL=3600)
+class QueryCountTests(TestCase):
+    """
+    Every action must run the same number of queries however many trips,
+    dates, photos and requests there are: each test checks the count on a
+    small catalogue and again after it has grown.
+    """
+
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        settings_override = override_settings(MEDIA_ROOT=self.media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(self.media_root.cleanup)
+        self.client = APIClient()
+        caches["default"].clear()
+        # Spam rules are loaded once per process, not per request
+        get_scorer()
+
+    def grow(self):
+        size = Trip.objects.count() + 2
+        for _ in range(2):
+            trip = make_trip(country="it", dates=size, photos=size, days=size, features=size, faqs=size)
+            TripPhoto.objects.create(trip=trip, photo="gallery.jpg", type="gallery")
+            self.photo = TripPhoto.objects.create(trip=trip, photo="main.jpg", type="main")
+            TripRequest.objects.create(trip=trip, name="Анна", phone="+420777123456", preferred_contact="tg")
+            Review.objects.create(name="Анна", avatar="reviews/a.jpg", text="Отлично")
+            Sociallink.objects.create(name="tg", url="https://t.me/fierytrips")
+        return trip
+
+    def assertConstantQueries(self, num, request, status=200):
+        for _ in range(2):
+            target = self.grow()
+            caches["default"].clear()
+            with self.assertNumQueries(num):
+                response = request(target)
+            self.assertEqual(response.status_code, status, response.content)
+
+    # TripViewSet
+
+    def test_trip_list(self):
+        # Last-Modified, trips with their stored date summary, then slide photos
+        self.assertConstantQueries(3, lambda trip: self.client.get("/trips/"))
+
+    def test_trip_retrieve(self):
+        self.assertConstantQueries(7, lambda trip: self.client.get(f"/trips/{trip.pk}/"))
+
+    def test_trip_partial_update(self):
+        # select, old country, update, then the detail payload is read without
+        # prefetching; the country index only changes with the country
+        self.assertConstantQueries(
+            8, lambda trip: self.client.patch(f"/trips/{trip.pk}/", {"title": "Новое название"}, format="json")
+        )
+
+    def test_trip_destroy(self):
+        # the photos' blob references are released with one read and one update
+        self.assertConstantQueries(20, lambda trip: self.client.delete(f"/trips/{trip.pk}/"), status=204)
+
+    def test_trip_country_trips(self):
+        self.assertConstantQueries(3, lambda trip: self.client.get("/trips/countries/it/"))
+
+    def test_trip_list_countries(self):
+        self.assertConstantQueries(2, lambda trip: self.client.get("/trips/countries/"))
+
+    # TripPhotoViewSet
+
+    def test_photo_list(self):
+        self.assertConstantQueries(1, lambda trip: self.client.get("/photos/"))
+
+    def test_photo_retrieve(self):
+        self.assertConstantQueries(1, lambda trip: self.client.get(f"/photos/{self.photo.pk}/"))
+
+    def test_photo_partial_update(self):
+        # select, pool entry, stored file, update, trip updated_at; a slide
+        # photo leaves the country index alone
+        self.assertConstantQueries(
+            5, lambda trip: self.client.patch(f"/photos/{self.photo.pk}/", {"caption": "Рассвет"}, format="json")
+        )
+
+    def test_photo_destroy(self):
+        # one of them releases the blob references
+        self.assertConstantQueries(4, lambda trip: self.client.delete(f"/photos/{self.photo.pk}/"), status=204)
+
+    def test_photo_typed_lists(self):
+        for url in ("/photos/main-photos/", "/photos/gallery-photos/", "/photos/slide-photos/"):
+            with self.subTest(url=url):
+                self.assertConstantQueries(1, lambda trip: self.client.get(url))
+
+    # TripRequestListCreateViewSet
+
+    def test_request_list(self):
+        self.assertConstantQueries(1, lambda trip: self.client.get("/request/"))
+
+    def test_request_create(self):
+        payload = {"name": "Анна", "phone": "+420777123456", "preferred_contact": "tg"}
+        # trip lookup, then request and outbox row inside a savepoint
+        self.assertConstantQueries(
+            5, lambda trip: self.client.post("/request/", {"trip": trip.slug, **payload}, format="json"), status=201
+        )
+
+    # ReviewViewSet
+
+    def test_review_list(self):
+        self.assertConstantQueries(1, lambda trip: self.client.get("/reviews/"))
+
+    def test_review_create(self):
+        # insert, then the avatar's blob is looked up, created and counted;
+        # a new image every time, the same one is only counted
+        self.assertConstantQueries(
+            4,
+            lambda trip: self.client.post(
+                "/reviews/", {"name": "Анна", "text": "Отлично", "avatar": make_image(size=(trip.pk, 4))}
+            ),
+            status=201,
+        )
+
+    # SocialLinkViewSet
+
+    def test_social_link_list(self):
+        self.assertConstantQueries(1, lambda trip: self.client.get("/social-links/"))
+
+
+class SeatCounterTests(TestCase):
+    def setUp(self):
+        self.trip = make_trip(dates=2)
+        self.first, self.second = self.trip.trip_dates.order_by('start_date')
+
+    def test_reserve_updates_date_and_trip(self):
+        self.first.reserve(3)
+        self.second.reserve(2)
+
+        self.trip.refresh_from_db()
+        self.assertEqual(self.first.current_members, 3)
+        self.assertEqual(self.first.available_spots, 9)
+        self.assertEqual(self.trip.current_members, 5)
+
+    def test_reserve_does_not_oversell(self):
+        self.first.reserve(10)
+        with self.assertRaises(ValidationError):
+            self.first.reserve(3)
+
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.current_members, 10)
+
+    def test_release(self):
+        self.first.reserve(4)
+        self.first.release(1)
+        with self.assertRaises(ValidationError):
+            self.first.release(5)
+
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.current_members, 3)
+
+    def test_date_edit_and_delete_recount_trip(self):
+        self.first.current_members = 6
+        self.first.save()
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.current_members, 6)
+
+        self.first.delete()
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.current_members, 0)
+
+    def test_trip_save_keeps_counter(self):
+        stale = Trip.objects.get(pk=self.trip.pk)
+        self.first.reserve(2)
+
+        stale.title = "Новое название"
+        stale.save()
+
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.current_members, 2)
+
+    def test_reconcile_command(self):
+        self.first.reserve(5)
+        Trip.objects.update(current_members=42)
+
+        out = io.StringIO()
+        call_command("reconcile_seats", stdout=out)
+
+        self.assertIn("42 -> 5", out.getvalue())
+        self.trip.refresh_from_db()
+        self.assertEqual(self.trip.current_members, 5)
+
+
+@override_settings(IMAGE_PROCESSING_SYNC=True)
+class ConcurrentBookingTests(TransactionTestCase):
+    def test_parallel_reservations_never_oversell(self):
+        # Commits right away, built here rather than in a pool process
+        with self.assertLogs("agency.images", "WARNING"):
+            trip = make_trip(dates=1)
+        trip_date = trip.trip_dates.get()
+        results = []
+
+        def book():
+            try:
+                TripDate.objects.get(pk=trip_date.pk).reserve(1)
+                results.append(True)
+            except ValidationError:
+                results.append(False)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=book) for _ in range(30)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        trip.refresh_from_db()
+        trip_date.refresh_from_db()
+        self.assertEqual(results.count(True), trip.group_size)
+        self.assertEqual(trip_date.current_members, trip.group_size)
+        self.assertEqual(trip.current_members, trip.group_size)
+
+
+class PaginationAndFieldsTests(TestCase):
+    def setUp(self):
+        caches["default"].clear()
+        self.client = APIClient()
+        self.trip = make_trip(slug="iceland")
+        for i in range(5):
+            TripRequest.objects.create(trip=self.trip, name=f"Клиент {i}", phone="+420777123456", preferred_contact="tg")
+
+    def test_request_list_is_cursor_paginated(self):
+        names = []
+        url = "/request/?page_size=2"
+        while url:
+            page = self.client.get(url).json()
+            self.assertLessEqual(len(page["results"]), 2)
+            names += [row["name"] for row in page["results"]]
+            url = page["next"]
+
+        self.assertEqual(names, [f"Клиент {i}" for i in reversed(range(5))])
+
+    def test_page_size_is_capped(self):
+        for i in range(110):
+            Sociallink.objects.create(name=f"link {i}", url="https://t.me/fierytrips")
+            TripPhoto.objects.create(trip=self.trip, photo=f"{i}.jpg", type="gallery")
+
+        self.assertEqual(len(self.client.get("/photos/?page_size=500").json()["results"]), 100)
+        self.assertEqual(len(self.client.get("/photos/gallery-photos/").json()["results"]), 20)
+
+    def test_sparse_fields_limit_output_and_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/trips/?fields=id,title,country")
+
+        self.assertEqual(response.json()["results"], [{"id": self.trip.pk, "title": "Тур", "country": "Италия"}])
+        # After the Last-Modified query
+        trip_query = queries.captured_queries[1]["sql"]
+        self.assertIn('"agency_trip"."country"', trip_query)
+        self.assertNotIn('"agency_trip"."description"', trip_query)
+
+    def test_sparse_fields_on_related_slug(self):
+        with self.assertNumQueries(1):
+            rows = self.client.get("/request/?fields=trip,name").json()["results"]
+        self.assertEqual(rows[0], {"trip": "iceland", "name": "Клиент 4"})
+
+        with CaptureQueriesContext(connection) as queries:
+            rows = self.client.get("/request/?fields=name").json()["results"]
+        self.assertEqual(rows[0], {"name": "Клиент 4"})
+        self.assertNotIn("JOIN", queries.captured_queries[0]["sql"])
+
+    def test_unknown_field_is_rejected(self):
+        response = self.client.get("/reviews/?fields=id,password")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("password", response.json()["fields"])
+
+
+class CountryIndexTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.trip = make_trip(country="it", slug="rome")
+        self.photo = TripPhoto.objects.create(trip=self.trip, photo="rome.jpg", type="gallery")
+
+    def test_countries_are_served_from_index_in_one_query(self):
+        make_trip(country="is", slug="iceland")
+
+        # Last-Modified, then the index
+        with self.assertNumQueries(2):
+            response = self.client.get("/trips/countries/")
+
+        self.assertEqual(response.json(), [
+            {"country": "is", "country_name": "Исландия", "photo": None, "trip_count": 1, "min_price": "1000"},
+            {"country": "it", "country_name": "Италия", "photo": "rome.jpg", "trip_count": 1, "min_price": "1000"},
+        ])
+
+    def test_photo_pool_follows_photo_changes(self):
+        TripPhoto.objects.create(trip=self.trip, photo="venice.jpg", type="gallery")
+        TripPhoto.objects.create(trip=self.trip, photo="slide.jpg", type="slide")
+        self.assertEqual(CountryIndex.objects.get().gallery_photos, ["rome.jpg", "venice.jpg"])
+
+        self.photo.type = "slide"
+        self.photo.save()
+        self.assertEqual(CountryIndex.objects.get().gallery_photos, ["venice.jpg"])
+
+    def test_price_and_count_follow_trip_changes(self):
+        other = make_trip(country="it", slug="milan")
+        TripDate.objects.filter(trip=other).update(price=700)
+        TripDate.objects.filter(trip=other).first().save()
+        index = CountryIndex.objects.get()
+        self.assertEqual((index.trip_count, index.min_price), (2, 700))
+
+        other.country = "fr"
+        other.save()
+        self.assertEqual(CountryIndex.objects.get(country="it").trip_count, 1)
+        self.assertEqual(CountryIndex.objects.get(country="fr").trip_count, 1)
+
+        self.trip.delete()
+        self.assertEqual(list(CountryIndex.objects.values_list("country", flat=True)), ["fr"])
+
+    def test_changes_update_the_entry_without_rescanning_the_country(self):
+        photo = TripPhoto.objects.create(trip=self.trip, photo="venice.jpg", type="gallery")
+        with CaptureQueriesContext(connection) as queries:
+            photo.caption = "Венеция"
+            photo.save()
+            photo.delete()
+            TripDate.objects.create(
+                trip=self.trip, start_date=datetime.date.today() + datetime.timedelta(days=5),
+                end_date=datetime.date.today() + datetime.timedelta(days=9), price=400,
+            )
+        self.assertFalse([query for query in queries if '"agency_trip"."country" =' in query["sql"]])
+        index = CountryIndex.objects.get()
+        self.assertEqual((index.gallery_photos, index.min_price), (["rome.jpg"], 400))
+
+        # The cheapest date goes, the minimum is looked up again
+        TripDate.objects.get(price=400).delete()
+        self.assertEqual(CountryIndex.objects.get().min_price, 1000)
+        other = TripPhoto.objects.create(trip=self.trip, photo="rome.jpg", type="gallery")
+        other.delete()
+        self.assertEqual(CountryIndex.objects.get().gallery_photos, ["rome.jpg"])
+
+    def test_rebuild(self):
+        CountryIndex.objects.all().delete()
+        CountryIndex.rebuild()
+        self.assertEqual(CountryIndex.objects.get().gallery_photos, ["rome.jpg"])
+
+
+@override_settings(IMAGE_VARIANTS={"thumb": (100, 100), "card": (400, 300), "hero": (2000, 1000)})
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        settings_override = override_settings(MEDIA_ROOT=self.media_root.name, MEDIA_URL="/media/")
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(self.media_root.cleanup)
+        self.trip = make_trip(photos=0)
+
+    def test_variants_are_stored_as_blobs(self):
+        with override_settings(IMAGE_PROCESSING_SYNC=True):
+            photo = TripPhoto.objects.create(trip=self.trip, photo=make_image("lake.png", (1200, 800)), type="slide")
+
+        photo.refresh_from_db()
+        self.assertEqual(photo.variants["source"], photo.photo.name)
+        self.assertEqual(photo.variants["thumb"]["width"], 100)
+        self.assertEqual(photo.variants["card"]["width"], 400)
+        # never upscaled
+        self.assertEqual(photo.variants["hero"]["width"], 1200)
+        for variant in ("thumb", "card", "hero"):
+            for key in ("jpeg", "webp"):
+                name = photo.variants[variant][key]
+                self.assertTrue(name.startswith("blobs/"))
+                self.assertTrue(photo.photo.storage.exists(name))
+
+    def test_srcset_is_exposed(self):
+        with override_settings(IMAGE_PROCESSING_SYNC=True):
+            photo = TripPhoto.objects.create(trip=self.trip, photo=make_image("lake.png", (1200, 800)), type="slide")
+        photo.refresh_from_db()
+
+        data = APIClient().get(f"/photos/{photo.pk}/").json()
+        jpeg = data["srcset"]["jpeg"].split(", ")
+        self.assertEqual(len(jpeg), 3)
+        self.assertTrue(jpeg[0].startswith("http://testserver/media/blobs/"))
+        self.assertTrue(jpeg[0].endswith(".jpg 100w"))
+        self.assertTrue(data["srcset"]["webp"].endswith(".webp 1200w"))
+
+        caches["default"].clear()
+        trip = APIClient().get("/trips/").json()["results"][0]
+        self.assertIn(".jpg 400w", trip["photo_srcset"]["jpeg"])
+
+    def test_srcset_is_null_until_built(self):
+        photo = TripPhoto.objects.create(trip=self.trip, photo=make_image("lake.png"), type="slide")
+        self.assertIsNone(APIClient().get(f"/photos/{photo.pk}/").json()["srcset"])
+
+    def test_backfill_command(self):
+        reviews = [
+            Review.objects.create(name=f"Клиент {i}", avatar=make_image(f"{i}.png", (300, 300)), text="Отлично")
+            for i in range(3)
+        ]
+
+        out = io.StringIO()
+        call_command("generate_image_variants", "--workers", "2", "--only", "reviews", stdout=out)
+
+        self.assertIn("reviews: 3 processed, 0 failed", out.getvalue())
+        for review in reviews:
+            review.refresh_from_db()
+            self.assertEqual(review.variants["thumb"]["width"], 100)
+            self.assertEqual(review.variants["card"]["width"], 300)
+
+    @override_settings(IMAGE_PROCESSING_POOL=False)
+    def test_uploads_wait_for_the_image_worker(self):
+        with mock.patch("agency.images.get_executor") as get_executor, self.captureOnCommitCallbacks(execute=True):
+            photo = TripPhoto.objects.create(trip=self.trip, photo=make_image("lake.png"), type="slide")
+        get_executor.assert_not_called()
+        self.assertEqual(list(pending(TripPhoto, "photo")), [photo])
+
+        # A new file makes built variants stale again
+        call_command("generate_image_variants", "--only", "photos", stdout=io.StringIO())
+        self.assertFalse(pending(TripPhoto, "photo").exists())
+        photo.photo = make_image("sea.png")
+        photo.save()
+        self.assertEqual(list(pending(TripPhoto, "photo")), [photo])
+
+    def test_unreadable_original_is_skipped(self):
+        with self.assertLogs("agency.images", level="WARNING"):
+            self.assertIsNone(render_variants("reviews/missing.png"))
+
+
+class MediaStorageTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        settings_override = override_settings(MEDIA_ROOT=self.media_root.name, MEDIA_GC_GRACE_HOURS=24)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(self.media_root.cleanup)
+        self.trip = make_trip(photos=0)
+        self.later = timezone.now() + datetime.timedelta(hours=25)
+
+    def counts(self):
+        return dict(MediaBlob.objects.values_list("name", "ref_count"))
+
+    def test_same_upload_is_stored_once(self):
+        other = make_trip(slug="other", photos=0)
+        first = TripPhoto.objects.create(trip=self.trip, photo=make_image("a.png"), type="slide")
+        second = TripPhoto.objects.create(trip=other, photo=make_image("b.png"), type="slide")
+
+        self.assertEqual(first.photo.name, second.photo.name)
+        self.assertTrue(first.photo.name.startswith("blobs/"))
+        self.assertEqual(self.counts(), {first.photo.name: 2})
+        self.assertEqual(len(os.listdir(os.path.dirname(first.photo.path))), 1)
+
+    def test_references_follow_saves_and_deletes(self):
+        photo = TripPhoto.objects.create(trip=self.trip, photo=make_image(), type="slide")
+        old = photo.photo.name
+        photo.photo = make_image(size=(8, 8))
+        photo.save()
+        self.assertEqual(self.counts(), {old: 0, photo.photo.name: 1})
+
+        photo.delete()
+        self.assertEqual(self.counts(), {old: 0, photo.photo.name: 0})
+
+    def test_trip_delete_releases_its_photos(self):
+        for size in (4, 8):
+            TripPhoto.objects.create(trip=self.trip, photo=make_image(size=(size, size)), type="gallery")
+        self.trip.delete()
+        self.assertEqual(set(self.counts().values()), {0})
+
+    def test_variants_are_counted(self):
+        with override_settings(IMAGE_PROCESSING_SYNC=True):
+            photo = TripPhoto.objects.create(trip=self.trip, photo=make_image(size=(600, 400)), type="slide")
+        photo.refresh_from_db()
+        # the original and both formats of each size; card and hero are the
+        # same unscaled image, stored and counted once
+        self.assertEqual(photo.variants["card"], photo.variants["hero"])
+        self.assertEqual(self.counts(), dict.fromkeys(self.counts(), 1))
+        self.assertEqual(len(self.counts()), 5)
+        self.assertEqual(recount(), 0)
+
+        photo.delete()
+        self.assertEqual(set(self.counts().values()), {0})
+
+    def test_garbage_is_collected_after_the_grace_period(self):
+        kept = TripPhoto.objects.create(trip=self.trip, photo=make_image(), type="slide")
+        removed = TripPhoto.objects.create(trip=self.trip, photo=make_image(size=(8, 8)), type="slide")
+        removed.delete()
+        # an upload whose row was never saved
+        orphan = default_storage.save("reviews/x.png", make_image(size=(2, 2)))
+
+        self.assertEqual(collect_garbage(), [])
+        deleted = {name for name, _ in collect_garbage(self.later)}
+
+        self.assertEqual(deleted, {removed.photo.name, orphan})
+        self.assertFalse(default_storage.exists(orphan))
+        self.assertFalse(default_storage.exists(removed.photo.name))
+        self.assertTrue(default_storage.exists(kept.photo.name))
+        self.assertEqual(self.counts(), {kept.photo.name: 1})
+
+    def test_blob_uploaded_again_is_not_collected(self):
+        photo = TripPhoto.objects.create(trip=self.trip, photo=make_image(), type="slide")
+        photo.delete()
+        path = photo.photo.path
+        day_ago = (timezone.now() - datetime.timedelta(days=2)).timestamp()
+        os.utime(path, (day_ago, day_ago))
+        MediaBlob.objects.update(updated_at=timezone.now() - datetime.timedelta(days=2))
+
+        # the upload of a new row, saved after the garbage is found
+        default_storage.save("trip_1/slide/again.png", make_image())
+        self.assertEqual(collect_garbage(), [])
+        self.assertTrue(os.path.exists(path))
+
+    def test_recount_fixes_drift(self):
+        photo = TripPhoto.objects.create(trip=self.trip, photo=make_image(), type="slide")
+        MediaBlob.objects.update(ref_count=5)
+        MediaBlob.objects.create(name="blobs/gone.png", ref_count=1)
+
+        self.assertEqual(recount(), 2)
+        self.assertEqual(self.counts(), {photo.photo.name: 1, "blobs/gone.png": 0})
+
+    def test_usage_report(self):
+        other = make_trip(slug="other", photos=0)
+        for trip in (self.trip, other):
+            photo = TripPhoto.objects.create(trip=trip, photo=make_image(), type="slide")
+        size = photo.photo.size
+        default_storage.save("reviews/x.png", make_image(size=(2, 2)))
+
+        report = usage()
+        self.assertEqual(report["blobs"], 1)
+        self.assertEqual(report["stored_bytes"], size)
+        self.assertEqual(report["referenced_bytes"], 2 * size)
+        self.assertEqual(report["saved_bytes"], size)
+        self.assertEqual(report["untracked_blobs"], 1)
+
+        out = io.StringIO()
+        call_command("media_usage", stdout=out)
+        self.assertIn("In use:    1 blob(s)", out.getvalue())
+
+    def test_gc_command(self):
+        photo = TripPhoto.objects.create(trip=self.trip, photo=make_image(), type="slide")
+        photo.delete()
+
+        out = io.StringIO()
+        call_command("gc_media", "--grace-hours", "0", "--dry-run", stdout=out)
+        self.assertIn("1 blob(s) unused", out.getvalue())
+        self.assertTrue(default_storage.exists(photo.photo.name))
+
+        call_command("gc_media", "--grace-hours", "0", "--recount", stdout=out)
+        self.assertIn("1 blob(s) deleted", out.getvalue())
+        self.assertFalse(default_storage.exists(photo.photo.name))
+
+
+class FakeS3Server(ThreadingHTTPServer):
+    """
+    Stands in for an S3-compatible endpoint: objects in a dict, lists two
+    keys a page to exercise continuation. Requests must be signed.
+    """
+    page_size = 2
+
+    def __init__(self):
+        self.objects = {}
+        self.unsigned = 0
+        self.uploads = 0
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def parse(self):
+                path, _, query = self.path.partition("?")
+                bucket, _, key = path.lstrip("/").partition("/")
+                if not self.headers.get("Authorization", "").startswith("AWS4-HMAC-SHA256 Credential=key/"):
+                    server.unsigned += 1
+                return bucket, key, dict(pair.split("=", 1) for pair in query.split("&") if pair)
+
+            def reply(self, status, body=b"", headers=None):
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                if "Content-Length" not in (headers or {}):
+                    self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(body)
+
+            def object_headers(self, item):
+                return {
+                    "Content-Length": str(len(item["body"])),
+                    "Last-Modified": http_date(item["modified"].timestamp()),
+                    "Content-Type": item["content_type"],
+                }
+
+            def do_PUT(self):
+                _, key, _ = self.parse()
+                source = self.headers.get("x-amz-copy-source")
+                if source:
+                    source = source.lstrip("/").partition("/")[2]
+                    if source not in server.objects:
+                        return self.reply(404)
+                    body = server.objects[source]["body"]
+                else:
+                    body = self.rfile.read(int(self.headers["Content-Length"]))
+                    server.uploads += 1
+                server.objects[key] = {
+                    "body": body,
+                    "content_type": self.headers["Content-Type"],
+                    "cache_control": self.headers["Cache-Control"],
+                    "modified": timezone.now(),
+                }
+                self.reply(200)
+
+            def do_HEAD(self):
+                _, key, _ = self.parse()
+                if key not in server.objects:
+                    return self.reply(404)
+                self.reply(200, headers=self.object_headers(server.objects[key]))
+
+            def do_GET(self):
+                _, key, query = self.parse()
+                if query.get("list-type") == "2":
+                    return self.reply(200, server.list(query))
+                if key not in server.objects:
+                    return self.reply(404)
+                item = server.objects[key]
+                self.reply(200, item["body"], self.object_headers(item))
+
+            def do_DELETE(self):
+                _, key, _ = self.parse()
+                server.objects.pop(key, None)
+                self.reply(204)
+
+            def log_message(self, *args):
+                pass
+
+        super().__init__(("127.0.0.1", 0), Handler)
+
+    def list(self, query):
+        from urllib.parse import unquote
+
+        prefix, delimiter = unquote(query.get("prefix", "")), unquote(query.get("delimiter", ""))
+        start = int(query.get("continuation-token", 0))
+        keys, prefixes = [], set()
+        for key in sorted(self.objects):
+            if not key.startswith(prefix):
+                continue
+            rest = key[len(prefix):]
+            if delimiter and delimiter in rest:
+                prefixes.add(prefix + rest.split(delimiter)[0] + delimiter)
+            else:
+                keys.append(key)
+        page = keys[start:start + self.page_size]
+        truncated = start + self.page_size < len(keys)
+        xml = ['<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">']
+        for key in page:
+            item = self.objects[key]
+            xml.append(
+                f"<Contents><Key>{key}</Key><Size>{len(item['body'])}</Size>"
+                f"<LastModified>{item['modified'].strftime('%Y-%m-%dT%H:%M:%S.000Z')}</LastModified></Contents>"
+            )
+        xml.extend(f"<CommonPrefixes><Prefix>{name}</Prefix></CommonPrefixes>" for name in sorted(prefixes))
+        xml.append(f"<IsTruncated>{'true' if truncated else 'false'}</IsTruncated>")
+        if truncated:
+            xml.append(f"<NextContinuationToken>{start + self.page_size}</NextContinuationToken>")
+        xml.append("</ListBucketResult>")
+        return "".join(xml).encode()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class S3BlobStorageTests(TestCase):
+    def setUp(self):
+        self.server = FakeS3Server()
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.storage = S3BlobStorage(
+            self.server.url, "media", "key", "secret", public_url="https://media.example.com",
+        )
+
+    def test_blobs_round_trip(self):
+        name = self.storage.save("trip_1/slide/lake.png", make_image())
+        again = self.storage.save("reviews/other.PNG", make_image())
+
+        self.assertEqual(name, again)
+        self.assertEqual(list(self.server.objects), [name])
+        self.assertEqual(self.server.uploads, 1)
+        stored = self.server.objects[name]
+        self.assertEqual(stored["content_type"], "image/png")
+        self.assertIn("immutable", stored["cache_control"])
+
+        self.assertTrue(self.storage.exists(name))
+        self.assertEqual(self.storage.size(name), len(stored["body"]))
+        with self.storage.open(name) as file:
+            self.assertEqual(file.read(), stored["body"])
+        self.assertEqual(self.storage.url(name), f"https://media.example.com/{name}")
+        self.assertLess(abs(self.storage.get_modified_time(name) - timezone.now()), datetime.timedelta(minutes=1))
+
+        self.storage.delete(name)
+        self.assertFalse(self.storage.exists(name))
+        self.assertEqual(self.server.unsigned, 0)
+
+    def test_duplicate_upload_refreshes_the_blob_in_place(self):
+        name = self.storage.save("trip_1/slide/lake.png", make_image())
+        stored = self.server.objects[name]
+        stored["modified"] -= datetime.timedelta(days=2)
+
+        self.assertEqual(self.storage.save("trip_2/slide/lake.png", make_image()), name)
+        refreshed = self.server.objects[name]
+        self.assertEqual(self.server.uploads, 1)
+        self.assertEqual(refreshed["body"], stored["body"])
+        self.assertEqual((refreshed["content_type"], refreshed["cache_control"]), ("image/png", stored["cache_control"]))
+        self.assertLess(abs(self.storage.get_modified_time(name) - timezone.now()), datetime.timedelta(minutes=1))
+
+    def test_listing_follows_continuation(self):
+        names = {self.storage.save("x.png", make_image(size=(size, 1))) for size in range(1, 6)}
+        self.storage.client.put("reviews/old.png", b"old", "image/png", "no-cache")
+
+        self.assertEqual({name for name, _, _ in self.storage.iter_blobs()}, names)
+        directories, files = self.storage.listdir("")
+        self.assertEqual(sorted(directories), ["blobs", "reviews"])
+        self.assertEqual(files, [])
+        self.assertEqual(self.storage.listdir("reviews"), ([], ["old.png"]))
+
+
+class TripSearchTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.iceland = make_trip(title="Зимняя Исландия", country="is", slug="iceland", faqs=0)
+        self.iceland.duration_days = 10
+        self.iceland.save()
+        ProgramByDay.objects.create(trip=self.iceland, title="Ледник", description="Поход по леднику Ватнайекюдль")
+        self.italy = make_trip(title="Осенняя Италия", country="it", slug="italy", dates=2)
+        FAQ.objects.create(trip=self.italy, question="Нужна ли виза?", answer="Да, шенгенская виза")
+        TripDate.objects.filter(trip=self.iceland).update(price=2500)
+        get_index().build()
+
+    def search(self, **params):
+        response = self.client.get("/trips/search/", params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_tokenize_normalizes_russian(self):
+        self.assertEqual(tokenize("Исландии"), tokenize("исландия"))
+        self.assertEqual(tokenize("ледники"), tokenize("Ледник"))
+        self.assertEqual(tokenize("ёлка"), tokenize("елки"))
+
+    def test_matches_title_program_and_faq(self):
+        self.assertEqual([t["id"] for t in self.search(q="исландии")["results"]], [self.iceland.pk])
+        self.assertEqual([t["id"] for t in self.search(q="ледниками")["results"]], [self.iceland.pk])
+        self.assertEqual([t["id"] for t in self.search(q="шенгенские визы")["results"]], [self.italy.pk])
+        self.assertEqual(self.search(q="исландия виза")["results"], [])
+
+    def test_filters_and_facets(self):
+        data = self.search(country="it")
+        self.assertEqual(data["count"], 1)
+        # the country facet ignores its own filter
+        self.assertEqual(data["facets"]["country"], {"is": 1, "it": 1})
+        self.assertEqual(data["facets"]["duration"], {"4-7": 1})
+
+        data = self.search(price_max=2000)
+        self.assertEqual([t["id"] for t in data["results"]], [self.italy.pk])
+        self.assertEqual(data["facets"]["price"], {"1000-2000": 1, "2000+": 1})
+
+        start = TripDate.objects.filter(trip=self.italy).order_by("start_date").last().start_date
+        data = self.search(date_from=start.isoformat(), country="it,is")
+        self.assertEqual([t["id"] for t in data["results"]], [self.italy.pk])
+        # the month facet ignores the date window
+        iceland_month = self.iceland.trip_dates.get().start_date.strftime("%Y-%m")
+        self.assertIn(iceland_month, data["facets"]["month"])
+
+        self.assertEqual(self.search(duration_min=8)["facets"]["duration"], {"4-7": 1, "8-14": 1})
+
+    def test_index_follows_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            FAQ.objects.create(trip=self.iceland, question="Северное сияние?", answer="Зимой почти всегда")
+        self.assertEqual([t["id"] for t in self.search(q="сияние")["results"]], [self.iceland.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.iceland.delete()
+        self.assertEqual(self.search(q="сияние")["results"], [])
+
+    def test_other_processes_replay_the_changes(self):
+        other = TripSearchIndex()
+        other.build()
+        with self.captureOnCommitCallbacks(execute=True):
+            FAQ.objects.create(trip=self.iceland, question="Северное сияние?", answer="Зимой почти всегда")
+        # Bookings don't touch the log
+        TripDate.objects.filter(trip=self.italy).first().reserve(1)
+
+        with mock.patch.object(other, "build") as build, self.assertNumQueries(5):
+            other.catch_up()
+        build.assert_not_called()
+        self.assertEqual(other.match("сияние"), {self.iceland.pk: 1})
+
+    def test_lost_changes_rebuild_in_the_background(self):
+        other = TripSearchIndex()
+        other.build()
+        with self.captureOnCommitCallbacks(execute=True):
+            FAQ.objects.create(trip=self.iceland, question="Северное сияние?", answer="Зимой почти всегда")
+        caches["default"].delete(change_key(other.seq + 1))
+
+        with mock.patch.object(other, "start_rebuild") as start_rebuild, self.assertNumQueries(0):
+            other.catch_up()
+        start_rebuild.assert_called_once()
+        # The old index keeps answering meanwhile
+        self.assertEqual(other.match("сияние"), {})
+        self.assertIn(self.italy.pk, other.match("италия"))
+
+    def test_search_is_served_without_like_scans(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.search(q="италия")
+        self.assertFalse(any("LIKE" in query["sql"] for query in queries.captured_queries))
+
+    def test_invalid_params(self):
+        response = self.client.get("/trips/search/", {"date_from": "июнь"})
+        self.assertEqual(response.status_code, 400)
+
+
+class CatalogueImportExportTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.start = datetime.date.today() + datetime.timedelta(days=60)
+
+    def record(self, slug="norway", **overrides):
+        record = {
+            "slug": slug, "title": "Фьорды Норвегии", "country": "no", "welcome_message": "Привет",
+            "duration_days": 8, "group_size": 10, "ask_title": "Вопрос", "description": "Фьорды и ледники",
+            "trip_dates": [
+                {"start_date": self.start.isoformat(), "end_date": (self.start + datetime.timedelta(days=8)).isoformat(),
+                 "price": "1800"},
+            ],
+            "program_by_days": [{"day_number": 1, "title": "Берген", "description": "Прилёт"}],
+            "faqs": [{"question": "Виза?", "answer": "Шенген"}],
+            "photos": [{"photo": "trip_x/main/fjord.jpg", "type": "main"}],
+        }
+        record.update(overrides)
+        return record
+
+    def import_records(self, *records, args=()):
+        path = f"{self.directory.name}/trips.jsonl"
+        with open(path, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(r, ensure_ascii=False) + "\n" if isinstance(r, dict) else r for r in records)
+        out, err = io.StringIO(), io.StringIO()
+        call_command("import_trips", path, *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_import_creates_trips_with_children(self):
+        out, err = self.import_records(self.record(), self.record("norway-2", title="Лофотены"))
+
+        self.assertIn("2 created, 0 updated, 0 unchanged, 0 error(s)", out)
+        self.assertEqual(err, "")
+        trip = Trip.objects.get(slug="norway")
+        self.assertEqual(trip.trip_dates.get().price, 1800)
+        self.assertEqual(trip.program_by_days.get().title, "Берген")
+        self.assertEqual(trip.faqs.get().answer, "Шенген")
+        self.assertEqual(trip.photos.get().type, "main")
+        self.assertEqual(CountryIndex.objects.get(country="no").trip_count, 2)
+
+    def test_reimport_reports_a_diff(self):
+        self.import_records(self.record())
+        dates = self.record()["trip_dates"]
+        dates[0]["price"] = "1700"
+        out, _ = self.import_records(
+            self.record(title="Норвегия", trip_dates=dates, faqs=[], program_by_days=[
+                {"day_number": 1, "title": "Берген", "description": "Прилёт"},
+                {"day_number": 2, "title": "Флом", "description": "Поезд"},
+            ]),
+        )
+
+        self.assertIn("~ norway [title] trip_dates +0 ~1 -0 program_by_days +1 ~0 -0 faqs +0 ~0 -1", out)
+        self.assertIn("0 created, 1 updated, 0 unchanged", out)
+        trip = Trip.objects.get(slug="norway")
+        self.assertEqual(trip.title, "Норвегия")
+        self.assertEqual(trip.trip_dates.get().price, 1700)
+        self.assertEqual(trip.program_by_days.count(), 2)
+        self.assertFalse(trip.faqs.exists())
+
+    def test_unchanged_import_writes_nothing(self):
+        self.import_records(self.record())
+        with CaptureQueriesContext(connection) as queries:
+            out, _ = self.import_records(self.record())
+        self.assertIn("0 created, 0 updated, 1 unchanged", out)
+        self.assertFalse(any(q["sql"].startswith(("INSERT", "UPDATE", "DELETE")) for q in queries.captured_queries))
+
+    def test_booked_dates_are_kept(self):
+        self.import_records(self.record())
+        Trip.objects.get(slug="norway").trip_dates.get().reserve(2)
+
+        out, _ = self.import_records(self.record(trip_dates=[]))
+        self.assertIn("kept: 2 seat(s) booked", out)
+        trip = Trip.objects.get(slug="norway")
+        self.assertEqual(trip.trip_dates.count(), 1)
+        self.assertEqual(trip.current_members, 2)
+
+    def test_invalid_records_are_reported_and_skipped(self):
+        out, err = self.import_records(
+            self.record("bad", country="xx"),
+            "{not json\n",
+            self.record("good"),
+        )
+        self.assertIn("1 created, 0 updated, 0 unchanged, 2 error(s)", out)
+        self.assertIn("line 1: bad: country:", err)
+        self.assertIn("line 2:", err)
+        self.assertEqual(list(Trip.objects.values_list("slug", flat=True)), ["good"])
+
+    def test_main_photo_can_be_replaced(self):
+        self.import_records(self.record())
+        out, err = self.import_records(self.record(photos=[{"photo": "trip_x/main/lofoten.jpg", "type": "main"}]))
+        self.assertEqual(err, "")
+        self.assertIn("photos +1 ~0 -1", out)
+        self.assertEqual(Trip.objects.get(slug="norway").photos.get().photo.name, "trip_x/main/lofoten.jpg")
+
+    def test_two_main_photos_are_a_line_error(self):
+        photos = [{"photo": "trip_x/main/a.jpg", "type": "main"}, {"photo": "trip_x/main/b.jpg", "type": "main"}]
+        out, err = self.import_records(self.record("bad", photos=photos), self.record("good"))
+        self.assertIn("line 1: bad: photos: more than one row with type='main'", err)
+        self.assertIn("1 created, 0 updated, 0 unchanged, 1 error(s)", out)
+
+    def test_refused_records_are_reported_and_the_rest_imported(self):
+        write = CatalogueImporter.write
+
+        def refuse_bad(importer, planned):
+            if any(plan["trip"].slug == "bad" for plan in planned):
+                raise IntegrityError("UNIQUE constraint failed")
+            return write(importer, planned)
+
+        with mock.patch.object(CatalogueImporter, "write", refuse_bad):
+            out, err = self.import_records(
+                self.record("good"), self.record("bad"), self.record("later"), args=["--chunk-size", "2"],
+            )
+        self.assertIn("line 2: bad: UNIQUE constraint failed", err)
+        self.assertIn("2 created, 0 updated, 0 unchanged, 1 error(s)", out)
+        self.assertEqual(sorted(Trip.objects.values_list("slug", flat=True)), ["good", "later"])
+
+    def test_dry_run(self):
+        out, _ = self.import_records(self.record(), args=["--dry-run"])
+        self.assertIn("+ norway", out)
+        self.assertIn("1 created", out)
+        self.assertFalse(Trip.objects.exists())
+
+    def test_export_round_trips(self):
+        make_trip(slug="italy", dates=2, days=2)
+        self.import_records(self.record())
+
+        for extension in ("jsonl", "csv"):
+            path = f"{self.directory.name}/export.{extension}"
+            call_command("export_trips", "--output", path)
+            out = io.StringIO()
+            call_command("import_trips", path, stdout=out)
+            self.assertIn("0 created, 0 updated, 2 unchanged, 0 error(s)", out.getvalue())
+
+        out = io.StringIO()
+        call_command("export_trips", stdout=out)
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([r["slug"] for r in records], ["italy", "norway"])
+        self.assertEqual(len(records[0]["trip_dates"]), 2)
+        self.assertNotIn("current_members", records[0])
+
+
+class StreamingListTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        for i in range(3):
+            trip = make_trip(title=f"Тур {i}", photos=3)
+            TripRequest.objects.create(trip=trip, name="Анна", phone=f"+3912345678{i}", preferred_contact="tg")
+        TripPhoto.objects.filter(pk__in=TripPhoto.objects.values("pk")[:2]).update(type="gallery")
+
+    def get_streamed(self, url, **params):
+        response = self.client.get(url, {"stream": "1", **params})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content)
+
+    def test_stream_matches_the_paginated_body(self):
+        for url in ("/photos/", "/photos/gallery-photos/", "/request/", "/reviews/"):
+            with self.subTest(url=url):
+                expected = self.client.get(url, {"page_size": 100}).content
+                self.assertEqual(self.get_streamed(url), expected)
+        self.assertEqual(self.get_streamed("/social-links/"), self.client.get("/social-links/").content)
+
+    def test_stream_returns_every_row(self):
+        data = json.loads(self.get_streamed("/photos/"))
+        self.assertEqual(len(data["results"]), 9)
+        self.assertIsNone(data["next"])
+        self.assertEqual(json.loads(self.get_streamed("/request/", fields="name"))["results"][0], {"name": "Анна"})
+
+    def test_rows_are_read_with_one_query(self):
+        with self.assertNumQueries(1):
+            self.get_streamed("/request/")
+
+    def test_browsable_api_is_not_streamed(self):
+        response = self.client.get("/photos/", {"stream": "1"}, HTTP_ACCEPT="text/html")
+        self.assertFalse(response.streaming)
+
+
+class FakeClock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@override_settings(RATE_LIMIT_BACKEND="agency.ratelimit.TokenBucketRateLimitBackend")
+class TripRequestRateLimitTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.trip = make_trip(slug="iceland")
+        self.backend = get_rate_limit_backend()
+        self.backend.reset()
+        self.backend.clock = self.clock = FakeClock()
+
+    def post(self, phone="+420777123456", ip="10.0.0.1", trip="iceland", **headers):
+        payload = {"trip": trip, "name": "Анна", "phone": phone, "preferred_contact": "tg"}
+        return self.client.post("/request/", payload, format="json", REMOTE_ADDR=ip, **headers)
+
+    def test_phone_limit(self):
+        for _ in range(3):
+            self.assertEqual(self.post().status_code, 201)
+
+        response = self.post(phone="+420 777-123-456")
+        self.assertEqual(response.status_code, 429)
+        self.assertIn("Слишком много запросов", response.json()["detail"])
+        self.assertEqual(int(response["Retry-After"]), 1200)
+        self.assertEqual(self.post(phone="+420777000000").status_code, 201)
+
+        # a token comes back every 20 minutes
+        self.clock.now += 1200
+        self.assertEqual(self.post().status_code, 201)
+        self.assertEqual(self.post().status_code, 429)
+
+    @override_settings(TRIP_REQUEST_RATES={"ip": "2/minute", "trip": "3/minute"})
+    def test_ip_and_trip_limits(self):
+        self.assertEqual(self.post(phone="+420777000001").status_code, 201)
+        self.assertEqual(self.post(phone="+420777000002").status_code, 201)
+        self.assertEqual(self.post(phone="+420777000003").status_code, 429)
+
+        self.assertEqual(self.post(phone="+420777000004", ip="10.0.0.2").status_code, 201)
+        # fourth submission for the same trip, from a fresh IP and phone
+        self.assertEqual(self.post(phone="+420777000005", ip="10.0.0.3").status_code, 429)
+
+    @override_settings(TRIP_REQUEST_RATES={"ip": "2/minute"})
+    def test_forwarded_for_is_not_trusted_without_proxies(self):
+        for ip in ("1.1.1.1", "2.2.2.2"):
+            self.assertEqual(self.post(phone=f"+42077700000{ip[0]}", HTTP_X_FORWARDED_FOR=ip).status_code, 201)
+        self.assertEqual(self.post(phone="+420777000003", HTTP_X_FORWARDED_FOR="3.3.3.3").status_code, 429)
+
+    def test_invalid_posts_dont_use_up_the_phone_budget(self):
+        for _ in range(3):
+            self.assertEqual(self.post(trip="missing").status_code, 400)
+        self.assertEqual(self.post().status_code, 201)
+
+    def test_only_submissions_are_limited(self):
+        for _ in range(5):
+            self.assertEqual(self.client.get("/request/").status_code, 200)
+
+    def test_no_count_query_on_submission(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.post()
+        self.assertFalse(any("COUNT" in query["sql"] for query in queries.captured_queries))
+
+
+class CacheRateLimitBackendTests(TestCase):
+    def setUp(self):
+        caches["default"].clear()
+        self.clock = FakeClock(now=3600 * 1000)
+        self.backend = CacheRateLimitBackend(clock=self.clock)
+
+    def test_sliding_window(self):
+        for _ in range(3):
+            self.assertEqual(self.backend.hit("phone", 3, 3600), (True, None))
+        allowed, wait = self.backend.hit("phone", 3, 3600)
+        self.assertFalse(allowed)
+        self.assertEqual(wait, 3600)
+
+        # a quarter into the next window 3 * 0.75 of the previous hits still count
+        self.clock.now += 3600 + 900
+        self.assertFalse(self.backend.hit("phone", 3, 3600)[0])
+        # a third in, 3 * 2/3 = 2 leave room for one
+        self.clock.now += 300
+        self.assertTrue(self.backend.hit("phone", 3, 3600)[0])
+        self.assertFalse(self.backend.hit("phone", 3, 3600)[0])
+
+    def test_exact_under_contention(self):
+        results = []
+        barrier = threading.Barrier(20)
+
+        def submit():
+            barrier.wait()
+            results.append(self.backend.hit("busy", 5, 60)[0])
+
+        threads = [threading.Thread(target=submit) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results.count(True), 5)
+
+
+@override_settings(SPAM_RULES_CHECK_INTERVAL=0, SPAM_BAYES_MIN_DOCS=2)
+class SpamScoringTests(TestCase):
+    def setUp(self):
+        caches["default"].clear()
+        self.trip = make_trip(slug="iceland")
+
+    def submit(self, notes="", phone="+420777123456", **data):
+        return TripRequest.objects.create(
+            trip=self.trip, name=data.pop("name", "Анна"), phone=phone, preferred_contact="tg", notes=notes, **data,
+        )
+
+    def test_legacy_keywords_are_rules(self):
+        self.assertEqual(
+            sorted(SpamRule.objects.values_list("pattern", flat=True)), ["http", "www", "куплю", "продам"],
+        )
+        spam = self.submit("Продам ГАРАЖ недорого")
+        self.assertTrue(spam.is_spam)
+        self.assertFalse(spam.notifications.exists())
+
+        ham = self.submit("Хотим поехать вдвоём в октябре", phone="+420777000001")
+        self.assertFalse(ham.is_spam)
+        self.assertEqual(ham.spam_score, 0)
+        self.assertTrue(ham.notifications.exists())
+
+    def test_rules_reload_without_restart(self):
+        self.assertFalse(self.submit(email="bot@spam.example").is_spam)
+        SpamRule.objects.create(pattern=r"@spam\.example$", kind="regex", field="email", weight=2)
+        self.assertTrue(self.submit(email="bot@spam.example", phone="+420777000001").is_spam)
+
+    def test_regex_rules_are_validated(self):
+        with self.assertRaises(ValidationError):
+            SpamRule(pattern="(unclosed", kind="regex").full_clean()
+        # Each rule is its own regex: flags, named groups and backreferences work
+        for pattern in (r"(?i)casino", r"(?P<x>a)", r"(\w)\1\1"):
+            SpamRule(pattern=pattern, kind="regex").full_clean()
+
+    def test_flags_and_backreferences_in_rules(self):
+        SpamRule.objects.create(pattern=r"(?i)casino", kind="regex", weight=2)
+        SpamRule.objects.create(pattern=r"(\w)\1{4}", kind="regex", field="name", weight=2)
+        self.assertTrue(self.submit("Best CASINO bonus").is_spam)
+        self.assertTrue(self.submit(name="ааааааа", phone="+420777000001").is_spam)
+
+    def test_broken_rule_is_skipped(self):
+        SpamRule.objects.create(pattern="(unclosed", kind="regex", weight=5)
+        with self.assertLogs("agency.spam", level="WARNING"):
+            spam = self.submit("Продам гараж")
+        self.assertTrue(spam.is_spam)
+        self.assertEqual(self.submit("Вопрос по туру", phone="+420777000001").spam_score, 0)
+
+    def test_overlapping_rules_all_count(self):
+        scorer = SpamScorer([("куплю", "keyword", "notes", 0.6), ("куплю дешево", "keyword", "notes", 0.6)])
+        result = scorer.score(notes="Куплю дешево")
+        self.assertEqual(result.score, 1.2)
+        self.assertEqual(result.reasons, ["rule:куплю", "rule:куплю дешево"])
+
+    def test_link_density_and_repeated_phone(self):
+        scorer = SpamScorer()
+        self.assertEqual(scorer.score(notes="Смотрите site.ru и shop.com").score, 2.0)
+        self.assertLess(
+            scorer.score(notes="Видели ваш тур на example.com, хотим такой же, но в мае, на семью из четырёх").score, 1,
+        )
+        self.assertEqual(scorer.score(phone_count=3).score, 0.5)
+
+        scores = [self.submit("Вопрос по туру").spam_score for _ in range(3)]
+        self.assertEqual(scores, [0, 0.25, 0.5])
+
+    def test_admin_marks_train_naive_bayes(self):
+        spam = [self.submit(f"Лучшие кредиты онлайн {i}", name="Кредит", phone=f"+42077700000{i}") for i in range(3)]
+        ham = [self.submit(f"Можно ли с ребёнком {i}", phone=f"+42077711111{i}") for i in range(3)]
+        learn(TripRequest.objects.filter(pk__in=[r.pk for r in spam]), is_spam=True)
+        learn(TripRequest.objects.filter(pk__in=[r.pk for r in ham]), is_spam=False)
+
+        self.assertEqual(SpamToken.objects.get(token="кредиты").spam_count, 3)
+        self.assertEqual(SpamToken.objects.get(token="ребенком").ham_count, 3)
+        self.assertTrue(self.submit("Кредиты онлайн", name="Кредит", phone="+420777222222").is_spam)
+        self.assertFalse(self.submit("Можно ли с ребёнком?", phone="+420777333333").is_spam)
+
+        # relabelling moves the counts instead of adding to them
+        learn(TripRequest.objects.filter(pk=spam[0].pk), is_spam=False)
+        token = SpamToken.objects.get(token="кредиты")
+        self.assertEqual((token.spam_count, token.ham_count), (2, 1))
+        # marking again with the same label changes nothing
+        learn(TripRequest.objects.filter(pk=spam[0].pk), is_spam=False)
+        self.assertEqual(SpamToken.objects.get(token="кредиты").ham_count, 1)
+
+
+class AdminChangelistQueryTests(TestCase):
+    """
+    Changelists of trip rows at 5k rows each: session and user, the
+    statistics lookup, COUNT and the page with its trips joined; no query
+    per row or per trip.
+    """
+    ROWS = 5000
+    CHANGELISTS = {
+        "tripphoto": 5,
+        # + the distinct day numbers of the day_number filter
+        "programbyday": 6,
+        "includedfeature": 5,
+        "tripdate": 5,
+        "faq": 5,
+        "triprequest": 5,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser("admin", "admin@example.com", "password")
+        trips = Trip.objects.bulk_create(
+            Trip(
+                title=f"Тур {i}", slug=f"trip-{i}", country="it", welcome_message="...", duration_days=7,
+                group_size=12, ask_title="Вопрос", description="...",
+            )
+            for i in range(50)
+        )
+        cls.trip = trips[0]
+        start = datetime.date.today() + datetime.timedelta(days=30)
+        rows = [(trips[i % len(trips)], i) for i in range(cls.ROWS)]
+        TripPhoto.objects.bulk_create(TripPhoto(trip=trip, photo=f"p/{i}.jpg", type="gallery") for trip, i in rows)
+        ProgramByDay.objects.bulk_create(
+            ProgramByDay(trip=trip, day_number=i, title=f"День {i}", description="...") for trip, i in rows
+        )
+        IncludedFeature.objects.bulk_create(
+            IncludedFeature(trip=trip, title=f"Пункт {i}", description="...") for trip, i in rows
+        )
+        TripDate.objects.bulk_create(
+            TripDate(
+                trip=trip, price=1000, start_date=start + datetime.timedelta(days=i),
+                end_date=start + datetime.timedelta(days=i + 7),
+            )
+            for trip, i in rows
+        )
+        FAQ.objects.bulk_create(FAQ(trip=trip, question=f"Вопрос {i}", answer="Ответ", order=i) for trip, i in rows)
+        TripRequest.objects.bulk_create(
+            TripRequest(trip=trip, name=f"Гость {i}", phone="+420777123456", preferred_contact="tg") for trip, i in rows
+        )
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def test_changelists_run_constant_queries(self):
+        for model_name, queries in self.CHANGELISTS.items():
+            url = reverse(f"admin:agency_{model_name}_changelist")
+            with self.subTest(model_name), self.assertNumQueries(queries):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertContains(response, "trip-autocomplete-filter")
+
+    def test_filter_by_trip_loads_only_that_trip(self):
+        url = reverse("admin:agency_faq_changelist")
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, {"trip__id__exact": self.trip.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["cl"].result_count, self.ROWS // 50)
+        self.assertContains(response, f'<option value="{self.trip.pk}" selected>{self.trip.title}</option>', html=True)
+        self.assertNotContains(response, "Тур 1<")
+
+    def test_unfiltered_count_is_estimated_from_statistics(self):
+        url = reverse("admin:agency_triprequest_changelist")
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        TripRequest.objects.filter(pk__in=self.trip.requests.values("pk")[:10]).delete()
+
+        with override_settings(ADMIN_ESTIMATED_COUNT_THRESHOLD=1000):
+            response = self.client.get(url)
+            self.assertEqual(response.context["cl"].result_count, self.ROWS)
+            response = self.client.get(url, {"trip__id__exact": self.trip.pk})
+            self.assertEqual(response.context["cl"].result_count, self.ROWS // 50 - 10)
+
+        # Under the threshold the table is counted exactly
+        response = self.client.get(url)
+        self.assertEqual(response.context["cl"].result_count, self.ROWS - 10)
+
+
+class SettingsProfileTests(TestCase):
+    """
+    The prod profile is read from the environment in a fresh interpreter,
+    the test run itself uses dev.
+    """
+
+    def load_prod(self, **environ):
+        script = (
+            "import json, django; django.setup(); from django.conf import settings; from django.urls import get_resolver; "
+            "print(json.dumps({'debug': settings.DEBUG, 'apps': settings.INSTALLED_APPS, "
+            "'middleware': settings.MIDDLEWARE, 'database': settings.DATABASES['default'], "
+            "'urls': [str(p.pattern) for p in get_resolver().url_patterns]}, default=str))"
+        )
+        environ = {
+            **os.environ, "DJANGO_SETTINGS_MODULE": "travel_agency.settings.prod", "DJANGO_SECRET_KEY": "secret",
+            "POSTGRES_DB": "fierytrips", "REDIS_URL": "redis://localhost:6379/0",
+            "TELEGRAM_BOT_TOKEN": "token", "TELEGRAM_CHAT_ID": "chat", **environ,
+        }
+        return subprocess.run(
+            [sys.executable, "-c", script], cwd=settings.BASE_DIR, env=environ, capture_output=True, text=True,
+        )
+
+    def test_prod_profile_drops_debug_tooling(self):
+        config = json.loads(self.load_prod(DB_ENGINE="sqlite", DB_CONN_MAX_AGE="300").stdout)
+        self.assertFalse(config["debug"])
+        self.assertNotIn("debug_toolbar", config["apps"])
+        self.assertFalse(any("debug_toolbar" in name for name in config["middleware"]))
+        self.assertNotIn("__debug__/", config["urls"])
+        # SQLite stand-in, connections are kept between requests
+        self.assertEqual(config["database"]["ENGINE"], "django.db.backends.sqlite3")
+        self.assertEqual(config["database"]["CONN_MAX_AGE"], 300)
+        self.assertTrue(config["database"]["CONN_HEALTH_CHECKS"])
+
+    def test_prod_profile_pools_postgres_connections(self):
+        result = self.load_prod(DB_POOL="psycopg", DB_POOL_MAX_SIZE="20")
+        if result.returncode and "Error loading psycopg" in result.stderr:
+            self.skipTest("psycopg isn't installed")
+        database = json.loads(result.stdout)["database"]
+        self.assertEqual(database["OPTIONS"]["pool"], {"min_size": 2, "max_size": 20})
+        # The pool owns connections, Django doesn't keep them
+        self.assertEqual(database["CONN_MAX_AGE"], 0)
+
+    def test_prod_profile_requires_secret_key(self):
+        result = self.load_prod(DJANGO_SECRET_KEY="", DB_ENGINE="sqlite")
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn("DJANGO_SECRET_KEY", result.stderr)
+
+    def test_prod_profile_requires_telegram_token(self):
+        result = self.load_prod(TELEGRAM_BOT_TOKEN="", DB_ENGINE="sqlite")
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn("ImproperlyConfigured", result.stderr)
+        self.assertIn("TELEGRAM_BOT_TOKEN", result.stderr)
+
+    def test_prod_profile_requires_shared_cache(self):
+        result = self.load_prod(REDIS_URL="", DB_ENGINE="sqlite")
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn("REDIS_URL", result.stderr)
+
+    def test_dev_profile_has_toolbar(self):
+        self.assertIn("debug_toolbar", settings.INSTALLED_APPS)
+        self.assertEqual(settings.MIDDLEWARE[1], "debug_toolbar.middleware.DebugToolbarMiddleware")
+
+
+class AsyncReadViewTests(TestCase):
+    """
+    The async views serve the same bytes as the sync DRF actions.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.enterClassContext(async_read_routes())
+
+    def setUp(self):
+        caches["default"].clear()
+        self.trips = [make_trip(slug=f"trip-{i}", country=country) for i, country in enumerate(["it", "is", "it"])]
+        TripPhoto.objects.create(trip=self.trips[0], photo="rome.jpg", type="gallery")
+        for i in range(3):
+            Review.objects.create(name=f"Клиент {i}", avatar="reviews/a.jpg", text="Отлично")
+
+    def sync_get(self, viewset, actions, url, **kwargs):
+        caches["default"].clear()
+        request = APIRequestFactory().get(url)
+        response = viewset.as_view(actions)(request, **kwargs)
+        if hasattr(response, "render"):
+            response.render()
+        caches["default"].clear()
+        return response.content
+
+    def test_routes_are_async(self):
+        for url in ("/trips/", f"/trips/{self.trips[0].pk}/", "/trips/countries/", "/reviews/"):
+            self.assertTrue(asyncio.iscoroutinefunction(resolve(url).func), url)
+        self.assertFalse(asyncio.iscoroutinefunction(resolve("/photos/").func))
+
+    async def test_payloads_match_sync_views(self):
+        trip_id = self.trips[0].pk
+        cases = [
+            ("/trips/?page_size=2", TripViewSet, {"get": "list"}, {}),
+            ("/trips/?fields=id,title", TripViewSet, {"get": "list"}, {}),
+            (f"/trips/{trip_id}/", TripViewSet, {"get": "retrieve"}, {"pk": str(trip_id)}),
+            ("/trips/countries/", TripViewSet, {"get": "list_countries"}, {}),
+            ("/reviews/?page_size=2", ReviewViewSet, {"get": "list"}, {}),
+        ]
+        for url, viewset, actions, kwargs in cases:
+            with self.subTest(url):
+                expected = await sync_to_async(self.sync_get)(viewset, actions, url, **kwargs)
+                response = await self.async_client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.content, expected)
+
+    async def test_cursor_pages(self):
+        names = []
+        url = "/reviews/?page_size=2"
+        while url:
+            page = (await self.async_client.get(url)).json()
+            names += [row["name"] for row in page["results"]]
+            url = page["next"]
+        self.assertEqual(names, ["Клиент 2", "Клиент 1", "Клиент 0"])
+
+    async def test_errors_and_fallbacks(self):
+        self.assertEqual((await self.async_client.get("/trips/0/")).status_code, 404)
+        self.assertEqual((await self.async_client.get("/reviews/?fields=password")).status_code, 400)
+        self.assertEqual((await self.async_client.get("/reviews/?cursor=broken")).status_code, 404)
+        # Served by the sync view
+        streamed = await self.async_client.get("/reviews/?stream=1")
+        self.assertTrue(streamed.streaming)
+        browsable = await self.async_client.get("/trips/", headers={"accept": "text/html"})
+        self.assertContains(browsable, "Trip List")
+        created = await self.async_client.post(
+            "/reviews/", {"name": "Анна", "text": "Спасибо", "avatar": make_image()},
+        )
+        self.assertEqual(created.status_code, 201)
+
+    async def test_authentication_permissions_and_throttles_run(self):
+        class Closed(BaseThrottle):
+            def allow_request(self, request, view):
+                return False
+
+        with mock.patch.object(ReviewViewSet, "permission_classes", [IsAuthenticated]):
+            self.assertEqual((await self.async_client.get("/reviews/")).status_code, 403)
+            user = await sync_to_async(User.objects.create_user)("manager")
+            await self.async_client.aforce_login(user)
+            self.assertEqual((await self.async_client.get("/reviews/")).status_code, 200)
+        with mock.patch.object(ReviewViewSet, "throttle_classes", [Closed]):
+            self.assertEqual((await self.async_client.get("/reviews/")).status_code, 429)
+
+
+@override_settings(CATALOGUE_SNAPSHOT=True)
+class CatalogueSnapshotTests(TestCase):
+    """
+    The snapshot serves the same bytes as the ORM path, sync and async.
+    """
+
+    def setUp(self):
+        caches["default"].clear()
+        snapshot.reset()
+        self.addCleanup(snapshot.reset)
+        self.trips = []
+        for i, (country, price) in enumerate([("it", 1500), ("is", 900), ("it", 1200)]):
+            trip = make_trip(slug=f"trip-{i}", country=country, dates=2, photos=2)
+            for trip_date in trip.trip_dates.all():
+                trip_date.price = price
+                trip_date.save()
+            self.trips.append(trip)
+        TripPhoto.objects.create(trip=self.trips[0], photo="rome.jpg", type="gallery")
+        TripDate.objects.filter(trip=self.trips[1]).update(current_members=12)
+        self.trips[1].refresh_current_members()
+        Trip.objects.filter(pk=self.trips[1].pk).update(**upcoming_summary())
+        caches["default"].clear()
+
+    def get(self, url, snapshot_on, **kwargs):
+        caches["default"].clear()
+        action = "retrieve" if kwargs else "list_countries" if url.startswith("/trips/countries/") else "list"
+        with override_settings(CATALOGUE_SNAPSHOT=snapshot_on):
+            response = TripViewSet.as_view({"get": action})(APIRequestFactory().get(url), **kwargs)
+            response.render()
+        return response
+
+    def test_payloads_match_the_orm(self):
+        trip_id = self.trips[0].pk
+        cases = [
+            ("/trips/", {}),
+            ("/trips/?page_size=2", {}),
+            ("/trips/?ordering=min_price", {}),
+            ("/trips/?ordering=-next_start_date&page_size=1", {}),
+            ("/trips/?price_max=1300&available=1", {}),
+            ("/trips/?fields=id,title", {}),
+            (f"/trips/{trip_id}/", {"pk": str(trip_id)}),
+            (f"/trips/{trip_id}/?fields=id,photos,faqs", {"pk": str(trip_id)}),
+        ]
+        for url, kwargs in cases:
+            with self.subTest(url):
+                expected = self.get(url, False, **kwargs)
+                self.assertEqual(expected.status_code, 200)
+                self.assertEqual(self.get(url, True, **kwargs).content, expected.content)
+                caches["default"].clear()
+                self.assertEqual(self.client.get(url).content, expected.content)
+
+    def test_cursor_pages_match_the_orm(self):
+        for ordering in ("-created_at", "min_price"):
+            pages = {}
+            for snapshot_on in (False, True):
+                url, ids = f"/trips/?page_size=1&ordering={ordering}", []
+                with override_settings(CATALOGUE_SNAPSHOT=snapshot_on):
+                    while url:
+                        caches["default"].clear()
+                        page = self.client.get(url).json()
+                        ids += [row["id"] for row in page["results"]]
+                        url = page["next"]
+                pages[snapshot_on] = ids
+            self.assertEqual(pages[True], pages[False])
+            self.assertEqual(len(pages[True]), 3)
+
+    def test_countries(self):
+        expected = json.loads(self.get("/trips/countries/", False).content)
+        self.assertEqual(self.client.get("/trips/countries/").json(), expected)
+
+    def test_cache_misses_run_no_queries(self):
+        self.client.get("/trips/")
+        with self.assertNumQueries(0):
+            self.assertEqual(len(self.client.get("/trips/?page_size=2").json()["results"]), 2)
+            self.client.get("/trips/countries/")
+
+    def test_edits_swap_the_snapshot(self):
+        self.client.get("/trips/")
+        old = snapshot.get_snapshot()
+        trip = self.trips[2]
+        trip.title = "Новое название"
+        trip.save()
+
+        self.assertEqual(self.client.get(f"/trips/{trip.pk}/").json()["title"], "Новое название")
+        self.assertIsNot(snapshot.get_snapshot(), old)
+        # the old snapshot is left as it was for requests still reading it
+        self.assertEqual(dict(zip(old.item_names, old.by_id[trip.pk].item))["title"], "Тур")
+
+        trip.delete()
+        self.assertEqual(self.client.get(f"/trips/{trip.pk}/").status_code, 404)
+        self.assertEqual(len(self.client.get("/trips/").json()["results"]), 2)
+
+    def test_records_are_read_only(self):
+        record = snapshot.get_snapshot().trips[0]
+        with self.assertRaises(AttributeError):
+            record.title = "Другое"
+        with self.assertRaises(AttributeError):
+            record.free_seats = 0
+
+    def test_errors_go_to_the_orm(self):
+        self.assertEqual(self.client.get("/trips/?fields=password").status_code, 400)
+        self.assertEqual(self.client.get("/trips/?cursor=broken").status_code, 404)
+        self.assertEqual(self.client.get("/trips/?price_min=abc").status_code, 400)
+        self.assertEqual(self.client.get("/trips/0/").status_code, 404)
+
+
+class CompiledSerializerTests(TestCase):
+    """
+    Compiled serializers render the same bytes as the DRF serializers.
+    """
+
+    def setUp(self):
+        variants = {
+            size: {"width": width, "jpeg": f"v/{size}.jpg", "webp": f"v/{size}.webp"}
+            for size, width in (("thumb", 100), ("card", 400), ("hero", 1200))
+        }
+        self.trips = [make_trip(country=country, dates=2, photos=2, days=2) for country in ("it", "is")]
+        TripPhoto.objects.filter(trip=self.trips[0]).update(variants=variants)
+        TripPhoto.objects.create(trip=self.trips[1], photo="", type="gallery")
+        Trip.objects.filter(pk=self.trips[0].pk).update(**upcoming_summary())
+        Review.objects.create(name="Анна", avatar="reviews/a.jpg", text="Отлично", variants=variants)
+        Review.objects.create(name="Иван", avatar="reviews/b.jpg", text="Хорошо")
+        TripRequest.objects.create(trip=self.trips[0], name="Анна", phone="+420777123456", preferred_contact="tg")
+        Sociallink.objects.create(name="Telegram", icon="tg", url="https://t.me/fierytrips")
+        self.request = Request(APIRequestFactory().get("/trips/"))
+
+    def assertRendersAlike(self, serializer_class, rows, projected_rows=None, fields=None, context=None):
+        expected = serializer_class(rows, many=True, context=context or {}).data
+        projection = compile_serializer(serializer_class, fields)
+        data = projection.many(rows if projected_rows is None else projected_rows, context)
+        if fields is not None:
+            expected = [{name: value for name, value in row.items() if name in fields} for row in expected]
+        self.assertEqual(JSONRenderer().render(data), JSONRenderer().render(expected))
+
+    def test_instances(self):
+        trips = list(Trip.objects.prefetch_related(
+            Prefetch("photos", TripPhoto.objects.filter(type="slide"), to_attr="slide_photos"),
+        ))
+        cases = [
+            (TripListSerializer, trips),
+            (TripRetrieveSerializer, list(Trip.objects.all())),
+            (TripPhotoSerializer, list(TripPhoto.objects.all())),
+            (ReviewSerializer, list(Review.objects.all())),
+            (CountrySerializer, list(CountryIndex.objects.all())),
+            (TripRequestSerializer, list(TripRequest.objects.select_related("trip"))),
+            (SocialLinkSerializer, list(Sociallink.objects.all())),
+        ]
+        for serializer_class, rows in cases:
+            for context in ({}, {"request": self.request}):
+                with self.subTest(serializer_class.__name__, request="request" in context):
+                    self.assertRendersAlike(serializer_class, rows, context=context)
+
+    def test_values_rows(self):
+        for serializer_class in (TripListSerializer, TripPhotoSerializer, ReviewSerializer):
+            model = serializer_class.Meta.model
+            with self.subTest(serializer_class.__name__):
+                self.assertRendersAlike(
+                    serializer_class, list(model.objects.order_by("pk")), list(model.objects.order_by("pk").values()),
+                    context={"request": self.request},
+                )
+
+    def test_requested_fields(self):
+        trips = list(Trip.objects.all())
+        self.assertRendersAlike(TripListSerializer, trips, fields={"title", "country", "price", "id"})
+        self.assertRendersAlike(TripRetrieveSerializer, trips, fields={"photos", "faqs", "formatted_start_date"})
+        with self.assertRaises(DRFValidationError):
+            compile_serializer(TripListSerializer, {"id", "nope"})
+
+    def test_views_match_drf_serializers(self):
+        trip_id = self.trips[0].pk
+        cases = [
+            (f"/trips/{trip_id}/", lambda request: TripRetrieveSerializer(
+                Trip.objects.get(pk=trip_id), context={"request": request}).data),
+            ("/photos/", lambda request: TripPhotoSerializer(
+                TripPhoto.objects.order_by("id"), many=True, context={"request": request}).data),
+            ("/reviews/", lambda request: ReviewSerializer(
+                Review.objects.order_by("-created_at", "-id"), many=True, context={"request": request}).data),
+        ]
+        for url, serialize in cases:
+            with self.subTest(url):
+                caches["default"].clear()
+                data = self.client.get(url, HTTP_ACCEPT="application/json").json()
+                expected = json.loads(JSONRenderer().render(serialize(Request(APIRequestFactory().get(url)))))
+                self.assertEqual(data.get("results", data), expected)
+
+
+class TripUpcomingSummaryTests(TestCase):
+    def setUp(self):
+        caches["default"].clear()
+        self.today = datetime.date.today()
+        self.trip = make_trip(slug="iceland", dates=0)
+
+    def add_date(self, days, price, **kwargs):
+        start = self.today + datetime.timedelta(days=days)
+        return TripDate.objects.create(
+            trip=self.trip, start_date=start, end_date=start + datetime.timedelta(days=7), price=price, **kwargs,
+        )
+
+    def summary(self):
+        self.trip.refresh_from_db()
+        return (
+            self.trip.next_start_date, self.trip.min_price, self.trip.max_price,
+            self.trip.has_special_offer, self.trip.free_seats,
+        )
+
+    def test_trip_without_dates(self):
+        row = self.client.get("/trips/").json()["results"][0]
+        self.assertEqual((row["formatted_start_date"], row["price"], row["next_start_date"]), (None, 0.0, None))
+        self.assertIsNone(self.client.get(f"/trips/{self.trip.pk}/").json()["formatted_end_date"])
+
+    def test_past_dates_are_left_out(self):
+        self.add_date(-10, 500, is_special_offer=True)
+        self.add_date(40, 1500)
+        later = self.add_date(20, 1200)
+        self.assertEqual(
+            self.summary(), (self.today + datetime.timedelta(days=20), 1200, 1500, False, 24),
+        )
+
+        later.reserve(5)
+        self.assertEqual(self.summary()[4], 19)
+        self.trip.group_size = 10
+        self.trip.save()
+        self.assertEqual(self.summary()[4], 15)
+        later.delete()
+        self.assertEqual(self.summary(), (self.today + datetime.timedelta(days=40), 1500, 1500, False, 10))
+
+    def test_daily_refresh_moves_past_expired_dates(self):
+        self.add_date(3, 900, is_special_offer=True)
+        self.add_date(30, 1100)
+        TripDate.objects.filter(price=900).update(start_date=self.today - datetime.timedelta(days=1))
+        # As stored five days ago, before the first date started
+        Trip.objects.filter(pk=self.trip.pk).update(**upcoming_summary(self.today - datetime.timedelta(days=5)))
+        make_trip(slug="current")
+
+        out = io.StringIO()
+        call_command("refresh_trip_summaries", stdout=out)
+        self.assertIn("1 trip(s) refreshed", out.getvalue())
+        self.assertEqual(self.summary(), (self.today + datetime.timedelta(days=30), 1100, 1100, False, 12))
+
+    def test_list_filters_and_orders_on_summary(self):
+        self.add_date(30, 2000)
+        other = make_trip(slug="italy", dates=0)
+        start = self.today + datetime.timedelta(days=10)
+        TripDate.objects.create(
+            trip=other, start_date=start, end_date=start + datetime.timedelta(days=7), price=800, is_special_offer=True,
+        )
+        make_trip(slug="no-dates", dates=0)
+
+        def ids(**params):
+            with CaptureQueriesContext(connection) as queries:
+                rows = self.client.get("/trips/", params).json()["results"]
+            self.assertNotIn("agency_tripdate", " ".join(query["sql"] for query in queries.captured_queries))
+            return [row["id"] for row in rows]
+
+        self.assertEqual(ids(ordering="min_price"), [other.pk, self.trip.pk])
+        self.assertEqual(ids(ordering="-next_start_date"), [self.trip.pk, other.pk])
+        self.assertEqual(ids(price_max=1000), [other.pk])
+        self.assertEqual(ids(special_offer="true"), [other.pk])
+        self.assertEqual(ids(departure_from=start + datetime.timedelta(days=1)), [self.trip.pk])
+        self.assertEqual(self.client.get("/trips/", {"price_min": "дорого"}).status_code, 400)
+
+        # The cursor is positioned on the ordering column
+        page = self.client.get("/trips/", {"ordering": "min_price", "page_size": 1, "fields": "id"}).json()
+        self.assertEqual(self.client.get(page["next"]).json()["results"], [{"id": self.trip.pk}])
+
+
+class MetricsTests(TestCase):
+    """
+    Requests are recorded under their viewset action and exposed on /metrics.
+    """
+
+    def setUp(self):
+        caches["default"].clear()
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        self.trip = make_trip(dates=2, photos=2)
+
+    @async_read_routes()
+    def test_requests_are_recorded_per_action(self):
+        self.assertEqual(self.client.get("/trips/").status_code, 200)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get("/photos/")
+        photo_queries = len(queries)
+        self.client.get(f"/trips/{self.trip.pk}/")
+        self.client.get("/trips/countries/")
+        self.client.get("/trips/countries/it/")
+        payload = {"trip": self.trip.slug, "name": "Анна", "phone": "+420777123456", "preferred_contact": "tg"}
+        self.client.post("/request/", payload, content_type="application/json")
+
+        durations = metrics.REQUEST_DURATION.snapshot()
+        self.assertEqual(
+            {labels for labels in durations},
+            {
+                ("TripViewSet.list", "GET", "200"), ("TripViewSet.retrieve", "GET", "200"),
+                ("TripViewSet.list_countries", "GET", "200"), ("TripViewSet.country_trips", "GET", "200"),
+                ("TripRequestListCreateViewSet.create", "POST", "201"), ("TripPhotoViewSet.list", "GET", "200"),
+            },
+        )
+        self.assertEqual(metrics.REQUEST_QUERIES.snapshot()[("TripPhotoViewSet.list", )][-1], photo_queries)
+        # Queries of the async views run in other threads, and are counted too
+        self.assertGreater(metrics.REQUEST_QUERIES.snapshot()[("TripViewSet.list", )][-1], 0)
+        self.assertGreater(metrics.QUERY_DURATION.snapshot()[("TripViewSet.list", )], 0)
+        self.assertEqual(sum(metrics.SERIALIZER_DURATION.snapshot()[("TripViewSet.list", )][:-1]), 1)
+        self.assertGreater(metrics.RESPONSE_BYTES.snapshot()[("TripViewSet.retrieve", )][-1], 0)
+
+    def test_exposition(self):
+        self.client.get("/trips/")
+        self.client.get("/trips/")
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], metrics.CONTENT_TYPE)
+        text = response.content.decode()
+        self.assertIn("# TYPE agency_request_duration_seconds histogram", text)
+        self.assertIn(
+            'agency_request_duration_seconds_bucket{view="TripViewSet.list",method="GET",status="200",le="+Inf"} 2',
+            text,
+        )
+        self.assertIn('agency_request_duration_seconds_count{view="TripViewSet.list",method="GET",status="200"} 2', text)
+        self.assertIn('agency_response_cache_requests_total{result="hits"} 1', text)
+        # Scrapes aren't recorded
+        self.assertNotIn("metrics", {labels[0] for labels in metrics.REQUEST_DURATION.snapshot()})
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_token(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 403)
+        self.assertEqual(self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer secret").status_code, 200)
+
+    @override_settings(METRICS_TOKEN=None, METRICS_PUBLIC=False)
+    def test_hidden_without_token(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 404)
+
+    def test_processes_are_added_up_in_metrics_dir(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            self.client.get("/trips/")
+            # Another worker's samples
+            other = {"agency_request_duration_seconds": [[["TripViewSet.list", "GET", "200"], [1] + [0] * 11 + [0.5]]]}
+            with open(os.path.join(directory, "1.json"), "w") as file:
+                json.dump(other, file)
+            text = self.client.get("/metrics").content.decode()
+        self.assertIn('agency_request_duration_seconds_count{view="TripViewSet.list",method="GET",status="200"} 2', text)
+
+    def test_telegram_calls_are_timed(self):
+        class Transport:
+            def send(self, text):
+                if "fail" in text:
+                    raise ConnectionError(text)
+
+        trip_request = TripRequest.objects.create(
+            trip=self.trip, name="Анна", phone="+420777123456", preferred_contact="tg",
+        )
+        NotificationOutbox.objects.filter(trip_request=trip_request).delete()
+        for text in ("ok", "fail"):
+            NotificationOutbox.objects.create(trip_request=trip_request, text=text, next_attempt_at=timezone.now())
+        with self.assertLogs("agency.notifications", "WARNING") as logs:
+            process_batch(Transport(), batch_size=10, workers=2)
+        self.assertIn("failed: fail", logs.output[0])
+        samples = metrics.TELEGRAM_DURATION.snapshot()
+        self.assertEqual(sum(samples[("ok", )][:-1]), 1)
+        self.assertEqual(sum(samples[("error", )][:-1]), 1)
+
+
+class SlowQueryLogTests(TestCase):
+    """
+    Slow SELECTs are logged with their plan and callers, the report groups
+    them and compares their columns with the declared indexes.
+    """
+
+    def setUp(self):
+        caches["default"].clear()
+        make_trip()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.log = os.path.join(directory.name, "slow.log")
+
+    def read(self):
+        return list(slow_queries.read_log(self.log))
+
+    def test_slow_selects_are_logged_with_plan_and_callers(self):
+        with override_settings(SLOW_QUERY_LOG=self.log, SLOW_QUERY_THRESHOLD_MS=0):
+            self.assertEqual(self.client.get("/photos/").status_code, 200)
+        entries = self.read()
+        photos = [entry for entry in entries if 'FROM "agency_tripphoto"' in entry["sql"]]
+        self.assertTrue(photos)
+        self.assertEqual(photos[0]["view"], "TripPhotoViewSet.list")
+        self.assertTrue(photos[0]["plan"])
+        self.assertNotIn("%s", photos[0]["fingerprint"])
+        # EXPLAIN ran in a savepoint of the test transaction, which still works
+        self.assertEqual(Trip.objects.count(), 1)
+
+    def test_params_are_left_out(self):
+        payload = {"trip": Trip.objects.get().slug, "name": "Анна", "phone": "+420777123456", "preferred_contact": "tg"}
+        with override_settings(SLOW_QUERY_LOG=self.log, SLOW_QUERY_THRESHOLD_MS=0):
+            self.assertEqual(self.client.post("/request/", payload, content_type="application/json").status_code, 201)
+        entries = self.read()
+        self.assertTrue(any(entry["sql"].startswith("INSERT") for entry in entries))
+        self.assertEqual({entry["params"] for entry in entries}, {None})
+
+        with override_settings(SLOW_QUERY_LOG=self.log, SLOW_QUERY_THRESHOLD_MS=0, SLOW_QUERY_LOG_PARAMS=True):
+            self.client.post("/request/", {**payload, "phone": "+420777654321"}, content_type="application/json")
+        logged = [entry for entry in self.read()[len(entries):] if entry["params"] is not None]
+        self.assertTrue(logged)
+        self.assertTrue(all(slow_queries.is_select(entry["sql"]) for entry in logged))
+
+    def test_threshold_and_sampling(self):
+        with override_settings(SLOW_QUERY_LOG=self.log, SLOW_QUERY_THRESHOLD_MS=10_000):
+            self.client.get("/photos/")
+        with override_settings(SLOW_QUERY_LOG=self.log, SLOW_QUERY_THRESHOLD_MS=0, SLOW_QUERY_SAMPLE_RATE=0):
+            self.client.get("/photos/")
+        self.assertEqual(self.read(), [])
+
+    def test_fingerprint(self):
+        self.assertEqual(
+            slow_queries.fingerprint(
+                'SELECT "t"."id" FROM "agency_trip2" t WHERE "t"."country" = \'it\' AND "t"."id" IN (%s, %s,  %s)\n'
+                'LIMIT 21'
+            ),
+            'SELECT "t"."id" FROM "agency_trip2" t WHERE "t"."country" = ? AND "t"."id" IN (...) LIMIT ?',
+        )
+
+    def test_report_suggests_missing_indexes(self):
+        def entry(sql, ms, plan=()):
+            return {"fingerprint": slow_queries.fingerprint(sql), "sql": sql, "ms": ms, "plan": list(plan),
+                    "view": "TripViewSet.list", "origin": "agency/views.py:1 list"}
+
+        entries = [
+            entry('SELECT * FROM "agency_triprequest" WHERE "agency_triprequest"."email" = %s '
+                  'ORDER BY "agency_triprequest"."created_at" DESC', 300),
+            entry('SELECT * FROM "agency_triprequest" WHERE "agency_triprequest"."email" = %s '
+                  'ORDER BY "agency_triprequest"."created_at" DESC', 500, ["SCAN agency_triprequest"]),
+            # Covered by Meta.indexes and the foreign key
+            entry('SELECT * FROM "agency_trip" WHERE "agency_trip"."country" = %s', 250),
+            entry('SELECT * FROM "agency_tripdate" WHERE "agency_tripdate"."trip_id" = %s '
+                  'ORDER BY "agency_tripdate"."start_date"', 250),
+            entry('SELECT * FROM "agency_tripphoto" ORDER BY RANDOM() LIMIT 1', 400),
+        ]
+        with open(self.log, "w") as file:
+            file.writelines(json.dumps(item) + "\n" for item in entries)
+            file.write('{"cut off')
+
+        summaries = slow_queries.group(self.read())
+        self.assertEqual([summary["count"] for summary in summaries], [2, 1, 1, 1])
+        hints, suggestions = slow_queries.advise(summaries[0])
+        self.assertIn("full scan of agency_triprequest", hints)
+        self.assertEqual([(model, fields) for model, fields, _ in suggestions], [(TripRequest, ["email", "created_at"])])
+        for summary in summaries[1:]:
+            self.assertEqual(slow_queries.advise(summary)[1], [])
+
+        out = io.StringIO()
+        call_command("slow_query_report", log=self.log, stdout=out)
+        report = out.getvalue()
+        self.assertIn("agency.TripRequest.Meta.indexes: models.Index(fields=['email', 'created_at'])", report)
+        self.assertIn("order_by('?')", report)
+        self.assertNotIn("agency.Trip.Meta", report)
+
+
+class RendererTests(TestCase):
+    """
+    orjson renders the bytes of DRF's JSONRenderer, MessagePack its values.
+    """
+
+    def setUp(self):
+        caches["default"].clear()
+        self.trip = make_trip(dates=2, photos=2)
+        Trip.objects.filter(pk=self.trip.pk).update(**upcoming_summary())
+        Review.objects.create(name="Анна", avatar="reviews/a.jpg", text="Отлично")
+
+    def test_orjson_renders_the_same_bytes(self):
+        data = {
+            "price": decimal.Decimal("1250.50"),
+            "created_at": datetime.datetime(2025, 5, 1, 12, 30, 1, 250, tzinfo=datetime.timezone.utc),
+            "naive": datetime.datetime(2025, 5, 1, 12, 30),
+            "offset": datetime.datetime(2025, 5, 1, 12, 30, tzinfo=datetime.timezone(datetime.timedelta(hours=2))),
+            "date": datetime.date(2025, 5, 1),
+            "lazy": gettext_lazy("Страна"),
+            "separators": "a\u2028b\u2029c",
+            "tuple": (1, 2.5, None, True),
+            "set": {"only"},
+            "text": "Исландия — \"ледник\"",
+            1: "int key",
+        }
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(
+            ORJSONRenderer().render(data, "application/json; indent=2"),
+            JSONRenderer().render(data, "application/json; indent=2"),
+        )
+
+    def test_endpoints_render_the_same_bytes(self):
+        for url in ("/trips/", f"/trips/{self.trip.pk}/", "/trips/calendar/", "/reviews/", "/trips/countries/"):
+            with self.subTest(url):
+                caches["default"].clear()
+                response = self.client.get(url, HTTP_ACCEPT="application/json")
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.content, JSONRenderer().render(response.data))
+
+    def test_invalid_json_is_a_parse_error(self):
+        response = self.client.post("/request/", b'{"trip": ', content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("JSON parse error", response.json()["detail"])
+
+    def test_msgpack_carries_the_json_values(self):
+        if msgpack is None:
+            self.skipTest("msgpack isn't installed")
+        for url in ("/trips/", f"/trips/{self.trip.pk}/", "/trips/calendar/", "/reviews/"):
+            with self.subTest(url):
+                caches["default"].clear()
+                expected = self.client.get(url, HTTP_ACCEPT="application/json").json()
+                caches["default"].clear()
+                response = self.client.get(url, HTTP_ACCEPT="application/msgpack")
+                self.assertEqual(response["Content-Type"], "application/msgpack")
+                self.assertEqual(msgpack.unpackb(response.content), expected)
+
+        payload = {"trip": self.trip.slug, "name": "Анна", "phone": "+420777123456", "preferred_contact": "tg"}
+        response = self.client.post(
+            "/request/", msgpack.packb(payload), content_type="application/msgpack", HTTP_ACCEPT="application/msgpack",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(msgpack.unpackb(response.content)["name"], "Анна")
+
+
+class DepartureCalendarTests(TestCase):
+    def setUp(self):
+        caches["default"].clear()
+        self.today = datetime.date.today()
+        self.italy = make_trip(slug="italy", country="it", dates=0)
+        self.iceland = make_trip(slug="iceland", country="is", dates=0)
+        self.june = datetime.date(self.today.year + 1, 6, 1)
+        self.dates = {
+            "italy-early": self.add_date(self.italy, self.june, 1400),
+            "iceland-early": self.add_date(self.iceland, self.june + datetime.timedelta(days=4), 2100),
+            "italy-full": self.add_date(self.italy, self.june + datetime.timedelta(days=10), 900, current_members=10),
+            "italy-july": self.add_date(self.italy, self.june + datetime.timedelta(days=35), 1200),
+        }
+
+    def add_date(self, trip, start, price, **kwargs):
+        return TripDate.objects.create(
+            trip=trip, start_date=start, end_date=start + datetime.timedelta(days=7), price=price, **kwargs,
+        )
+
+    def calendar(self, **params):
+        response = self.client.get("/trips/calendar/", params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def ids(self, data):
+        return [
+            departure["id"]
+            for month in data["months"] for country in month["countries"] for departure in country["departures"]
+        ]
+
+    def test_groups_by_month_and_country(self):
+        data = self.calendar(date_from=self.june, date_to=self.june + datetime.timedelta(days=60))
+        self.assertEqual([month["month"] for month in data["months"]], [f"{self.june.year}-06", f"{self.june.year}-07"])
+        june = data["months"][0]["countries"]
+        self.assertEqual([(country["country"], country["country_name"]) for country in june], [("is", "Исландия"), ("it", "Италия")])
+        self.assertEqual(june[1]["departures"][0], {
+            "id": self.dates["italy-early"].pk,
+            "trip": self.italy.pk,
+            "slug": "italy",
+            "title": "Тур",
+            "start_date": self.june.isoformat(),
+            "end_date": (self.june + datetime.timedelta(days=7)).isoformat(),
+            "price": 1400.0,
+            "free_seats": 12,
+            "is_special_offer": False,
+        })
+
+    def test_range_seats_and_price(self):
+        june_15 = self.june + datetime.timedelta(days=14)
+        self.assertEqual(
+            self.ids(self.calendar(date_from=self.june, date_to=june_15, seats=4, price_max=1500)),
+            [self.dates["italy-early"].pk],
+        )
+        self.assertEqual(
+            self.ids(self.calendar(date_from=self.june, date_to=june_15)),
+            [self.dates["iceland-early"].pk, self.dates["italy-early"].pk, self.dates["italy-full"].pk],
+        )
+        self.assertEqual(
+            self.ids(self.calendar(date_from=self.june, date_to=june_15, country="is,no")),
+            [self.dates["iceland-early"].pk],
+        )
+        self.assertEqual(
+            self.ids(self.calendar(date_from=self.june, return_by=self.june + datetime.timedelta(days=11))),
+            [self.dates["iceland-early"].pk, self.dates["italy-early"].pk],
+        )
+
+    def test_past_dates_are_left_out(self):
+        past = self.today - datetime.timedelta(days=3)
+        TripDate.objects.create(trip=self.italy, start_date=past, end_date=self.today, price=500)
+        data = self.calendar(date_from=past - datetime.timedelta(days=10))
+        self.assertEqual(data["date_from"], self.today.isoformat())
+        self.assertEqual(len(self.ids(data)), 4)
+
+    def test_rejects_bad_windows(self):
+        for params in (
+            {"date_from": self.june, "date_to": self.june - datetime.timedelta(days=1)},
+            {"date_from": self.june, "date_to": self.june + datetime.timedelta(days=400)},
+            {"seats": 0},
+        ):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get("/trips/calendar/", params).status_code, 400)
+
+    def test_one_indexed_query_and_cached(self):
+        params = {"date_from": self.june, "date_to": self.june + datetime.timedelta(days=14), "seats": 4}
+        # Last-Modified, then the departures
+        with self.assertNumQueries(2):
+            self.calendar(**params)
+        with self.assertNumQueries(0):
+            self.calendar(**params)
+
+        self.add_date(self.iceland, self.june + datetime.timedelta(days=2), 1000)
+        self.assertEqual(len(self.ids(self.calendar(**params))), 3)
+
+        plan = find_departures(self.june, self.june + datetime.timedelta(days=14), seats=4).explain()
+        self.assertIn("agency_trip_start_d_f171c1_idx", plan)
+
+
+@override_settings(CDN_PURGE_BACKEND="agency.cdn.MemoryPurgeBackend")
+class HttpCacheHeaderTests(TestCase):
+    def setUp(self):
+        caches["default"].clear()
+        self.trip = make_trip(slug="iceland")
+        self.other = make_trip(slug="italy")
+        # An hour ago, so changes in the test are seconds later
+        self.hour_ago = timezone.now().replace(microsecond=0) - datetime.timedelta(hours=1)
+        Trip.objects.update(updated_at=self.hour_ago)
+        caches["default"].clear()
+        get_purge_backend().reset()
+
+    def get(self, url, **headers):
+        return self.client.get(url, headers=headers)
+
+    def test_catalogue_headers(self):
+        response = self.get("/trips/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            set(response["Cache-Control"].split(", ")),
+            {"public", "max-age=60", "s-maxage=600", "stale-while-revalidate=60"},
+        )
+        # Session authentication reads the cookie
+        self.assertEqual(response["Vary"], "Accept, Cookie")
+        self.assertEqual(response["Surrogate-Key"], "trips")
+        self.assertEqual(response["Last-Modified"], http_date(self.hour_ago.timestamp()))
+        self.assertTrue(response["ETag"])
+
+        detail = self.get(f"/trips/{self.trip.pk}/")
+        self.assertEqual(detail["Surrogate-Key"], f"trip-{self.trip.pk}")
+        self.assertEqual(self.get("/reviews/")["Cache-Control"], "public, max-age=60, s-maxage=300")
+        self.assertFalse(self.get("/request/").has_header("Cache-Control"))
+
+    def test_if_modified_since_answers_304_without_serializing(self):
+        last_modified = self.get("/trips/")["Last-Modified"]
+        with self.assertNumQueries(0):
+            response = self.get("/trips/?page_size=5", if_modified_since=last_modified)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["Last-Modified"], last_modified)
+        self.assertEqual(response["Surrogate-Key"], "trips")
+
+        # If-None-Match wins over If-Modified-Since
+        response = self.get("/trips/", if_modified_since=last_modified, if_none_match='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_child_edits_and_deletions_move_last_modified(self):
+        since = http_date(self.hour_ago.timestamp())
+        self.assertEqual(self.get(f"/trips/{self.trip.pk}/", if_modified_since=since).status_code, 304)
+
+        FAQ.objects.filter(trip=self.trip).delete()
+        self.assertEqual(self.get(f"/trips/{self.trip.pk}/", if_modified_since=since).status_code, 200)
+        self.assertEqual(self.get(f"/trips/{self.other.pk}/", if_modified_since=since).status_code, 304)
+        self.assertEqual(self.get("/trips/", if_modified_since=since).status_code, 200)
+
+        # Deleting the newest trip doesn't take the list back to the older one
+        Trip.objects.filter(pk=self.trip.pk).update(updated_at=self.hour_ago + datetime.timedelta(minutes=10))
+        caches["default"].clear()
+        last_modified = self.get("/trips/")["Last-Modified"]
+        self.trip.delete()
+        response = self.get("/trips/", if_modified_since=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(parse_http_date(response["Last-Modified"]), parse_http_date(last_modified))
+
+    def test_bookings_move_last_modified(self):
+        since = http_date(self.hour_ago.timestamp())
+        self.trip.trip_dates.get().reserve(2)
+        self.assertEqual(self.get("/trips/calendar/", if_modified_since=since).status_code, 200)
+
+    async def test_async_view_answers_304(self):
+        response = await self.async_client.get(f"/trips/{self.trip.pk}/")
+        self.assertEqual(response["Surrogate-Key"], f"trip-{self.trip.pk}")
+        response = await self.async_client.get(
+            f"/trips/{self.trip.pk}/", headers={"if-modified-since": response["Last-Modified"]},
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_edits_purge_the_cdn_once_per_transaction(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.trip.title = "Исландия"
+                self.trip.save()
+                TripDate.objects.create(
+                    trip=self.trip, start_date=datetime.date.today() + datetime.timedelta(days=90),
+                    end_date=datetime.date.today() + datetime.timedelta(days=97), price=1500,
+                )
+        self.assertTrue(wait_for_purges(5))
+        # Keys of rollbacks earlier in the thread may ride along
+        [keys] = get_purge_backend().purged
+        self.assertLessEqual({f"trip-{self.trip.pk}", "trips"}, set(keys))
+
+    def test_slow_cdn_doesnt_hold_up_the_edit(self):
+        release = threading.Event()
+
+        class Slow:
+            purged = []
+
+            def purge(self, keys):
+                release.wait(5)
+                self.purged.append(sorted(keys))
+
+        with mock.patch("agency.cdn.get_backend", return_value=Slow()):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.trip.save()
+            self.assertFalse(wait_for_purges(0.1))
+            with self.captureOnCommitCallbacks(execute=True):
+                self.other.save()
+            release.set()
+            self.assertTrue(wait_for_purges(5))
+        # Queued while the first purge was in flight, sent right after it
+        self.assertEqual(len(Slow.purged), 2)
+        self.assertIn(f"trip-{self.other.pk}", Slow.purged[1])
+
+    def test_admin_purge_action_and_failures(self):
+        User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.login(username="admin", password="password")
+        self.client.post(reverse("admin:agency_trip_changelist"), {
+            "action": "purge_cdn", "_selected_action": [self.trip.pk, self.other.pk],
+        })
+        self.assertEqual(get_purge_backend().purged, [sorted([f"trip-{self.trip.pk}", f"trip-{self.other.pk}", "trips"])])
+
+        class Failing:
+            def purge(self, keys):
+                raise ConnectionError("CDN is down")
+
+        with mock.patch("agency.cdn.get_backend", return_value=Failing()), self.assertLogs("agency.cdn", "ERROR"):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.trip.save()
+            wait_for_purges(5)
+        self.assertEqual(self.get(f"/trips/{self.trip.pk}/").status_code, 200)
@@ -0,0 +1,68 @@
+import re
+
+from django.conf import settings
+from rest_framework.throttling import BaseThrottle
+
+from .ratelimit import get_backend, parse_rate
+
+
+DEFAULT_RATES = {
+    'phone': '3/hour',
+    'ip': '20/hour',
+    'trip': '100/hour',
+}
+
+
+class TripRequestRateThrottle(BaseThrottle):
+    """
+    Limits trip request submissions per `scope` key through the
+    rate-limit backend, rates come from TRIP_REQUEST_RATES.
+    """
+    scope = None
+
+    def __init__(self):
+        self.retry_after = None
+
+    def get_rate(self):
+        rates = {**DEFAULT_RATES, **getattr(settings, 'TRIP_REQUEST_RATES', {})}
+        return rates.get(self.scope)
+
+    def get_key(self, request):
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        rate = self.get_rate()
+        key = self.get_key(request)
+        if not rate or not key:
+            return True
+
+        limit, window = parse_rate(rate)
+        allowed, self.retry_after = get_backend().hit(f"trip-request:{self.scope}:{key}", limit, window)
+        return allowed
+
+    def wait(self):
+        return self.retry_after
+
+
+class PhoneRateThrottle(TripRequestRateThrottle):
+    scope = 'phone'
+
+    def get_key(self, request):
+        phone = request.data.get('phone')
+        # +420 777-123-456 and +420777123456 are the same person
+        return re.sub(r'\D', '', phone) if isinstance(phone, str) else None
+
+
+class IPRateThrottle(TripRequestRateThrottle):
+    scope = 'ip'
+
+    def get_key(self, request):
+        return self.get_ident(request)
+
+
+class TripRateThrottle(TripRequestRateThrottle):
+    scope = 'trip'
+
+    def get_key(self, request):
+        trip = request.data.get('trip')
+        return trip if isinstance(trip, str) else None
@@ -1,8 +1,9 @@
-from django.urls import path, include
+from django.urls import URLPattern, path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from rest_framework import routers
 
+from .metrics import metrics_view
 from .views import (
     TripViewSet,
     TripPhotoViewSet,
@@ -16,8 +17,23 @@ router.register("request", TripRequestListCreateViewSet)
 router.register("reviews", ReviewViewSet)
 router.register("social-links", SocialLinkViewSet)
 
+
+def with_async_reads(pattern):
+    """
+    Routes a viewset URL to its async view when its GET action is served async.
+    """
+    view = pattern.callback
+    viewset = getattr(view, "cls", None)
+    if not getattr(settings, "ASYNC_READ_VIEWS", True) or not hasattr(viewset, "as_async_view"):
+        return pattern
+    if view.actions.get("get") not in viewset.async_actions:
+        return pattern
+    return URLPattern(pattern.pattern, viewset.as_async_view(view), pattern.default_args, pattern.name)
+
+
 urlpatterns = [
-    path("", include(router.urls)),
+    path("", include([with_async_reads(pattern) for pattern in router.urls])),
+    path("metrics", metrics_view, name="metrics"),
 ]
 
 app_name = "agency"
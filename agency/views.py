@@ -1,18 +1,233 @@
-from django.db.models import Prefetch, Count
-from django.db.models import OuterRef, Subquery
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.db.models import Prefetch
+from django.http import Http404
 
 from rest_framework import mixins, viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import APIException, Throttled
 from rest_framework.response import Response
 
-from .models import Trip, TripPhoto, TripRequest, TripDate, ProgramByDay, FAQ, IncludedFeature, Review, Sociallink
+from .cache import CATALOGUE_VERSION_KEY, CachedResponseMixin
+from .departures import find_departures, group_departures
+from .filters import TripOrderingFilter, TripSummaryFilter
+from .http_cache import HttpCacheMixin, HttpCachePolicy, TripCachePolicy
+from .models import (
+    Trip, TripPhoto, TripRequest, TripDate, ProgramByDay, FAQ, IncludedFeature, Review, Sociallink, CountryIndex
+)
+from .metrics import serializer_timer
+from .pagination import CreatedAtCursorPagination, IdCursorPagination, SearchPagination
+from .projections import can_compile, compile_serializer
+from .renderers import StreamingJSONRenderer
+from .search import SearchFilters, get_index
+from .snapshot import SnapshotReadMixin, aget_snapshot, get_snapshot
 from .serializers import TripRetrieveSerializer, TripListSerializer, TripPhotoSerializer, TripRequestSerializer, \
-    CountrySerializer, ReviewSerializer, SocialLinkSerializer
+    CountrySerializer, ReviewSerializer, SocialLinkSerializer, TripSearchQuerySerializer, CalendarQuerySerializer, \
+    get_requested_fields
+from .throttles import PhoneRateThrottle, IPRateThrottle, TripRateThrottle
 
 
-class TripViewSet(viewsets.ModelViewSet):
+class SparseFieldsetViewMixin:
+    """
+    `.only()`-loads the columns behind the fields asked for with `?fields=`,
+    and serializes what it read with the compiled serializer.
+    """
+
+    def get_projection(self):
+        """
+        The function of one row, see agency/projections.py. The serializer's
+        `to_representation` for serializers that can't be compiled.
+        """
+        serializer_class = self.get_serializer_class()
+        if not can_compile(serializer_class):
+            return self.get_serializer().to_representation
+        projection = compile_serializer(serializer_class, get_requested_fields(self.request))
+        return projection.bind(self.get_serializer_context())
+
+    def serialize(self, instance, many=False):
+        with serializer_timer():
+            project = self.get_projection()
+            return [project(obj) for obj in instance] if many else project(instance)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        requested = get_requested_fields(self.request)
+        if requested is None:
+            return queryset
+
+        columns = self.get_serializer_class().get_model_columns(requested)
+        # The cursor is built from the ordering columns of the last row
+        if self.paginator is not None:
+            columns.update(field.lstrip('-') for field in self.paginator.get_ordering(self.request, queryset, self))
+
+        # A relation can't be both deferred and traversed with select_related
+        related = queryset.query.select_related
+        if isinstance(related, dict):
+            keep = [name for name in related if any(column.startswith(f"{name}__") for column in columns)]
+            queryset = queryset.select_related(None)
+            if keep:
+                queryset = queryset.select_related(*keep)
+
+        return queryset.only(*columns)
+
+    def get_list_response(self, queryset):
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.serialize(page, many=True))
+
+        return Response(self.serialize(queryset, many=True))
+
+    async def aget_list_response(self, queryset):
+        if self.paginator is not None:
+            page = await self.paginator.apaginate_queryset(queryset, self.request, view=self)
+            if page is not None:
+                return self.get_paginated_response(self.serialize(page, many=True))
+
+        return Response(self.serialize([obj async for obj in queryset], many=True))
+
+    def retrieve(self, request, *args, **kwargs):
+        return Response(self.serialize(self.get_object()))
+
+
+class AsyncReadMixin:
+    """
+    Serves the GET actions named in `async_actions` from native async views
+    under ASGI: rows are read with the async ORM, then serialized and
+    rendered exactly as the sync action does.
+
+    Only public reads take this path. Other methods, the browsable API and
+    `?stream=1` are handed to the sync DRF view.
+    """
+    async_actions = ()
+
+    @classmethod
+    def as_async_view(cls, view):
+        """
+        Wraps a router view of this viewset.
+        """
+        async def async_view(request, *args, **kwargs):
+            if request.method == 'GET' and 'format' not in kwargs:
+                response = await cls(**view.initkwargs).adispatch(view.actions, request, *args, **kwargs)
+                if response is not None:
+                    return response
+            return await sync_to_async(view)(request, *args, **kwargs)
+
+        async_view.cls = cls
+        async_view.initkwargs = view.initkwargs
+        async_view.actions = view.actions
+        async_view.csrf_exempt = True
+        return async_view
+
+    async def adispatch(self, actions, request, *args, **kwargs):
+        """
+        The response of the async action, None to fall back to the sync view.
+        """
+        self.action_map = actions
+        self.args, self.kwargs = args, kwargs
+        self.headers = self.default_response_headers
+        self.format_kwarg = None
+        self.request = request = self.initialize_request(request, *args, **kwargs)
+        if self.action not in self.async_actions:
+            return None
+
+        try:
+            renderer, media_type = self.perform_content_negotiation(request)
+        except APIException:
+            return None
+        if renderer.format == 'api':
+            return None
+        request.accepted_renderer, request.accepted_media_type = renderer, media_type
+
+        try:
+            await self.ainitial(request)
+            response = await getattr(self, f"a{self.action}")(request, *args, **kwargs)
+            if response is None:
+                return None
+        except (APIException, Http404) as exc:
+            response = self.handle_exception(exc)
+
+        response = self.finalize_response(request, response, *args, **kwargs)
+        if isinstance(response, Response):
+            response.render()
+        return response
+
+    async def ainitial(self, request):
+        """
+        The checks `initial()` runs before a sync action.
+        """
+        # Authenticators, permissions and throttles are sync code that may
+        # query the session or the cache, one trip to a worker thread
+        def checks():
+            self.perform_authentication(request)
+            self.check_permissions(request)
+            self.check_throttles(request)
+
+        await sync_to_async(checks)()
+
+    async def alist(self, request, *args, **kwargs):
+        return await self.aget_list_response(self.filter_queryset(self.get_queryset()))
+
+    async def aretrieve(self, request, *args, **kwargs):
+        return Response(self.serialize(await self.aget_object()))
+
+    async def aget_object(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            obj = await queryset.aget(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        except (ObjectDoesNotExist, TypeError, ValueError, ValidationError):
+            raise Http404
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+
+class StreamingListMixin:
+    """
+    `?stream=1` returns every row of a list in one streamed response.
+
+    Rows are read with `.iterator()` and rendered one at a time, so memory
+    stays flat however long the list is. The body keeps the paginated
+    shape with `next` and `previous` set to null.
+    """
+    stream_param = 'stream'
+    stream_chunk_size = 500
+
+    def list(self, request, *args, **kwargs):
+        return self.get_list_response(self.filter_queryset(self.get_queryset()))
+
+    def get_list_response(self, queryset):
+        if self.request.query_params.get(self.stream_param) not in ('1', 'true'):
+            return super().get_list_response(queryset)
+
+        streamer = StreamingJSONRenderer.for_request(self.request, self.get_renderer_context())
+        # The browsable API and indented JSON take the regular path
+        if streamer is None:
+            return super().get_list_response(queryset)
+
+        if self.paginator is not None:
+            queryset = queryset.order_by(*self.paginator.ordering)
+        project = self.get_projection()
+        rows = (project(obj) for obj in queryset.iterator(chunk_size=self.stream_chunk_size))
+        envelope = {'next': None, 'previous': None} if self.paginator is not None else None
+        return streamer.response(rows, envelope)
+
+    async def aget_list_response(self, queryset):
+        # Streams are read with the sync .iterator()
+        if self.request.query_params.get(self.stream_param) in ('1', 'true'):
+            return None
+        return await super().aget_list_response(queryset)
+
+
+class TripViewSet(
+    HttpCacheMixin, CachedResponseMixin, SnapshotReadMixin, AsyncReadMixin, SparseFieldsetViewMixin, viewsets.ModelViewSet,
+):
     queryset = Trip.objects.all()
     serializer_class = TripListSerializer
+    pagination_class = CreatedAtCursorPagination
+    cache_policy = TripCachePolicy()
+    async_actions = ('list', 'retrieve', 'list_countries')
+    filter_backends = [TripSummaryFilter, TripOrderingFilter]
+    ordering_fields = ['created_at', 'next_start_date', 'min_price']
 
     def get_serializer_class(self):
         # Use TripRetrieveSerializer for the retrieve action
@@ -21,29 +236,32 @@ class TripViewSet(viewsets.ModelViewSet):
         return TripListSerializer
 
     def get_queryset(self):
-        queryset = self.queryset
-        prefetch_fields = [
-            Prefetch(
-                "photos",
-                queryset=TripPhoto.objects.filter(type="slide"),
-                to_attr="slide_photos",
-            ),
-            Prefetch(
-                "trip_dates",
-                queryset=TripDate.objects.all(),
-                to_attr="trip_dates_list",
-            ),
-
-        ]
+        queryset = super().get_queryset()
+        # Writes re-read relations after save, prefetching for them is wasted
+        if self.action in ['create', 'update', 'partial_update', 'destroy']:
+            return queryset
 
+        # Prefetch under the default names, so the nested `photos` / `trip_dates`
+        # fields read the cached rows; lists only need the stored summary of dates
+        prefetch_fields = []
 
         # Add additional prefetch fields for the retrieve action
         if self.action == "retrieve":
             prefetch_fields.extend([
+                Prefetch("trip_dates", queryset=TripDate.objects.all()),
+                Prefetch("photos", TripPhoto.objects.all(),),
                 Prefetch("program_by_days", ProgramByDay.objects.all(),),
                 Prefetch("included_features", IncludedFeature.objects.all(),),
                 Prefetch("faqs", FAQ.objects.all(),),
             ])
+        else:
+            prefetch_fields.append(
+                Prefetch(
+                    "photos",
+                    queryset=TripPhoto.objects.filter(type="slide"),
+                    to_attr="slide_photos",
+                ),
+            )
 
         return queryset.prefetch_related(*prefetch_fields)
 
@@ -54,82 +272,160 @@ class TripViewSet(viewsets.ModelViewSet):
         """
         queryset = self.get_queryset()
 
-        trips = queryset.filter(country=country_code)
+        trips = list(queryset.filter(country=country_code))
 
         # Handle case where no trips are found
-        if not trips.exists():
+        if not trips:
             return Response({"error": "No trips found for this country"}, status=404)
 
         # Serialize and return trips
-        serializer = TripListSerializer(trips, many=True)
-        return Response(serializer.data)
+        with serializer_timer():
+            return Response(compile_serializer(TripListSerializer).many(trips))
 
     @action(detail=False, methods=['GET'], url_path='countries')
     def list_countries(self, request):
         """
         Returns a list of all unique countries with a random gallery photo.
         """
-        # Subquery to fetch a random gallery photo for each country
-        random_photo_subquery = TripPhoto.objects.filter(
-            trip__country=OuterRef('country'),
-            type='gallery'
-        ).order_by('?').values('photo')[:1]
+        snapshot = get_snapshot()
+        if snapshot is not None:
+            return Response(snapshot.country_list())
 
-        # Get all unique country codes with a random photo
-        countries = Trip.objects.values('country').annotate(
-            photo=Subquery(random_photo_subquery)
-        ).distinct()
+        # Served from the per-country index, the database picks the photo from its pool
+        countries = CountryIndex.with_random_photo()
 
         # Serialize the data
         serializer = CountrySerializer(countries, many=True)
         return Response(serializer.data)
 
+    async def alist_countries(self, request):
+        snapshot = await aget_snapshot()
+        if snapshot is not None:
+            return Response(snapshot.country_list())
+
+        countries = [country async for country in CountryIndex.with_random_photo()]
+        serializer = CountrySerializer(countries, many=True)
+        return Response(serializer.data)
 
-class TripRequestListCreateViewSet(viewsets.GenericViewSet, mixins.ListModelMixin, mixins.CreateModelMixin):
-    queryset = TripRequest.objects.all().select_related() # Join with trip model slug field
+    @action(detail=False, methods=['GET'], url_path='calendar')
+    def calendar(self, request):
+        """
+        Upcoming departures in a date window grouped by month and country.
+        """
+        return self.get_cached_response(request, CATALOGUE_VERSION_KEY, lambda: self.build_calendar(request))
+
+    def build_calendar(self, request):
+        params = CalendarQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        filters = dict(params.validated_data)
+        if 'country' in filters:
+            filters['countries'] = filters.pop('country')
+
+        months = group_departures(find_departures(**filters))
+        return Response({
+            'date_from': filters['date_from'],
+            'date_to': filters['date_to'],
+            'months': months,
+        })
+
+    @action(detail=False, methods=['GET'], url_path='search')
+    def search(self, request):
+        """
+        Full-text search over trips with country, duration, price and month facets.
+        """
+        params = TripSearchQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        filters = dict(params.validated_data)
+        query = filters.pop('q')
+        if 'country' in filters:
+            filters['countries'] = filters.pop('country')
+
+        ids, facets = get_index().search(query, SearchFilters(**filters))
+
+        paginator = SearchPagination()
+        page = paginator.paginate_queryset(ids, request, view=self)
+        trips = self.get_queryset().in_bulk(page)
+        with serializer_timer():
+            data = compile_serializer(TripListSerializer).many(
+                [trips[trip_id] for trip_id in page if trip_id in trips], self.get_serializer_context(),
+            )
+        response = paginator.get_paginated_response(data)
+        response.data['facets'] = facets
+        return response
+
+
+class TripRequestListCreateViewSet(StreamingListMixin, SparseFieldsetViewMixin, viewsets.GenericViewSet, mixins.ListModelMixin,
+                                   mixins.CreateModelMixin):
+    queryset = TripRequest.objects.all().select_related('trip') # Join with trip model slug field
     serializer_class = TripRequestSerializer
+    pagination_class = CreatedAtCursorPagination
 
-    def perform_create(self, serializer):
-        trip_slug = self.request.data.get("trip")
-        trip = Trip.objects.get(slug=trip_slug)
-        serializer.save(trip=trip)
+    def get_throttles(self):
+        # Every submission counts against its client IP...
+        if self.action == 'create':
+            return [IPRateThrottle()]
+        return super().get_throttles()
+
+    def get_submission_throttles(self):
+        # ...a valid one against its phone and trip as well, so invalid or
+        # rejected posts don't use up a real customer's budget
+        return [PhoneRateThrottle(), TripRateThrottle()]
+
+    def check_throttles(self, request, throttles=None):
+        # Stop at the first limit reached, a rejected submission doesn't use up the other keys
+        for throttle in self.get_throttles() if throttles is None else throttles:
+            if not throttle.allow_request(request, self):
+                self.throttled(request, throttle.wait())
+
+    def throttled(self, request, wait):
+        raise Throttled(wait, detail="Слишком много запросов. Попробуйте позже.")
 
     def create(self, request, *args, **kwargs):
         trip_slug = self.request.data.get("trip")
         if not trip_slug:
             return Response({"error": "Trip slug is required"}, status=status.HTTP_400_BAD_REQUEST)
 
-        return super().create(request, *args, **kwargs)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.check_throttles(request, self.get_submission_throttles())
+        self.perform_create(serializer)
+        headers = self.get_success_headers(serializer.data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
 
-class TripPhotoViewSet(viewsets.ModelViewSet):
+class TripPhotoViewSet(StreamingListMixin, SparseFieldsetViewMixin, viewsets.ModelViewSet):
     queryset = TripPhoto.objects.all()
     serializer_class = TripPhotoSerializer
+    pagination_class = IdCursorPagination
 
     @action(detail=False, methods=['GET'], url_path="main-photos")
     def main_photos(self, request):
-        main_photos = TripPhoto.objects.all().filter(type="main") # Grouping by trip_id
-        serializer = self.get_serializer(main_photos, many=True)
-        return Response(serializer.data)
+        main_photos = self.get_queryset().filter(type="main") # Grouping by trip_id
+        return self.get_list_response(main_photos)
 
     @action(detail=False, methods=['GET'], url_path="gallery-photos")
     def gallery_photos(self, request):
-        gallery_photos = TripPhoto.objects.all().filter(type="gallery")
-        serializer = self.get_serializer(gallery_photos, many=True)
-        return Response(serializer.data)
+        gallery_photos = self.get_queryset().filter(type="gallery")
+        return self.get_list_response(gallery_photos)
 
     @action(detail=False, methods=['GET'], url_path="slide-photos")
     def slide_photos(self, request):
-        slide_photos = TripPhoto.objects.all().filter(type="slide")
-        serializer = self.get_serializer(slide_photos, many=True)
-        return Response(serializer.data)
+        slide_photos = self.get_queryset().filter(type="slide")
+        return self.get_list_response(slide_photos)
 
 
-class ReviewViewSet(viewsets.GenericViewSet, mixins.ListModelMixin, mixins.CreateModelMixin):
+class ReviewViewSet(HttpCacheMixin, AsyncReadMixin, StreamingListMixin, SparseFieldsetViewMixin, viewsets.GenericViewSet,
+                    mixins.ListModelMixin, mixins.CreateModelMixin):
     queryset = Review.objects.all()
     serializer_class = ReviewSerializer
+    pagination_class = CreatedAtCursorPagination
+    async_actions = ('list', )
+    # Not purged on edits, kept by the CDN for a short while only
+    cache_policy = HttpCachePolicy(public=True, max_age=60, s_maxage=300)
 
 
-class SocialLinkViewSet(viewsets.GenericViewSet, mixins.ListModelMixin):
+class SocialLinkViewSet(HttpCacheMixin, StreamingListMixin, SparseFieldsetViewMixin, viewsets.GenericViewSet,
+                        mixins.ListModelMixin):
     queryset = Sociallink.objects.all()
     serializer_class = SocialLinkSerializer
+    cache_policy = HttpCachePolicy(public=True, max_age=60, s_maxage=300)
@@ -0,0 +1,7 @@
+"""
+Benchmarks for the agency API.
+
+Each module runs against a throwaway test database:
+
+    python -m benchmarks.countries
+"""
@@ -0,0 +1,141 @@
+"""
+Per-serializer and per-action costs of the API on a generated catalogue:
+latency percentiles, queries and allocations of one call.
+
+Serializers run over rows that are already loaded, so only rendering to
+Python data is timed. Actions go through the whole Django stack in
+process, "cold" with the response cache cleared before every call,
+"warm" served from it.
+
+    python -m benchmarks.api --trips 500 --json before.json
+    python -m benchmarks.compare before.json after.json
+"""
+import argparse
+from dataclasses import asdict
+
+from .common import count_queries, measure, measure_allocations, report, setup, test_database, write_json
+from .dataset import Shape, populate
+
+
+ACTIONS = {
+    # name: (method, url), {trip_id} and {country} are filled in
+    "trips.list": ("GET", "/trips/"),
+    "trips.retrieve": ("GET", "/trips/{trip_id}/"),
+    "trips.countries": ("GET", "/trips/countries/"),
+    "trips.country_trips": ("GET", "/trips/countries/{country}/"),
+    "trips.calendar": ("GET", "/trips/calendar/"),
+    "trips.search": ("GET", "/trips/search/?q=ледник"),
+    "photos.list": ("GET", "/photos/"),
+    "reviews.list": ("GET", "/reviews/"),
+    "social-links.list": ("GET", "/social-links/"),
+    "request.create": ("POST", "/request/"),
+}
+
+
+def profile(func, repeat):
+    """
+    Latency stats in ms, then queries and allocations of one more call.
+    """
+    return {**measure(func, repeat), "queries": count_queries(func), **measure_allocations(func)}
+
+
+def serializer_benchmarks(page_size):
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory
+
+    from agency.models import CountryIndex, Review, TripPhoto
+    from agency.serializers import (
+        CountrySerializer, ReviewSerializer, TripListSerializer, TripPhotoSerializer, TripRetrieveSerializer,
+    )
+    from agency.views import TripViewSet
+
+    request = Request(APIRequestFactory().get("/trips/"))
+    context = {"request": request}
+
+    def rows(action):
+        view = TripViewSet(action=action, request=request, kwargs={}, format_kwarg=None)
+        return list(view.get_queryset().order_by("-created_at")[:page_size if action == "list" else 1])
+
+    trips, (trip,) = rows("list"), rows("retrieve")
+    photos = list(TripPhoto.objects.all()[:100])
+    reviews = list(Review.objects.all()[:page_size])
+    countries = list(CountryIndex.objects.all())
+
+    return {
+        f"TripListSerializer x{len(trips)}": lambda: TripListSerializer(trips, many=True, context=context).data,
+        "TripRetrieveSerializer": lambda: TripRetrieveSerializer(trip, context=context).data,
+        f"TripPhotoSerializer x{len(photos)}": lambda: TripPhotoSerializer(photos, many=True, context=context).data,
+        f"ReviewSerializer x{len(reviews)}": lambda: ReviewSerializer(reviews, many=True, context=context).data,
+        f"CountrySerializer x{len(countries)}": lambda: CountrySerializer(countries, many=True).data,
+    }
+
+
+def action_benchmarks(cold):
+    from django.core.cache import caches
+    from rest_framework.test import APIClient
+
+    from agency.models import Trip
+
+    client = APIClient(HTTP_ACCEPT="application/json")
+    trip = Trip.objects.order_by("pk").values("pk", "slug", "country").first()
+    payload = {"trip": trip["slug"], "name": "Анна", "phone": "+420777123456", "preferred_contact": "tg"}
+
+    def call(method, url):
+        def run():
+            if cold:
+                caches["default"].clear()
+            if method == "POST":
+                response = client.post(url, payload, format="json")
+            else:
+                response = client.get(url)
+            assert response.status_code in (200, 201), (url, response.status_code)
+            return response
+        return run
+
+    return {
+        name: call(method, url.format(trip_id=trip["pk"], country=trip["country"]))
+        for name, (method, url) in ACTIONS.items()
+        # Writes aren't cached
+        if cold or method == "GET"
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    for name, value in asdict(Shape()).items():
+        parser.add_argument(f"--{name}", type=int, default=value)
+    parser.add_argument("--page-size", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--only", help="Comma separated names of serializers or actions to run")
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    setup()
+    from django.test import override_settings
+
+    only = set(args.only.split(",")) if args.only else None
+    shape = Shape(**{name: getattr(args, name) for name in asdict(Shape())})
+
+    # Repeated submissions mustn't be rate limited
+    with test_database(), override_settings(TRIP_REQUEST_RATES={"phone": None, "ip": None, "trip": None}):
+        populate(shape)
+        results = {}
+        groups = (
+            ("serializers", lambda: serializer_benchmarks(args.page_size)),
+            ("cold", lambda: action_benchmarks(cold=True)),
+            ("warm", lambda: action_benchmarks(cold=False)),
+        )
+        for group, benchmarks in groups:
+            results[group] = {
+                name: profile(func, args.repeat)
+                for name, func in benchmarks().items()
+                if only is None or name in only
+            }
+            report(f"{group}: latency ms, queries, allocations of one call", results[group])
+
+    if args.json:
+        write_json(args.json, "api", {**asdict(shape), "page_size": args.page_size, "repeat": args.repeat}, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+Throughput of the catalogue read endpoints under WSGI and ASGI at 200
+concurrent connections.
+
+WSGI serves the sync DRF views from a thread per connection, ASGI serves
+the native async views from one event loop, "asgi-sync" the sync views
+through Django's sync adapter as before. All drive Django's own handlers
+in-process, so the numbers leave out the HTTP server. Each runs in its
+own interpreter with the prod profile, on SQLite unless --postgres and
+with the Redis of REDIS_URL (127.0.0.1:6379 by default).
+
+    python -m benchmarks.asgi --connections 200 --requests 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+from .common import ROOT, prod_environ, setup, test_database
+from .profiles import populate
+
+
+SERVERS = ("wsgi", "asgi", "asgi-sync")
+ENDPOINTS = ("/trips/", "/trips/{trip_id}/", "/trips/countries/", "/reviews/")
+
+
+def summarize(latencies, elapsed):
+    latencies.sort()
+    return {
+        "req/s": len(latencies) / elapsed,
+        "median": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95) - 1],
+        "p99": latencies[int(len(latencies) * 0.99) - 1],
+    }
+
+
+def run_wsgi(url, connections, requests):
+    from django.core.wsgi import get_wsgi_application
+    from django.test import RequestFactory
+
+    application = get_wsgi_application()
+    factory = RequestFactory(HTTP_ACCEPT="application/json")
+    latencies = []
+    start_barrier = threading.Barrier(connections + 1)
+
+    def start_response(status, headers):
+        assert status == "200 OK", status
+
+    def connection():
+        timings = []
+        start_barrier.wait()
+        for _ in range(requests):
+            start = time.perf_counter()
+            response = application(factory.get(url).environ, start_response)
+            b"".join(response)
+            response.close()
+            timings.append((time.perf_counter() - start) * 1000)
+        latencies.extend(timings)
+
+    threads = [threading.Thread(target=connection) for _ in range(connections)]
+    for thread in threads:
+        thread.start()
+    start_barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def run_asgi(url, connections, requests):
+    from django.core.asgi import get_asgi_application
+
+    application = get_asgi_application()
+    path, _, query = url.partition("?")
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": query.encode(),
+        "headers": [(b"host", b"testserver"), (b"accept", b"application/json")],
+        "client": ("127.0.0.1", 50000), "server": ("testserver", 80),
+    }
+
+    async def request():
+        disconnected = asyncio.Event()
+        body_sent = False
+        status = None
+
+        async def receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            # Django listens for a disconnect until the response is sent
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+
+        await application(dict(scope), receive, send)
+        disconnected.set()
+        assert status == 200, status
+
+    async def connection(latencies):
+        for _ in range(requests):
+            start = time.perf_counter()
+            await request()
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    async def main():
+        await request()  # warm up
+        latencies = []
+        start = time.perf_counter()
+        await asyncio.gather(*(connection(latencies) for _ in range(connections)))
+        return summarize(latencies, time.perf_counter() - start)
+
+    return asyncio.run(main())
+
+
+def serve(server, connections, requests):
+    setup()
+    with test_database():
+        populate()
+        from agency.models import CountryIndex, Trip
+
+        CountryIndex.rebuild()
+        trip_id = Trip.objects.values_list("id", flat=True).first()
+        run = run_wsgi if server == "wsgi" else run_asgi
+        return {
+            url.format(trip_id=trip_id): run(url.format(trip_id=trip_id), connections, requests)
+            for url in ENDPOINTS
+        }
+
+
+def child(server, args):
+    env = {
+        **os.environ,
+        **prod_environ(),
+        "DJANGO_SETTINGS_MODULE": "travel_agency.settings.prod",
+        "DJANGO_ALLOWED_HOSTS": "",
+        # As wsgi.py and asgi.py set it up
+        "DJANGO_ASYNC_READ_VIEWS": "1" if server == "asgi" else "0",
+    }
+    if not args.postgres:
+        env["DB_ENGINE"] = "sqlite"
+    command = [
+        sys.executable, "-m", "benchmarks.asgi", "--child", server,
+        "--connections", str(args.connections), "--requests", str(args.requests),
+    ]
+    output = subprocess.run(command, cwd=ROOT, env=env, check=True, stdout=subprocess.PIPE, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--connections", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=20, help="per connection and endpoint")
+    parser.add_argument("--postgres", action="store_true")
+    parser.add_argument("--child", choices=SERVERS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(serve(args.child, args.connections, args.requests)))
+        return
+
+    print(f"{args.connections} connections x {args.requests} requests, latency in ms")
+    for server in SERVERS:
+        print(server)
+        for url, stats in child(server, args).items():
+            values = "  ".join(f"{key} {value:8.1f}" for key, value in stats.items())
+            print(f"  {url:<20} {values}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import os
+import statistics
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import django
+
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def setup():
+    sys.path.insert(0, str(ROOT))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "travel_agency.settings.dev")
+    django.setup()
+
+
+def prod_environ():
+    """
+    Variables the prod profile requires: the cache is the Redis of REDIS_URL,
+    a local one unless set; Telegram isn't called, placeholders do.
+    """
+    return {
+        "DJANGO_SECRET_KEY": os.environ.get("DJANGO_SECRET_KEY", "benchmark-" * 6),
+        "REDIS_URL": os.environ.get("REDIS_URL", "redis://127.0.0.1:6379/0"),
+        "TELEGRAM_BOT_TOKEN": os.environ.get("TELEGRAM_BOT_TOKEN", "benchmark"),
+        "TELEGRAM_CHAT_ID": os.environ.get("TELEGRAM_CHAT_ID", "benchmark"),
+    }
+
+
+@contextmanager
+def test_database():
+    """
+    Creates the test database for the duration of a benchmark.
+    """
+    from django.test.utils import setup_test_environment, teardown_test_environment
+    from django.test.runner import DiscoverRunner
+
+    setup_test_environment()
+    runner = DiscoverRunner(verbosity=0, interactive=False)
+    old_config = runner.setup_databases()
+    try:
+        yield
+    finally:
+        runner.teardown_databases(old_config)
+        teardown_test_environment()
+
+
+def measure(func, repeat=50, warmup=3):
+    """
+    Runs `func` and returns latency stats in milliseconds.
+    """
+    for _ in range(warmup):
+        func()
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    timings.sort()
+    return {
+        "min": timings[0],
+        "median": statistics.median(timings),
+        "p95": timings[int(len(timings) * 0.95) - 1],
+        "max": timings[-1],
+    }
+
+
+def report(title, results):
+    print(title)
+    width = max([12, *map(len, results)])
+    for name, stats in results.items():
+        values = "  ".join(f"{key} {value:8.3f}" for key, value in stats.items())
+        print(f"  {name:<{width}} {values}")
+
+
+def count_queries(func):
+    """
+    Number of queries one call of `func` runs.
+    """
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    with CaptureQueriesContext(connection) as queries:
+        func()
+    return len(queries)
+
+
+def measure_allocations(func):
+    """
+    Memory allocated by one call of `func`: blocks and KiB still held by
+    its allocations when it returns, and the peak KiB along the way.
+    """
+    import gc
+    import tracemalloc
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        result = func()
+        peak = tracemalloc.get_traced_memory()[1]
+        # Reference cycles it left behind aren't held
+        gc.collect()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    del result
+
+    grown = [stat for stat in after.compare_to(before, "filename") if stat.size_diff > 0]
+    return {
+        "blocks": sum(stat.count_diff for stat in grown),
+        "KiB": sum(stat.size_diff for stat in grown) / 1024,
+        "peak KiB": peak / 1024,
+    }
+
+
+def environment():
+    """
+    What a result was measured on, saved with it so runs can be compared.
+    """
+    import platform
+    import subprocess
+
+    from django.conf import settings
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    result = {
+        "commit": commit,
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+    # HTTP load tests don't set Django up here
+    if settings.configured:
+        from django.db import connection
+
+        result.update(database=connection.vendor, settings=settings.SETTINGS_MODULE)
+    return result
+
+
+def write_json(path, benchmark, params, results):
+    """
+    Saves results for `python -m benchmarks.compare`.
+    """
+    import json
+
+    with open(path, "w") as file:
+        json.dump(
+            {"benchmark": benchmark, "params": params, "environment": environment(), "results": results},
+            file, indent=2, ensure_ascii=False, default=str,
+        )
+    print(f"Results written to {path}")
@@ -0,0 +1,86 @@
+"""
+Compares two JSON results of the same benchmark, e.g. before and after a
+change to a viewset or serializer:
+
+    python -m benchmarks.compare before.json after.json --threshold 10
+
+Latencies (median, p95, p99) and allocations that grew by more than the
+threshold percent, and any added queries, are regressions; the exit
+status is 1 when there are some.
+"""
+import argparse
+import json
+import sys
+
+
+# Metrics where lower is better, checked for regressions
+LATENCY = ("median", "p95", "p99", "avg")
+COUNTS = ("queries", "errors")
+MEMORY = ("blocks", "KiB", "peak KiB")
+
+
+def flatten(results, prefix=""):
+    """
+    {'cold': {'trips.list': {'median': 1.0}}} -> {('cold/trips.list', 'median'): 1.0}
+    """
+    rows = {}
+    for name, value in results.items():
+        if isinstance(value, dict) and all(not isinstance(item, dict) for item in value.values()):
+            for metric, number in value.items():
+                rows[(f"{prefix}{name}", metric)] = number
+        elif isinstance(value, dict):
+            rows.update(flatten(value, f"{prefix}{name}/"))
+    return rows
+
+
+def compare(before, after, threshold):
+    """
+    Yields (benchmark, metric, before, after, change %, regression).
+    """
+    old, new = flatten(before["results"]), flatten(after["results"])
+    for key in sorted(old.keys() & new.keys()):
+        (name, metric), a, b = key, old[key], new[key]
+        if not isinstance(a, (int, float)) or not isinstance(b, (int, float)):
+            continue
+        change = (b - a) / a * 100 if a else (0.0 if b == a else float("inf"))
+        if metric in COUNTS:
+            regression = b > a
+        elif metric in LATENCY or metric in MEMORY:
+            regression = change > threshold
+        else:
+            # Throughput and the like, informational
+            regression = False
+        yield name, metric, a, b, change, regression
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Percent a latency may grow, 10")
+    parser.add_argument("--all", action="store_true", help="Show every metric, not only regressions and queries")
+    args = parser.parse_args()
+
+    with open(args.before) as file:
+        before = json.load(file)
+    with open(args.after) as file:
+        after = json.load(file)
+    if before["benchmark"] != after["benchmark"]:
+        parser.error(f"{args.before} is {before['benchmark']}, {args.after} is {after['benchmark']}")
+    if before["params"] != after["params"]:
+        print(f"Warning: different parameters\n  {before['params']}\n  {after['params']}")
+
+    print(f"{before['benchmark']}: {before['environment'].get('commit')} -> {after['environment'].get('commit')}")
+    regressions = 0
+    for name, metric, a, b, change, regression in compare(before, after, args.threshold):
+        regressions += regression
+        if args.all or regression or metric in LATENCY[:1] + COUNTS:
+            mark = "  REGRESSION" if regression else ""
+            print(f"  {name:<40} {metric:<9} {a:10.3f} -> {b:10.3f}  {change:+7.1f}%{mark}")
+
+    print(f"{regressions} regression(s)")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
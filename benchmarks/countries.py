@@ -0,0 +1,72 @@
+"""
+/trips/countries/: ORDER BY RANDOM() subquery vs the CountryIndex table.
+
+    python -m benchmarks.countries --photos 10000
+"""
+import argparse
+
+from .common import measure, report, setup, test_database
+
+
+def legacy_countries():
+    # The query list_countries ran before the country index
+    from django.db.models import OuterRef, Subquery
+    from agency.models import Trip, TripPhoto
+
+    random_photo_subquery = TripPhoto.objects.filter(
+        trip__country=OuterRef('country'),
+        type='gallery'
+    ).order_by('?').values('photo')[:1]
+    return list(Trip.objects.values('country').annotate(photo=Subquery(random_photo_subquery)).distinct())
+
+
+def indexed_countries():
+    # What list_countries serves: the photo pool stays in the database, which picks one
+    from agency.models import CountryIndex
+
+    return list(CountryIndex.with_random_photo().values_list('country', 'picked_photo'))
+
+
+def populate(photos, trips):
+    from agency.models import CountryIndex, Trip, TripPhoto
+
+    countries = [code for code, _ in Trip.COUNTRY_CHOICES]
+    Trip.objects.bulk_create(
+        Trip(
+            title=f"Trip {i}", slug=f"trip-{i}", country=countries[i % len(countries)],
+            welcome_message="-", duration_days=7, group_size=12, ask_title="-", description="-",
+        )
+        for i in range(trips)
+    )
+    trip_ids = list(Trip.objects.values_list("id", flat=True))
+    TripPhoto.objects.bulk_create(
+        (
+            TripPhoto(trip_id=trip_ids[i % len(trip_ids)], photo=f"gallery/{i}.jpg", type="gallery")
+            for i in range(photos)
+        ),
+        batch_size=1000,
+    )
+    CountryIndex.rebuild()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--photos", type=int, default=10000)
+    parser.add_argument("--trips", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    setup()
+    with test_database():
+        populate(args.photos, args.trips)
+        report(
+            f"/trips/countries/ query, {args.photos} gallery photos, {args.trips} trips (ms)",
+            {
+                "legacy": measure(legacy_countries, args.repeat),
+                "index": measure(indexed_countries, args.repeat),
+            },
+        )
+
+
+if __name__ == "__main__":
+    main()
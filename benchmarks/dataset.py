@@ -0,0 +1,150 @@
+"""
+A generated catalogue of N trips with M dates, photos, program days,
+features and FAQs each, shared by the API benchmarks and the load test.
+
+Inside a benchmark it fills the throwaway test database; run as a module
+it fills the configured database for a server under `benchmarks.load`:
+
+    python -m benchmarks.dataset --trips 500 --dates 8 --photos 10
+    python -m benchmarks.dataset --clear --trips 0
+"""
+import argparse
+import datetime
+import random
+from dataclasses import asdict, dataclass
+
+
+SLUG_PREFIX = "bench-"
+
+WORDS = (
+    "горы ледник озеро море пляж замок музей вино сыр поход каньон пустыня водопад вулкан "
+    "фьорд остров город собор рынок гастрономия треккинг сафари закат рассвет северное сияние"
+).split()
+
+
+@dataclass
+class Shape:
+    trips: int = 100
+    dates: int = 6
+    photos: int = 8
+    days: int = 7
+    features: int = 5
+    faqs: int = 4
+    reviews: int = 50
+    seed: int = 1
+
+
+def text(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def populate(shape=None, batch_size=1000):
+    """
+    Bulk-creates the catalogue and fills what signals would have: stored
+    trip summaries, the country index and blob counts. Returns the trip ids.
+    """
+    from django.db import transaction
+    from django.db.models.functions import Now
+
+    from agency.blobs import recount
+    from agency.models import (
+        FAQ, CountryIndex, IncludedFeature, ProgramByDay, Review, Sociallink, Trip, TripDate, TripPhoto,
+        booked_seats_subquery, upcoming_summary,
+    )
+
+    shape = shape or Shape()
+    rng = random.Random(shape.seed)
+    countries = [code for code, _ in Trip.COUNTRY_CHOICES]
+    today = datetime.date.today()
+
+    with transaction.atomic():
+        Trip.objects.bulk_create(
+            (
+                Trip(
+                    title=text(rng, 3).capitalize(), slug=f"{SLUG_PREFIX}{i}", country=countries[i % len(countries)],
+                    welcome_message=text(rng, 8), duration_days=rng.randint(3, 14), group_size=rng.choice((8, 12, 16)),
+                    ask_title="Есть вопросы?", description=text(rng, 80),
+                )
+                for i in range(shape.trips)
+            ),
+            batch_size=batch_size,
+        )
+        trips = list(Trip.objects.filter(slug__startswith=SLUG_PREFIX).values_list("id", "group_size"))
+
+        def dates(trip_id, group_size):
+            for _ in range(shape.dates):
+                start = today + datetime.timedelta(days=rng.randint(-60, 540))
+                yield TripDate(
+                    trip_id=trip_id, start_date=start, end_date=start + datetime.timedelta(days=rng.randint(3, 14)),
+                    price=rng.randrange(500, 4000, 50), current_members=rng.randint(0, group_size),
+                    is_special_offer=rng.random() < 0.1,
+                )
+
+        def photos(trip_id):
+            for i in range(shape.photos):
+                kind = "main" if i == 0 else "gallery" if i <= 5 else "slide"
+                yield TripPhoto(trip_id=trip_id, photo=f"trip_{trip_id}/{kind}/{i}.jpg", type=kind, caption=text(rng, 3))
+
+        children = [
+            (TripDate, lambda trip_id, group_size: dates(trip_id, group_size)),
+            (TripPhoto, lambda trip_id, group_size: photos(trip_id)),
+            (ProgramByDay, lambda trip_id, group_size: (
+                ProgramByDay(trip_id=trip_id, day_number=day, title=text(rng, 2), description=text(rng, 40))
+                for day in range(1, shape.days + 1)
+            )),
+            (IncludedFeature, lambda trip_id, group_size: (
+                IncludedFeature(trip_id=trip_id, title=text(rng, 2), description=text(rng, 10))
+                for _ in range(shape.features)
+            )),
+            (FAQ, lambda trip_id, group_size: (
+                FAQ(trip_id=trip_id, question=f"{text(rng, 5)}?", answer=text(rng, 20), order=order)
+                for order in range(shape.faqs)
+            )),
+        ]
+        for model, rows in children:
+            model.objects.bulk_create(
+                (row for trip_id, group_size in trips for row in rows(trip_id, group_size)), batch_size=batch_size,
+            )
+
+        Review.objects.bulk_create(
+            Review(name=f"Клиент {i}", avatar=f"reviews/{i}.jpg", text=text(rng, 30)) for i in range(shape.reviews)
+        )
+        if not Sociallink.objects.exists():
+            Sociallink.objects.create(name="Telegram", url="https://t.me/fierytrips")
+
+        ids = [trip_id for trip_id, _ in trips]
+        Trip.objects.filter(pk__in=ids).update(
+            current_members=booked_seats_subquery(), updated_at=Now(), **upcoming_summary(),
+        )
+        CountryIndex.rebuild()
+        recount()
+    return ids
+
+
+def clear():
+    from agency.models import CountryIndex, Review, Trip
+
+    Trip.objects.filter(slug__startswith=SLUG_PREFIX).delete()
+    Review.objects.filter(name__startswith="Клиент ", avatar__regex=r"^reviews/\d+\.jpg$").delete()
+    CountryIndex.rebuild()
+
+
+def main():
+    from .common import setup
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    for name, value in asdict(Shape()).items():
+        parser.add_argument(f"--{name}", type=int, default=value)
+    parser.add_argument("--clear", action="store_true", help=f"Delete the generated trips ({SLUG_PREFIX}*) first")
+    args = parser.parse_args()
+
+    setup()
+    if args.clear:
+        clear()
+    if args.trips:
+        shape = Shape(**{name: getattr(args, name) for name in asdict(Shape())})
+        print(f"{len(populate(shape))} trips created")
+
+
+if __name__ == "__main__":
+    main()
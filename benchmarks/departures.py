@@ -0,0 +1,110 @@
+"""
+/trips/calendar/: filtering every trip's dates on the client vs the range
+query, without the TripDate indexes (trip_id only) and with them.
+
+    python -m benchmarks.departures --dates 100000
+"""
+import argparse
+import datetime
+import random
+
+from .common import measure, report, setup, test_database
+
+
+def populate(dates, trips):
+    from agency.models import Trip, TripDate
+
+    rng = random.Random(17)
+    countries = [code for code, _ in Trip.COUNTRY_CHOICES]
+    Trip.objects.bulk_create(
+        Trip(
+            title=f"Trip {i}", slug=f"trip-{i}", country=countries[i % len(countries)],
+            welcome_message="-", duration_days=7, group_size=12, ask_title="-", description="-",
+        )
+        for i in range(trips)
+    )
+    trip_ids = list(Trip.objects.values_list("id", flat=True))
+    today = datetime.date.today()
+    TripDate.objects.bulk_create(
+        (
+            TripDate(
+                trip_id=trip_ids[i % len(trip_ids)],
+                start_date=(start := today + datetime.timedelta(days=rng.randrange(-365, 3 * 365))),
+                end_date=start + datetime.timedelta(days=rng.choice((5, 7, 10, 14))),
+                price=rng.randrange(500, 4000, 50),
+                current_members=rng.randrange(0, 13),
+                is_special_offer=rng.random() < 0.1,
+            )
+            for i in range(dates)
+        ),
+        batch_size=2000,
+    )
+
+
+def client_side(window):
+    # What the frontend did: every trip with all of its dates, filtered locally
+    from agency.models import Trip
+
+    date_from, date_to, seats, price_max = window
+    return [
+        trip_date.pk
+        for trip in Trip.objects.prefetch_related("trip_dates")
+        for trip_date in trip.trip_dates.all()
+        if date_from <= trip_date.start_date <= date_to
+        and trip.group_size - trip_date.current_members >= seats
+        and trip_date.price <= price_max
+    ]
+
+
+def calendar(window):
+    from agency.departures import find_departures, group_departures
+
+    date_from, date_to, seats, price_max = window
+    return group_departures(find_departures(date_from, date_to, seats=seats, price_max=price_max))
+
+
+def analyze(connection):
+    # Fresh statistics, so the planner knows the index is selective
+    if connection.vendor in ("sqlite", "postgresql"):
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--dates", type=int, default=100000)
+    parser.add_argument("--trips", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    setup()
+    from django.db import connection
+    from agency.models import TripDate
+
+    june = datetime.date(datetime.date.today().year + 1, 6, 1)
+    window = (june, june + datetime.timedelta(days=14), 4, 1500)
+
+    with test_database():
+        populate(args.dates, args.trips)
+        analyze(connection)
+
+        results = {"client-side": measure(lambda: client_side(window), max(args.repeat // 10, 1), warmup=1)}
+        with connection.schema_editor() as editor:
+            for index in TripDate._meta.indexes:
+                editor.remove_index(TripDate, index)
+        results["no index"] = measure(lambda: calendar(window), args.repeat)
+        with connection.schema_editor() as editor:
+            for index in TripDate._meta.indexes:
+                editor.add_index(TripDate, index)
+        analyze(connection)
+        results["index"] = measure(lambda: calendar(window), args.repeat)
+
+        found = sum(len(country["departures"]) for month in calendar(window) for country in month["countries"])
+        report(
+            f"/trips/calendar/ 15-day window, >= 4 seats, <= 1500: {found} of {args.dates} dates (ms)",
+            results,
+        )
+
+
+if __name__ == "__main__":
+    main()
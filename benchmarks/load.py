@@ -0,0 +1,203 @@
+"""
+HTTP load test of a running server, in the manner of locust: simulated
+users pick weighted tasks, wait a random think time between them and are
+spawned at a fixed rate up to --users.
+
+Fill the server's database with `python -m benchmarks.dataset` first, then:
+
+    python manage.py runserver --noreload
+    python -m benchmarks.load --host http://127.0.0.1:8000 --users 50 --duration 60 --json load.json
+
+    gunicorn travel_agency.wsgi -w 4 --threads 8
+    python -m benchmarks.load --host http://127.0.0.1:8000 --users 200 --spawn-rate 20
+
+Only reads are sent unless --writes is given: trip requests for the
+generated trips (`bench-0` to `bench-<--trips - 1>`) are rate limited per
+IP and phone, and land in the Telegram outbox.
+"""
+import argparse
+import math
+import random
+import statistics
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import quote
+
+import requests
+
+from .common import write_json
+from .dataset import SLUG_PREFIX
+
+
+SEARCH_WORDS = ("ледник", "горы поход", "вино", "озеро", "замок", "северное сияние")
+
+
+class Catalogue:
+    """
+    Trip ids and countries read from the server, for the tasks' URLs.
+    """
+
+    def __init__(self, host, timeout):
+        response = requests.get(
+            f"{host}/trips/", params={"page_size": 100, "fields": "id,country"},
+            headers={"Accept": "application/json"}, timeout=timeout,
+        )
+        response.raise_for_status()
+        trips = response.json()["results"]
+        if not trips:
+            raise SystemExit(f"{host} has no trips, run `python -m benchmarks.dataset` against its database")
+        self.trip_ids = [trip["id"] for trip in trips]
+        countries = requests.get(f"{host}/trips/countries/", headers={"Accept": "application/json"}, timeout=timeout)
+        countries.raise_for_status()
+        self.countries = [country["country"] for country in countries.json()] or ["it"]
+
+
+# name: (weight, method, URL builder), the builder gets (catalogue, rng)
+TASKS = {
+    "trips.list": (10, "GET", lambda catalogue, rng: "/trips/"),
+    "trips.list filtered": (
+        3, "GET", lambda catalogue, rng: f"/trips/?available=1&price_max={rng.randrange(1000, 4000, 500)}",
+    ),
+    "trips.retrieve": (8, "GET", lambda catalogue, rng: f"/trips/{rng.choice(catalogue.trip_ids)}/"),
+    "trips.countries": (4, "GET", lambda catalogue, rng: "/trips/countries/"),
+    "trips.country_trips": (3, "GET", lambda catalogue, rng: f"/trips/countries/{rng.choice(catalogue.countries)}/"),
+    "trips.calendar": (2, "GET", lambda catalogue, rng: "/trips/calendar/"),
+    "trips.search": (2, "GET", lambda catalogue, rng: f"/trips/search/?q={quote(rng.choice(SEARCH_WORDS))}"),
+    "reviews.list": (2, "GET", lambda catalogue, rng: "/reviews/"),
+    "social-links.list": (1, "GET", lambda catalogue, rng: "/social-links/"),
+}
+WRITE_TASKS = {
+    "request.create": (1, "POST", lambda catalogue, rng: "/request/"),
+}
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def add(self, name, latency, ok):
+        with self.lock:
+            self.latencies[name].append(latency)
+            if not ok:
+                self.errors[name] += 1
+
+    def summary(self, elapsed):
+        def summarize(latencies, errors):
+            latencies = sorted(latencies)
+            return {
+                "requests": len(latencies),
+                "errors": errors,
+                "req/s": len(latencies) / elapsed,
+                "avg": statistics.fmean(latencies),
+                "median": statistics.median(latencies),
+                "p95": latencies[math.ceil(len(latencies) * 0.95) - 1],
+                "p99": latencies[math.ceil(len(latencies) * 0.99) - 1],
+                "max": latencies[-1],
+            }
+
+        results = {
+            name: summarize(latencies, self.errors[name])
+            for name, latencies in sorted(self.latencies.items())
+        }
+        everything = [latency for latencies in self.latencies.values() for latency in latencies]
+        if everything:
+            results["total"] = summarize(everything, sum(self.errors.values()))
+        return results
+
+
+class User(threading.Thread):
+    """
+    One simulated visitor with its own connection, until `stop` is set.
+    """
+
+    def __init__(self, number, args, catalogue, tasks, stats, stop):
+        super().__init__(daemon=True)
+        self.number = number
+        self.args = args
+        self.catalogue = catalogue
+        self.tasks = tasks
+        self.stats = stats
+        self.stop = stop
+        self.rng = random.Random(args.seed + number)
+        self.session = requests.Session()
+        self.session.headers["Accept"] = "application/json"
+
+    def request(self, method, url):
+        if method == "POST":
+            payload = {
+                "trip": f"{SLUG_PREFIX}{self.rng.randrange(self.args.trips)}", "name": f"Load {self.number}",
+                "phone": f"+4207{self.rng.randrange(10 ** 8):08d}", "preferred_contact": "tg",
+            }
+            return self.session.post(self.args.host + url, json=payload, timeout=self.args.timeout)
+        return self.session.get(self.args.host + url, timeout=self.args.timeout)
+
+    def run(self):
+        names = list(self.tasks)
+        weights = [self.tasks[name][0] for name in names]
+        while not self.stop.is_set():
+            name = self.rng.choices(names, weights)[0]
+            _, method, url = self.tasks[name]
+            start = time.perf_counter()
+            try:
+                ok = self.request(method, url(self.catalogue, self.rng)).status_code < 400
+            except requests.RequestException:
+                ok = False
+            self.stats.add(name, (time.perf_counter() - start) * 1000, ok)
+            self.stop.wait(self.rng.uniform(self.args.wait_min, self.args.wait_max))
+
+
+def run(args):
+    catalogue = Catalogue(args.host, args.timeout)
+    tasks = {**TASKS, **(WRITE_TASKS if args.writes else {})}
+    stats = Stats()
+    stop = threading.Event()
+    users = []
+
+    start = time.perf_counter()
+    for number in range(args.users):
+        user = User(number, args, catalogue, tasks, stats, stop)
+        user.start()
+        users.append(user)
+        if stop.wait(1 / args.spawn_rate):
+            break
+    stop.wait(max(args.duration - (time.perf_counter() - start), 0))
+    stop.set()
+    for user in users:
+        user.join(args.timeout)
+    return stats.summary(time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="http://127.0.0.1:8000")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--spawn-rate", type=float, default=10, help="Users started per second")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds, spawning included")
+    parser.add_argument("--wait-min", type=float, default=0.5, help="Think time between tasks, seconds")
+    parser.add_argument("--wait-max", type=float, default=2.0)
+    parser.add_argument("--timeout", type=float, default=10)
+    parser.add_argument("--writes", action="store_true", help="Also submit trip requests")
+    parser.add_argument("--trips", type=int, default=100, help="Generated trips the requests are for")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+    args.host = args.host.rstrip("/")
+
+    results = run(args)
+    print(f"{args.host}: {args.users} users, {args.duration:.0f} s, latency in ms")
+    for name, stats in results.items():
+        values = "  ".join(
+            f"{key} {value:8.1f}" if isinstance(value, float) else f"{key} {value:6d}" for key, value in stats.items()
+        )
+        print(f"  {name:<20} {values}")
+
+    if args.json:
+        params = {key: value for key, value in vars(args).items() if key not in ("json", "host")}
+        write_json(args.json, "load", params, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Overhead of the Prometheus metrics (agency/metrics.py): requests through
+the WSGI handler with and without MetricsMiddleware, the cost of one
+observation and of a /metrics scrape.
+
+    python -m benchmarks.metrics --trips 100 --repeat 500
+"""
+import argparse
+from dataclasses import asdict
+
+from .common import measure, report, setup, test_database, write_json
+from .dataset import Shape, populate
+
+
+URLS = ("/trips/", "/trips/{trip_id}/", "/photos/", "/trips/countries/")
+
+
+def handler(middleware):
+    from django.core.handlers.wsgi import WSGIHandler
+    from django.test import RequestFactory, override_settings
+
+    with override_settings(MIDDLEWARE=middleware):
+        application = WSGIHandler()
+    factory = RequestFactory(HTTP_ACCEPT="application/json")
+
+    def start_response(status, headers):
+        assert status == "200 OK", status
+
+    def call(url):
+        response = application(factory.get(url).environ, start_response)
+        b"".join(response)
+        response.close()
+    return call
+
+
+def request_benchmarks(urls, repeat):
+    from django.conf import settings
+
+    with_metrics = list(settings.MIDDLEWARE)
+    without = [name for name in with_metrics if name != "agency.metrics.MetricsMiddleware"]
+    calls = {"without": handler(without), "with": handler(with_metrics)}
+    results = {}
+    for url in urls:
+        for name, call in calls.items():
+            results[f"{url} {name}"] = measure(lambda: call(url), repeat)
+        overhead = results[f"{url} with"]["median"] - results[f"{url} without"]["median"]
+        results[f"{url} with"]["overhead ms"] = overhead
+    return results
+
+
+def micro_benchmarks(repeat):
+    from agency import metrics
+
+    labels = ("TripViewSet.list", "GET", "200")
+    state = metrics.RequestMetrics()
+
+    def observe_1000():
+        for _ in range(1000):
+            metrics.REQUEST_DURATION.observe(labels, 0.012)
+
+    def query_wrapper_1000():
+        token = metrics._current.set(state)
+        execute = lambda sql, params, many, context: None  # noqa: E731
+        for _ in range(1000):
+            metrics.execute_wrapper(execute, "SELECT 1", (), False, {})
+        metrics._current.reset(token)
+
+    return {
+        "observe x1000": measure(observe_1000, repeat),
+        "query wrapper x1000": measure(query_wrapper_1000, repeat),
+        "scrape": measure(metrics.render, repeat),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    for name, value in asdict(Shape(trips=100)).items():
+        parser.add_argument(f"--{name}", type=int, default=value)
+    parser.add_argument("--repeat", type=int, default=300)
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    setup()
+    from django.test import override_settings
+
+    from agency.models import Trip
+
+    shape = Shape(**{name: getattr(args, name) for name in asdict(Shape())})
+    results = {}
+    # The response cache is on: the cheapest requests show the overhead best
+    with test_database(), override_settings(ASYNC_READ_VIEWS=False):
+        populate(shape)
+        trip_id = Trip.objects.values_list("id", flat=True).first()
+        urls = [url.format(trip_id=trip_id) for url in URLS]
+        results["requests"] = request_benchmarks(urls, args.repeat)
+        report("requests: latency ms without and with MetricsMiddleware", results["requests"])
+        results["calls"] = micro_benchmarks(args.repeat // 10 or 1)
+        report("calls: ms", results["calls"])
+
+    if args.json:
+        write_json(args.json, "metrics", {**asdict(shape), "repeat": args.repeat}, results)
+
+
+if __name__ == "__main__":
+    main()
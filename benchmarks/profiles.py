@@ -0,0 +1,134 @@
+"""
+Startup time and per-request overhead of the dev and prod settings profiles.
+
+Every profile runs in its own interpreter. Requests go through the real
+WSGI handler, so connections are closed or kept exactly as in a server.
+The prod profile runs against SQLite unless --postgres is given, then it
+uses the POSTGRES_* and DB_POOL variables of the environment, and needs
+the Redis of REDIS_URL (127.0.0.1:6379 by default).
+
+    python -m benchmarks.profiles --requests 500
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from .common import ROOT, measure, prod_environ, report, setup, test_database
+
+
+PROFILES = {
+    "dev": "travel_agency.settings.dev",
+    "prod": "travel_agency.settings.prod",
+}
+URLS = ("/trips/", "/photos/", "/reviews/")
+
+
+def startup():
+    start = time.perf_counter()
+    setup()
+    from django.core.wsgi import get_wsgi_application
+
+    get_wsgi_application()
+    return (time.perf_counter() - start) * 1000
+
+
+def populate():
+    import datetime
+
+    from agency.models import Review, Trip, TripDate, TripPhoto
+
+    trips = Trip.objects.bulk_create(
+        Trip(
+            title=f"Trip {i}", slug=f"trip-{i}", country="it", welcome_message="-",
+            duration_days=7, group_size=12, ask_title="-", description="-",
+        )
+        for i in range(20)
+    )
+    start = datetime.date.today() + datetime.timedelta(days=30)
+    TripDate.objects.bulk_create(
+        TripDate(trip=trip, start_date=start, end_date=start + datetime.timedelta(days=7), price=1000)
+        for trip in trips
+    )
+    TripPhoto.objects.bulk_create(
+        TripPhoto(trip=trips[i % 20], photo=f"trip_{i}/slide/{i}.jpg", type="slide") for i in range(200)
+    )
+    Review.objects.bulk_create(Review(name=f"Client {i}", avatar="reviews/a.jpg", text="Отлично") for i in range(50))
+
+
+def serve(requests):
+    setup()
+    from django.core.wsgi import get_wsgi_application
+    from django.db.backends.signals import connection_created
+    from django.test import RequestFactory
+
+    opened = []
+    connection_created.connect(lambda sender, connection, **kwargs: opened.append(connection.alias), weak=False)
+
+    with test_database():
+        populate()
+        application = get_wsgi_application()
+        factory = RequestFactory(HTTP_ACCEPT="application/json")
+
+        def start_response(status, headers):
+            assert status == "200 OK", status
+
+        def get(url):
+            def call():
+                response = application(factory.get(url).environ, start_response)
+                b"".join(response)
+                response.close()
+            return call
+
+        results = {}
+        for url in URLS:
+            opened.clear()
+            results[url] = measure(get(url), repeat=requests)
+            results[url]["connects"] = len(opened)
+        return results
+
+
+def child(profile, task, requests, postgres):
+    env = {
+        **os.environ,
+        **prod_environ(),
+        "DJANGO_SETTINGS_MODULE": PROFILES[profile],
+        # The test environment allows "testserver"
+        "DJANGO_ALLOWED_HOSTS": "",
+        # Requests go through the WSGI handler, as wsgi.py sets up
+        "DJANGO_ASYNC_READ_VIEWS": "0",
+    }
+    if not postgres:
+        env["DB_ENGINE"] = "sqlite"
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.profiles", "--child", task, "--requests", str(requests)],
+        cwd=ROOT, env=env, check=True, stdout=subprocess.PIPE, text=True,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--startups", type=int, default=10)
+    parser.add_argument("--postgres", action="store_true")
+    parser.add_argument("--child", choices=("startup", "serve"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = startup() if args.child == "startup" else serve(args.requests)
+        print(json.dumps(result))
+        return
+
+    for profile in PROFILES:
+        timings = sorted(child(profile, "startup", 0, args.postgres) for _ in range(args.startups))
+        print(f"{profile}: django.setup() + WSGI app, median of {args.startups}: {timings[len(timings) // 2]:.1f} ms")
+        results = child(profile, "serve", args.requests, args.postgres)
+        # Connections opened over warmup and measured requests
+        report(f"{profile}: {args.requests} requests, ms", results)
+
+
+if __name__ == "__main__":
+    main()
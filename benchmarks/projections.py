@@ -0,0 +1,83 @@
+"""
+Rows/s of the DRF read serializers against their compiled projections
+(agency/projections.py), over model instances and `.values()` rows.
+
+    python -m benchmarks.projections --trips 500 --repeat 20
+"""
+import argparse
+from dataclasses import asdict
+
+from .common import measure, report, setup, test_database, write_json
+from .dataset import Shape, populate
+
+
+def cases(limit):
+    from django.db.models import Prefetch
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory
+
+    from agency.models import FAQ, IncludedFeature, ProgramByDay, Review, Trip, TripDate, TripPhoto
+    from agency.serializers import ReviewSerializer, TripListSerializer, TripPhotoSerializer, TripRetrieveSerializer
+
+    context = {"request": Request(APIRequestFactory().get("/trips/"))}
+    trips = list(Trip.objects.order_by("-created_at")[:limit].prefetch_related(
+        Prefetch("photos", TripPhoto.objects.filter(type="slide"), to_attr="slide_photos"),
+    ))
+    details = list(Trip.objects.order_by("-created_at")[:limit].prefetch_related(
+        Prefetch("trip_dates", TripDate.objects.all()), Prefetch("photos", TripPhoto.objects.all()),
+        Prefetch("program_by_days", ProgramByDay.objects.all()),
+        Prefetch("included_features", IncludedFeature.objects.all()), Prefetch("faqs", FAQ.objects.all()),
+    ))
+    photos = TripPhoto.objects.order_by("id")[:limit]
+    reviews = Review.objects.order_by("id")[:limit]
+    return context, [
+        # name, serializer, instances, values rows or None
+        ("TripListSerializer", TripListSerializer, trips, None),
+        ("TripRetrieveSerializer", TripRetrieveSerializer, details, None),
+        ("TripPhotoSerializer", TripPhotoSerializer, list(photos), list(photos.values())),
+        ("ReviewSerializer", ReviewSerializer, list(reviews), list(reviews.values())),
+    ]
+
+
+def rows_per_second(func, rows, repeat):
+    stats = measure(func, repeat)
+    return {"rows": rows, "rows/s": rows / stats["median"] * 1000, **stats}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    for name, value in asdict(Shape(trips=200)).items():
+        parser.add_argument(f"--{name}", type=int, default=value)
+    parser.add_argument("--limit", type=int, default=500, help="Rows serialized per call")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    setup()
+    from agency.projections import compile_serializer
+
+    shape = Shape(**{name: getattr(args, name) for name in asdict(Shape())})
+    results = {}
+    with test_database():
+        populate(shape)
+        context, benchmarks = cases(args.limit)
+        for name, serializer_class, instances, values in benchmarks:
+            projection = compile_serializer(serializer_class)
+            results[name] = {
+                "drf": rows_per_second(
+                    lambda: serializer_class(instances, many=True, context=context).data, len(instances), args.repeat,
+                ),
+                "compiled": rows_per_second(lambda: projection.many(instances, context), len(instances), args.repeat),
+            }
+            if values is not None:
+                results[name]["compiled .values()"] = rows_per_second(
+                    lambda: projection.many(values, context), len(values), args.repeat,
+                )
+            report(f"{name}: latency ms of one call", results[name])
+
+    if args.json:
+        write_json(args.json, "projections", {**asdict(shape), "limit": args.limit, "repeat": args.repeat}, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Trip request rate limiting under contention.
+
+Backends: many threads hitting one key, the limit must hold exactly.
+End to end: threads POST /request/, one phone hammering the form among
+well-behaved clients; reports accepted and rejected submissions per second.
+
+    python -m benchmarks.ratelimit --threads 16 --seconds 5
+"""
+import argparse
+import logging
+import threading
+import time
+
+from .common import setup, test_database
+
+
+def hammer(threads, seconds, func):
+    """
+    Calls `func(thread_number, i)` from `threads` threads for `seconds`,
+    returns the list of results.
+    """
+    results, lock = [], threading.Lock()
+    barrier = threading.Barrier(threads)
+    deadline = []
+
+    def run(number):
+        barrier.wait()
+        if not deadline:
+            deadline.append(time.perf_counter() + seconds)
+        local, i = [], 0
+        while time.perf_counter() < deadline[0]:
+            local.append(func(number, i))
+            i += 1
+        with lock:
+            results.extend(local)
+
+    workers = [threading.Thread(target=run, args=(n,)) for n in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return results
+
+
+def backends(threads, seconds):
+    from agency.ratelimit import CacheRateLimitBackend, TokenBucketRateLimitBackend
+
+    limit = 1000
+    for backend in (CacheRateLimitBackend(), TokenBucketRateLimitBackend()):
+        key = f"bench:{time.time()}"
+        results = hammer(threads, seconds, lambda n, i: backend.hit(key, limit, 3600)[0])
+        print(
+            f"  {type(backend).__name__:<28} {len(results) / seconds:>10.0f} checks/s, "
+            f"{results.count(True)} allowed of limit {limit}"
+        )
+
+
+def submissions(threads, seconds):
+    from django.db import connections
+    from rest_framework.test import APIClient
+    from agency.models import Trip
+
+    Trip.objects.create(
+        title="Trip", slug="trip", country="it", welcome_message="-",
+        duration_days=7, group_size=12, ask_title="-", description="-",
+    )
+
+    def submit(number, i):
+        # Thread 0 hammers with one phone, the others are distinct clients
+        phone = "+420777000000" if number == 0 else f"+4207{number:02d}{i:06d}"
+        payload = {"trip": "trip", "name": "Client", "phone": phone, "preferred_contact": "tg"}
+        status = APIClient().post("/request/", payload, format="json", REMOTE_ADDR=f"10.0.{number}.{i % 250}")
+        return number, status.status_code
+
+    try:
+        results = hammer(threads, seconds, submit)
+    finally:
+        connections.close_all()
+
+    abuser = [status for number, status in results if number == 0]
+    others = [status for number, status in results if number != 0]
+    print(f"  total           {len(results) / seconds:>8.1f} submissions/s")
+    for name, statuses in (("hammering phone", abuser), ("other clients", others)):
+        print(
+            f"  {name:<15} {statuses.count(201) / seconds:>8.1f} accepted/s, "
+            f"{statuses.count(429) / seconds:>8.1f} rejected/s"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    setup()
+    from django.test.utils import override_settings
+
+    # Every rejection is logged as a 429 warning
+    logging.getLogger("django.request").setLevel(logging.ERROR)
+
+    with test_database():
+        print(f"backends, {args.threads} threads on one key")
+        backends(args.threads, args.seconds)
+        # The trip-wide limit would cap the whole run, only phone and IP are exercised
+        with override_settings(TRIP_REQUEST_RATES={"trip": None}):
+            print(f"POST /request/, {args.threads} threads")
+            submissions(args.threads, args.seconds)
+
+
+if __name__ == "__main__":
+    main()
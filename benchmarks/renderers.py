@@ -0,0 +1,71 @@
+"""
+Render time and payload size of /trips/ and /trips/<id>/ responses with
+DRF's JSONRenderer, the orjson renderer and MessagePack, plus the gzipped
+size of each body.
+
+    python -m benchmarks.renderers --trips 200 --repeat 200
+"""
+import argparse
+import gzip
+from dataclasses import asdict
+
+from .common import measure, report, setup, test_database, write_json
+from .dataset import Shape, populate
+
+
+def payloads():
+    """
+    response.data of a full /trips/ page and of one trip's detail.
+    """
+    from django.core.cache import caches
+    from rest_framework.test import APIClient
+
+    from agency.models import Trip
+
+    client = APIClient(HTTP_ACCEPT="application/json")
+    trip_id = Trip.objects.order_by("pk").values_list("pk", flat=True).first()
+    data = {}
+    for name, url in (("trips.list", "/trips/?page_size=100"), ("trips.retrieve", f"/trips/{trip_id}/")):
+        caches["default"].clear()
+        data[name] = client.get(url).data
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    for name, value in asdict(Shape(trips=200)).items():
+        parser.add_argument(f"--{name}", type=int, default=value)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    setup()
+    from rest_framework.renderers import JSONRenderer
+
+    from agency.renderers import MessagePackRenderer, ORJSONRenderer, msgpack
+
+    renderers = {"json": JSONRenderer(), "orjson": ORJSONRenderer()}
+    if msgpack is not None:
+        renderers["msgpack"] = MessagePackRenderer()
+
+    shape = Shape(**{name: getattr(args, name) for name in asdict(Shape())})
+    results = {}
+    with test_database():
+        populate(shape)
+        for name, data in payloads().items():
+            results[name] = {}
+            for renderer_name, renderer in renderers.items():
+                body = renderer.render(data, renderer.media_type)
+                results[name][renderer_name] = {
+                    **measure(lambda: renderer.render(data, renderer.media_type), args.repeat),
+                    "KiB": len(body) / 1024,
+                    "gzip KiB": len(gzip.compress(body)) / 1024,
+                }
+            report(f"{name}: render ms, body size", results[name])
+
+    if args.json:
+        write_json(args.json, "renderers", {**asdict(shape), "repeat": args.repeat}, results)
+
+
+if __name__ == "__main__":
+    main()
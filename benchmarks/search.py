@@ -0,0 +1,106 @@
+"""
+/trips/search/: in-memory inverted index vs LIKE scans.
+
+    python -m benchmarks.search --trips 50000
+"""
+import argparse
+import datetime
+import random
+import time
+import tracemalloc
+
+from .common import measure, report, setup, test_database
+
+
+WORDS = (
+    "горы ледник озеро море пляж замок музей вино сыр поход каньон пустыня водопад вулкан "
+    "фьорд остров город собор рынок гастрономия треккинг сафари закат рассвет северное сияние "
+    "mountains glacier lake beach castle museum wine hiking canyon desert waterfall volcano"
+).split()
+
+# Filler vocabulary, so the real words above are selective like in real texts
+FILLER = [f"w{i}" for i in range(5000)]
+
+QUERIES = ["ледник", "горы поход", "северное сияние", "вино сыр замок", "castle"]
+
+
+def text(rng, words):
+    return " ".join(rng.choice(WORDS) if rng.random() < 0.05 else rng.choice(FILLER) for _ in range(words))
+
+
+def populate(trips, seed=1):
+    from agency.models import FAQ, ProgramByDay, Trip, TripDate
+
+    rng = random.Random(seed)
+    countries = [code for code, _ in Trip.COUNTRY_CHOICES]
+    today = datetime.date.today()
+    batch = 2000
+    for offset in range(0, trips, batch):
+        created = Trip.objects.bulk_create(
+            Trip(
+                title=text(rng, 4), slug=f"trip-{i}", country=rng.choice(countries),
+                welcome_message=text(rng, 8), duration_days=rng.randint(2, 20), group_size=12,
+                ask_title="-", description=text(rng, 60),
+            )
+            for i in range(offset, min(offset + batch, trips))
+        )
+        ProgramByDay.objects.bulk_create(
+            ProgramByDay(trip=trip, day_number=day, title=text(rng, 2), description=text(rng, 30))
+            for trip in created for day in (1, 2)
+        )
+        FAQ.objects.bulk_create(FAQ(trip=trip, question=text(rng, 5), answer=text(rng, 15)) for trip in created)
+        TripDate.objects.bulk_create(
+            TripDate(
+                trip=trip, start_date=today + datetime.timedelta(days=rng.randint(1, 365)),
+                end_date=today + datetime.timedelta(days=400), price=rng.randint(300, 3000),
+            )
+            for trip in created for _ in range(2)
+        )
+
+
+def like_search(query):
+    from django.db.models import Q
+    from agency.models import Trip
+
+    condition = Q()
+    for word in query.split():
+        condition &= (
+            Q(title__icontains=word) | Q(description__icontains=word) | Q(welcome_message__icontains=word)
+            | Q(program_by_days__description__icontains=word) | Q(faqs__answer__icontains=word)
+        )
+    return list(Trip.objects.filter(condition).values_list("id", flat=True).distinct())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--trips", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    setup()
+    from agency.search import SearchFilters, TripSearchIndex
+
+    with test_database():
+        populate(args.trips)
+
+        index = TripSearchIndex()
+        start = time.perf_counter()
+        index.build()
+        build_time = time.perf_counter() - start
+        # Separate run, tracemalloc slows the build down several times
+        tracemalloc.start()
+        TripSearchIndex().build()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"index build: {build_time:.2f} s, peak {peak / 2**20:.1f} MiB, {len(index.postings)} tokens")
+
+        filters = SearchFilters(countries={"it", "is"}, price_max=1500)
+        results = {}
+        for query in QUERIES:
+            results[f"{query} / index"] = measure(lambda: index.search(query, filters), args.repeat)
+            results[f"{query} / like"] = measure(lambda: like_search(query), max(3, args.repeat // 5), warmup=1)
+        report(f"search latency, {args.trips} trips (ms)", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+The catalogue snapshot (CATALOGUE_SNAPSHOT) against the ORM path: memory
+the loaded catalogue holds and requests/s of the endpoints it serves.
+
+Requests go through the WSGI handler. Each carries a unique query string,
+so every one misses the response cache and builds its payload.
+
+    python -m benchmarks.snapshot --trips 50 --requests 500
+"""
+import argparse
+import itertools
+import time
+from dataclasses import asdict
+
+from .common import measure_allocations, report, setup, test_database, write_json
+from .dataset import Shape, populate
+
+
+ENDPOINTS = ("/trips/", "/trips/{trip_id}/", "/trips/countries/")
+
+
+def held(load):
+    """
+    Memory still held by what `load` returns, and the time it took in ms.
+    """
+    timing = {}
+
+    def timed():
+        start = time.perf_counter()
+        value = load()
+        timing["load ms"] = (time.perf_counter() - start) * 1000
+        return value
+
+    return {**measure_allocations(timed), **timing}
+
+
+def orm_catalogue():
+    # What the list and detail actions read, for every trip
+    from django.db.models import Prefetch
+
+    from agency.models import FAQ, CountryIndex, IncludedFeature, ProgramByDay, Trip, TripDate, TripPhoto
+
+    return (
+        list(Trip.objects.prefetch_related(
+            Prefetch("trip_dates", TripDate.objects.all()), Prefetch("photos", TripPhoto.objects.all()),
+            Prefetch("program_by_days", ProgramByDay.objects.all()),
+            Prefetch("included_features", IncludedFeature.objects.all()), Prefetch("faqs", FAQ.objects.all()),
+        )),
+        list(CountryIndex.objects.all()),
+    )
+
+
+def payloads():
+    # The same catalogue kept as the serializers' dicts, without records
+    from agency.models import CountryIndex
+    from agency.serializers import CountrySerializer, TripListSerializer, TripRetrieveSerializer
+
+    trips = orm_catalogue()[0]
+    for trip in trips:
+        trip.slide_photos = [photo for photo in trip.photos.all() if photo.type == "slide"]
+    return (
+        [(dict(TripListSerializer(trip).data), dict(TripRetrieveSerializer(trip).data)) for trip in trips],
+        [dict(CountrySerializer(index).data) for index in CountryIndex.objects.all()],
+    )
+
+
+def throughput(url, requests):
+    from django.core.wsgi import get_wsgi_application
+    from django.test import RequestFactory
+
+    application = get_wsgi_application()
+    factory = RequestFactory(HTTP_ACCEPT="application/json")
+    separator = "&" if "?" in url else "?"
+    counter = itertools.count()
+
+    def start_response(status, headers):
+        assert status == "200 OK", status
+
+    def call():
+        response = application(factory.get(f"{url}{separator}nocache={next(counter)}").environ, start_response)
+        b"".join(response)
+        response.close()
+
+    for _ in range(10):
+        call()
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(requests):
+        began = time.perf_counter()
+        call()
+        latencies.append((time.perf_counter() - began) * 1000)
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {"req/s": requests / elapsed, "median": latencies[len(latencies) // 2], "p95": latencies[int(requests * 0.95) - 1]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    for name, value in asdict(Shape(trips=50)).items():
+        parser.add_argument(f"--{name}", type=int, default=value)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    setup()
+    from django.test import override_settings
+
+    from agency import snapshot
+    from agency.cache import CATALOGUE_VERSION_KEY, get_version
+    from agency.models import Trip
+
+    shape = Shape(**{name: getattr(args, name) for name in asdict(Shape())})
+    results = {}
+    with test_database():
+        populate(shape)
+        trip_id = Trip.objects.values_list("id", flat=True).first()
+
+        load = lambda: snapshot.Snapshot.load(get_version(CATALOGUE_VERSION_KEY))  # noqa: E731
+        # Serializer fields and imports built on first use aren't the catalogue
+        orm_catalogue(), payloads(), load()
+        results["memory"] = {
+            "orm": held(orm_catalogue),
+            "payloads": held(payloads),
+            "snapshot": held(load),
+        }
+        report(f"{args.trips} trips loaded: allocations held, load time", results["memory"])
+
+        for enabled, name in ((False, "orm"), (True, "snapshot")):
+            snapshot.reset()
+            with override_settings(CATALOGUE_SNAPSHOT=enabled, ASYNC_READ_VIEWS=False):
+                results[name] = {
+                    url.format(trip_id=trip_id): throughput(url.format(trip_id=trip_id), args.requests)
+                    for url in ENDPOINTS
+                }
+            report(f"{name}: {args.requests} requests missing the response cache, latency ms", results[name])
+
+    if args.json:
+        write_json(args.json, "snapshot", {**asdict(shape), "requests": args.requests}, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Trip request spam scoring over the labelled corpus in fixtures/spam_corpus.jsonl.
+
+Compares the old keyword check, the rule/link scorer and the scorer with
+naive Bayes counts learned from the other folds (k-fold cross validation),
+and times a single score.
+
+    python -m benchmarks.spam --folds 4
+"""
+import argparse
+import json
+import time
+from collections import Counter
+from pathlib import Path
+
+from .common import setup
+
+
+CORPUS = Path(__file__).resolve().parent / "fixtures" / "spam_corpus.jsonl"
+LEGACY_KEYWORDS = ["http", "www", "куплю", "продам"]
+
+
+def load_corpus():
+    with open(CORPUS, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def legacy_is_spam(record):
+    return any(keyword in record["notes"].lower() for keyword in LEGACY_KEYWORDS)
+
+
+def train(records):
+    from agency.spam import get_tokens
+
+    tokens, docs = {}, Counter()
+    for record in records:
+        docs[record["spam"]] += 1
+        for token in get_tokens(record["name"], record["notes"], record["email"]):
+            spam, ham = tokens.get(token, (0, 0))
+            tokens[token] = (spam + record["spam"], ham + (not record["spam"]))
+    return tokens, docs[True], docs[False]
+
+
+def score_kwargs(record):
+    return {key: record[key] for key in ("name", "notes", "email", "phone")}
+
+
+def quality(predictions, records):
+    tp = sum(p and r["spam"] for p, r in zip(predictions, records))
+    fp = sum(p and not r["spam"] for p, r in zip(predictions, records))
+    fn = sum(not p and r["spam"] for p, r in zip(predictions, records))
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {"precision": precision, "recall": recall, "f1": f1, "false+": fp}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--folds", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    setup()
+    from agency.spam import SpamScorer
+
+    records = load_corpus()
+    rules = [(keyword, "keyword", "notes", 1.0) for keyword in LEGACY_KEYWORDS]
+    predictions = {"legacy keywords": [], "rules + links": [], "rules + links + bayes": []}
+    ordered = []
+
+    for fold in range(args.folds):
+        test = records[fold::args.folds]
+        training = [r for i, r in enumerate(records) if i % args.folds != fold]
+        ordered.extend(test)
+
+        plain = SpamScorer(rules)
+        learned = SpamScorer(rules, *train(training))
+        predictions["legacy keywords"].extend(legacy_is_spam(r) for r in test)
+        predictions["rules + links"].extend(plain.score(**score_kwargs(r)).is_spam for r in test)
+        predictions["rules + links + bayes"].extend(learned.score(**score_kwargs(r)).is_spam for r in test)
+
+    spam = sum(r["spam"] for r in records)
+    print(f"{len(records)} requests, {spam} spam, {args.folds}-fold cross validation")
+    for name, predicted in predictions.items():
+        values = "  ".join(f"{key} {value:5.2f}" for key, value in quality(predicted, ordered).items())
+        print(f"  {name:<22} {values}")
+
+    scorer = SpamScorer(rules, *train(records))
+    kwargs = [score_kwargs(r) for r in records]
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        for item in kwargs:
+            scorer.score(**item)
+    elapsed = time.perf_counter() - start
+    print(f"score: {elapsed / (args.repeat * len(records)) * 1e6:.1f} µs per request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Peak memory of a long list: rendered in one piece vs streamed with ?stream=1.
+
+    python -m benchmarks.streaming --rows 50000
+"""
+import argparse
+import time
+import tracemalloc
+
+from .common import setup, test_database
+
+
+def populate(rows):
+    from agency.models import Trip, TripPhoto, TripRequest
+
+    trips = Trip.objects.bulk_create(
+        Trip(
+            title=f"Trip {i}", slug=f"trip-{i}", country="it", welcome_message="-",
+            duration_days=7, group_size=12, ask_title="-", description="-",
+        )
+        for i in range(100)
+    )
+    TripPhoto.objects.bulk_create(
+        (TripPhoto(trip=trips[i % 100], photo=f"trip_{i}/slide/{i}.jpg", type="slide") for i in range(rows)),
+        batch_size=2000,
+    )
+    TripRequest.objects.bulk_create(
+        (
+            TripRequest(
+                trip=trips[i % 100], name=f"Client {i}", phone=f"+3900000{i:05d}",
+                preferred_contact="tg", notes="Хотим в октябре, двое взрослых",
+            )
+            for i in range(rows)
+        ),
+        batch_size=2000,
+    )
+
+
+def rendered(client, url):
+    # The list as it was served before pagination: serializer.data and one JSON string
+    from agency import views
+
+    viewset = {"/photos/": views.TripPhotoViewSet, "/request/": views.TripRequestListCreateViewSet}[url]
+    pagination_class, viewset.pagination_class = viewset.pagination_class, None
+    try:
+        return len(client.get(url).content)
+    finally:
+        viewset.pagination_class = pagination_class
+
+
+def streamed(client, url):
+    response = client.get(url, {"stream": "1"})
+    return sum(len(chunk) for chunk in response.streaming_content)
+
+
+def peak(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - start
+    # Separate run, tracemalloc slows everything down several times
+    tracemalloc.start()
+    size = func(*args)
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size, elapsed, peak_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=50000)
+    args = parser.parse_args()
+
+    setup()
+    from rest_framework.test import APIClient
+
+    with test_database():
+        populate(args.rows)
+        client = APIClient()
+        print(f"{args.rows} rows per list")
+        for url in ("/photos/", "/request/"):
+            for name, func in (("rendered", rendered), ("streamed", streamed)):
+                size, elapsed, peak_bytes = peak(func, client, url)
+                print(f"  {url:<10} {name:<9} body {size / 2**20:6.1f} MiB  "
+                      f"peak {peak_bytes / 2**20:7.1f} MiB  {elapsed:6.2f} s")
+
+
+if __name__ == "__main__":
+    main()
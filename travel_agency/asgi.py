@@ -11,6 +11,8 @@ import os
 
 from django.core.asgi import get_asgi_application
 
-os.environ.setdefault("DJANGO_SETTINGS_MODULE", "travel_agency.settings")
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "travel_agency.settings.prod")
+# Native async reads, see ASYNC_READ_VIEWS
+os.environ.setdefault("DJANGO_ASYNC_READ_VIEWS", "1")
 
 application = get_asgi_application()
@@ -0,0 +1,270 @@
+"""
+Django settings for travel_agency project, shared by every profile:
+`dev` for local work and tests, `prod` for deployments.
+
+Generated by 'django-admin startproject' using Django 5.1.1.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/5.1/topics/settings/
+
+For the full list of settings and their values, see
+https://docs.djangoproject.com/en/5.1/ref/settings/
+"""
+
+import os
+from importlib.util import find_spec
+from pathlib import Path
+
+# Build paths inside the project like this: BASE_DIR / 'subdir'.
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+
+
+# SECRET_KEY, DEBUG and ALLOWED_HOSTS are set by the profiles
+# See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
+
+DEBUG = False
+
+ALLOWED_HOSTS = []
+
+# Application definition
+
+INSTALLED_APPS = [
+    "django.contrib.admin",
+    "django.contrib.auth",
+    "django.contrib.contenttypes",
+    "django.contrib.sessions",
+    "django.contrib.messages",
+    "django.contrib.staticfiles",
+    "rest_framework",
+    "agency",
+]
+
+TELEGRAM_BOT_TOKEN = "ваш_токен"
+TELEGRAM_CHAT_ID = "ваш_чат_id"
+TELEGRAM_API_URL = "https://api.telegram.org"
+
+# Outbox worker, see `manage.py process_outbox`
+TELEGRAM_TRANSPORT = "agency.notifications.TelegramTransport"
+TELEGRAM_OUTBOX_BATCH_SIZE = 50
+TELEGRAM_OUTBOX_MAX_ATTEMPTS = 5
+TELEGRAM_OUTBOX_BACKOFF = 30  # seconds, doubled on every retry
+
+# Resized copies of uploaded photos, see agency/images.py
+IMAGE_VARIANTS = {
+    "thumb": (320, 320),
+    "card": (800, 600),
+    "hero": (1920, 1080),
+}
+# Built by `manage.py generate_image_variants --watch`; IMAGE_PROCESSING_POOL
+# builds them in a process pool of the web process instead (runserver)
+IMAGE_PROCESSING_WORKERS = 2
+IMAGE_PROCESSING_POOL = False
+IMAGE_PROCESSING_SYNC = False  # build in the request, for tests and debugging
+
+# Rendered /trips/ responses, see agency/cache.py
+TRIP_CACHE_ALIAS = "default"
+TRIP_CACHE_TIMEOUT = 60 * 60
+
+# Trip request submissions, see agency/throttles.py
+RATE_LIMIT_BACKEND = "agency.ratelimit.CacheRateLimitBackend"
+RATE_LIMIT_CACHE_ALIAS = "default"
+TRIP_REQUEST_RATES = {
+    "phone": "3/hour",
+    "ip": "20/hour",
+    "trip": "100/hour",
+}
+
+# Spam scoring of trip requests, see agency/spam.py; rules are edited in the admin
+SPAM_THRESHOLD = 1.0
+SPAM_SIGNAL_WEIGHTS = {
+    "links": 2.0,
+    "duplicate_phone": 0.25,
+    "bayes": 1.5,
+}
+SPAM_BAYES_MIN_DOCS = 5  # marked requests of each kind before Bayes kicks in
+SPAM_RULES_CHECK_INTERVAL = 5  # seconds between checks for changed rules
+
+# Native async GET views for /trips/, /trips/<id>/, /trips/countries/ and
+# /reviews/, see agency.views.AsyncReadMixin. Under WSGI (runserver too)
+# every such request would run its own event loop, so only asgi.py turns
+# them on
+ASYNC_READ_VIEWS = os.environ.get("DJANGO_ASYNC_READ_VIEWS", "0") == "1"
+
+# Serve /trips/, /trips/<id>/ and /trips/countries/ from a per-worker copy
+# of the catalogue reloaded on every catalogue change, see agency/snapshot.py
+CATALOGUE_SNAPSHOT = os.environ.get("DJANGO_CATALOGUE_SNAPSHOT", "0") == "1"
+
+# JSON through orjson, and application/msgpack for the mobile app when
+# msgpack is installed, picked by Accept; see agency/renderers.py
+REST_FRAMEWORK = {
+    # Reverse proxies in front of the app: X-Forwarded-For is only trusted
+    # that far, with none the client IP of the rate limits is REMOTE_ADDR
+    "NUM_PROXIES": int(os.environ.get("DJANGO_NUM_PROXIES", "0")),
+    "DEFAULT_RENDERER_CLASSES": [
+        "agency.renderers.ORJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+        *(["agency.renderers.MessagePackRenderer"] if find_spec("msgpack") else []),
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        "agency.parsers.ORJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+        *(["agency.parsers.MessagePackParser"] if find_spec("msgpack") else []),
+    ],
+}
+
+# Prometheus metrics on /metrics, see agency/metrics.py. With several
+# worker processes each writes its samples to METRICS_DIR, /metrics adds
+# them up; METRICS_TOKEN requires "Authorization: Bearer <token>", without
+# it /metrics is a 404 unless METRICS_PUBLIC
+METRICS_DIR = os.environ.get("DJANGO_METRICS_DIR") or None
+METRICS_FLUSH_INTERVAL = 5  # seconds
+METRICS_TOKEN = os.environ.get("DJANGO_METRICS_TOKEN") or None
+METRICS_PUBLIC = False
+
+# SELECTs slower than SLOW_QUERY_THRESHOLD_MS go with their EXPLAIN plan to
+# SLOW_QUERY_LOG, SLOW_QUERY_SAMPLE_RATE of them; see agency/slow_queries.py
+# and `manage.py slow_query_report`
+SLOW_QUERY_LOG = os.environ.get("DJANGO_SLOW_QUERY_LOG") or None
+SLOW_QUERY_THRESHOLD_MS = float(os.environ.get("DJANGO_SLOW_QUERY_THRESHOLD_MS", "200"))
+SLOW_QUERY_SAMPLE_RATE = float(os.environ.get("DJANGO_SLOW_QUERY_SAMPLE_RATE", "1"))
+# Parameters of the logged SELECTs; off, they may hold customer data
+SLOW_QUERY_LOG_PARAMS = os.environ.get("DJANGO_SLOW_QUERY_LOG_PARAMS", "0") == "1"
+SLOW_QUERY_LOG_MAX_BYTES = 10 * 1024 * 1024
+SLOW_QUERY_LOG_BACKUPS = 5
+
+# Unfiltered admin changelists of bigger tables show the row count from
+# the database statistics, see agency/pagination.py; sqlite needs ANALYZE
+ADMIN_ESTIMATED_COUNT_THRESHOLD = 10_000
+
+# Cache-Control of /trips/ responses, see agency/http_cache.py; the CDN
+# keeps them for s-maxage and is purged on edits by CDN_PURGE_BACKEND
+CATALOGUE_CACHE_CONTROL = {
+    "public": True,
+    "max_age": 60,
+    "s_maxage": 600,
+    "stale_while_revalidate": 60,
+}
+CDN_PURGE_BACKEND = "agency.cdn.NullPurgeBackend"
+CDN_PURGE_OPTIONS = {}
+
+# Widest date window of /trips/calendar/ in days, see agency/departures.py
+CALENDAR_MAX_DAYS = 366
+
+MIDDLEWARE = [
+    "agency.metrics.MetricsMiddleware",
+    "django.middleware.security.SecurityMiddleware",
+    "django.contrib.sessions.middleware.SessionMiddleware",
+    "django.middleware.common.CommonMiddleware",
+    "django.middleware.csrf.CsrfViewMiddleware",
+    "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "django.contrib.messages.middleware.MessageMiddleware",
+    "django.middleware.clickjacking.XFrameOptionsMiddleware",
+]
+
+ROOT_URLCONF = "travel_agency.urls"
+
+TEMPLATES = [
+    {
+        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        "DIRS": [os.path.join(BASE_DIR, "templates")],
+        "APP_DIRS": True,
+        "OPTIONS": {
+            "context_processors": [
+                "django.template.context_processors.debug",
+                "django.template.context_processors.request",
+                "django.contrib.auth.context_processors.auth",
+                "django.contrib.messages.context_processors.messages",
+            ],
+        },
+    },
+]
+
+WSGI_APPLICATION = "travel_agency.wsgi.application"
+
+
+# Database
+# https://docs.djangoproject.com/en/5.1/ref/settings/#databases
+
+DATABASES = {
+    "default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / "db.sqlite3",
+        # Writers wait for each other instead of failing with "database is locked"
+        "OPTIONS": {
+            "transaction_mode": "IMMEDIATE",
+            "timeout": 20,
+        },
+        # On disk, an in-memory test database can't be shared between threads
+        "TEST": {
+            "NAME": BASE_DIR / "test_db.sqlite3",
+        },
+    }
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+}
+
+
+# Password validation
+# https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
+
+AUTH_PASSWORD_VALIDATORS = [
+    {
+        "NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator",
+    },
+    {
+        "NAME": "django.contrib.auth.password_validation.MinimumLengthValidator",
+    },
+    {
+        "NAME": "django.contrib.auth.password_validation.CommonPasswordValidator",
+    },
+    {
+        "NAME": "django.contrib.auth.password_validation.NumericPasswordValidator",
+    },
+]
+
+
+# Internationalization
+# https://docs.djangoproject.com/en/5.1/topics/i18n/
+
+LANGUAGE_CODE = "en-us"
+
+TIME_ZONE = "UTC"
+
+USE_I18N = True
+
+USE_TZ = True
+
+
+# Static files (CSS, JavaScript, Images)
+# https://docs.djangoproject.com/en/5.1/howto/static-files/
+
+STATICFILES_DIRS = [
+    BASE_DIR / "static"
+]
+
+STATIC_URL = "static/"
+
+MEDIA_URL = "/media/"
+MEDIA_ROOT = os.path.join(BASE_DIR, "media")
+
+# Media is stored once per content under blobs/, see agency/storage.py;
+# `manage.py gc_media` removes blobs unused for MEDIA_GC_GRACE_HOURS
+STORAGES = {
+    "default": {"BACKEND": "agency.storage.LocalBlobStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+MEDIA_GC_GRACE_HOURS = 24
+
+# Default primary key field type
+# https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
+
+DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
@@ -0,0 +1,32 @@
+"""
+Local development and tests: SQLite, DEBUG and the debug toolbar.
+"""
+
+import mimetypes
+
+from .base import *  # noqa: F401,F403
+
+
+# SECURITY WARNING: keep the secret key used in production secret!
+SECRET_KEY = "django-insecure-g!$i%qj4(p(ek&ty4vgt+#0+h8)s$@2a9qb0mb(88=q_)(gtz4"
+
+# SECURITY WARNING: don't run with debug turned on in production!
+DEBUG = True
+
+INTERNAL_IPS = [
+    "localhost",
+    "127.0.0.1",
+]
+
+INSTALLED_APPS = INSTALLED_APPS + ["debug_toolbar"]  # noqa: F405
+
+MIDDLEWARE = MIDDLEWARE[:1] + ["debug_toolbar.middleware.DebugToolbarMiddleware"] + MIDDLEWARE[1:]  # noqa: F405
+
+# No image worker needed locally, see agency/images.py
+IMAGE_PROCESSING_POOL = True
+
+# /metrics without a token
+METRICS_PUBLIC = True
+
+# for Django debug toolbar
+mimetypes.add_type("application/javascript", ".js", True)
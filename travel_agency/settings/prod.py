@@ -0,0 +1,154 @@
+"""
+Deployments: everything environment-specific comes from the environment.
+
+    DJANGO_SECRET_KEY       required
+    DJANGO_ALLOWED_HOSTS    comma separated
+    DJANGO_NUM_PROXIES      reverse proxies in front of the app (nginx, a load balancer),
+                            X-Forwarded-For is trusted that far for the client IP, 0
+    DB_ENGINE               "postgresql" (default) or "sqlite"
+    POSTGRES_DB, POSTGRES_USER, POSTGRES_PASSWORD, POSTGRES_HOST, POSTGRES_PORT
+    DB_POOL                 "psycopg" - pool inside every worker (psycopg[pool]),
+                            "pgbouncer" - an external transaction pooler,
+                            empty - one persistent connection per worker thread
+    DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE
+    DB_CONN_MAX_AGE         seconds a persistent connection is reused, 60
+    REDIS_URL               required, shared cache for rate limits, spam rules and /trips/
+    TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID
+                            required, where `process_outbox` sends the trip requests
+    TELEGRAM_API_URL        https://api.telegram.org by default
+    DJANGO_STATIC_ROOT      where `collectstatic` puts files for the web server
+    FASTLY_SERVICE_ID, FASTLY_API_TOKEN
+                            purge edited trips from the Fastly CDN
+    MEDIA_S3_ENDPOINT_URL   media in an S3-compatible bucket instead of MEDIA_ROOT,
+    MEDIA_S3_BUCKET, MEDIA_S3_ACCESS_KEY, MEDIA_S3_SECRET_KEY,
+    MEDIA_S3_REGION, MEDIA_S3_PUBLIC_URL
+    DJANGO_METRICS_DIR      shared by the worker processes, /metrics adds up their samples
+    DJANGO_METRICS_TOKEN    bearer token the Prometheus scraper sends to /metrics,
+                            without it /metrics is a 404
+    DJANGO_SLOW_QUERY_LOG   file for slow SELECTs and their plans, off by default,
+    DJANGO_SLOW_QUERY_THRESHOLD_MS, DJANGO_SLOW_QUERY_SAMPLE_RATE
+    DJANGO_SLOW_QUERY_LOG_PARAMS
+                            "1" writes the parameters of the slow SELECTs too,
+                            customer data included
+"""
+
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .base import *  # noqa: F401,F403
+
+
+def env(name, default=None):
+    value = os.environ.get(name) or default
+    if value is None:
+        raise ImproperlyConfigured(f"Set the {name} environment variable.")
+    return value
+
+
+SECRET_KEY = env("DJANGO_SECRET_KEY")
+
+DEBUG = False
+
+ALLOWED_HOSTS = [host.strip() for host in env("DJANGO_ALLOWED_HOSTS", "").split(",") if host.strip()]
+
+
+# Database
+# Connections outlive requests, a broken one is replaced before use
+# instead of failing the request
+
+DB_POOL = env("DB_POOL", "")
+
+if env("DB_ENGINE", "postgresql") == "postgresql":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": env("POSTGRES_DB"),
+            "USER": env("POSTGRES_USER", ""),
+            "PASSWORD": env("POSTGRES_PASSWORD", ""),
+            "HOST": env("POSTGRES_HOST", ""),
+            "PORT": env("POSTGRES_PORT", ""),
+            "OPTIONS": {},
+        }
+    }
+    if DB_POOL == "psycopg":
+        DATABASES["default"]["OPTIONS"]["pool"] = {
+            "min_size": int(env("DB_POOL_MIN_SIZE", "2")),
+            "max_size": int(env("DB_POOL_MAX_SIZE", "10")),
+        }
+    elif DB_POOL == "pgbouncer":
+        # Server-side cursors of .iterator() don't survive transaction pooling
+        DATABASES["default"]["DISABLE_SERVER_SIDE_CURSORS"] = True
+
+# The pool owns the connections: Django gives them back after every request
+DATABASES["default"]["CONN_MAX_AGE"] = 0 if DB_POOL == "psycopg" else int(env("DB_CONN_MAX_AGE", "60"))
+DATABASES["default"]["CONN_HEALTH_CHECKS"] = True
+
+
+# Cache
+# Shared by every worker: a per-process cache would give each one its own
+# rate limits and stale spam rules and /trips/ versions
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": env("REDIS_URL"),
+    }
+}
+
+
+# Telegram notifications
+
+TELEGRAM_BOT_TOKEN = env("TELEGRAM_BOT_TOKEN")
+TELEGRAM_CHAT_ID = env("TELEGRAM_CHAT_ID")
+TELEGRAM_API_URL = env("TELEGRAM_API_URL", TELEGRAM_API_URL)  # noqa: F405
+
+
+# CDN
+
+if os.environ.get("FASTLY_SERVICE_ID"):
+    CDN_PURGE_BACKEND = "agency.cdn.FastlyPurgeBackend"
+    CDN_PURGE_OPTIONS = {
+        "service_id": env("FASTLY_SERVICE_ID"),
+        "token": env("FASTLY_API_TOKEN"),
+    }
+
+
+# Media
+
+if os.environ.get("MEDIA_S3_ENDPOINT_URL"):
+    STORAGES = {
+        **STORAGES,  # noqa: F405
+        "default": {
+            "BACKEND": "agency.storage.S3BlobStorage",
+            "OPTIONS": {
+                "endpoint_url": env("MEDIA_S3_ENDPOINT_URL"),
+                "bucket": env("MEDIA_S3_BUCKET"),
+                "access_key": env("MEDIA_S3_ACCESS_KEY"),
+                "secret_key": env("MEDIA_S3_SECRET_KEY"),
+                "region": env("MEDIA_S3_REGION", "us-east-1"),
+                "public_url": os.environ.get("MEDIA_S3_PUBLIC_URL"),
+            },
+        },
+    }
+
+
+# Static files are served by the web server, media too unless it's in S3
+
+STATIC_ROOT = env("DJANGO_STATIC_ROOT", str(BASE_DIR / "staticfiles"))  # noqa: F405
+
+REST_FRAMEWORK = {
+    **REST_FRAMEWORK,  # noqa: F405
+    # No browsable API: its forms query every related trip
+    "DEFAULT_RENDERER_CLASSES": [
+        renderer for renderer in REST_FRAMEWORK["DEFAULT_RENDERER_CLASSES"]  # noqa: F405
+        if renderer != "rest_framework.renderers.BrowsableAPIRenderer"
+    ],
+}
+
+
+# Security
+
+SECURE_PROXY_SSL_HEADER = ("HTTP_X_FORWARDED_PROTO", "https")
+SESSION_COOKIE_SECURE = True
+CSRF_COOKIE_SECURE = True